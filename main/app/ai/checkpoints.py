@@ -0,0 +1,115 @@
+"""
+Per-stage progress of a request, so failed or interrupted requests
+resume where they stopped.
+
+A request goes through these stages:
+
+- terms: search terms from Perplexity (skipped in single-hop mode)
+- urls: image URLs from the search providers
+- downloads: accepted images in the request folder
+- delivered: email (attachments or bundle link) sent
+
+The checkpoint records the completed stages and their outputs: the
+terms and URL list once their stream is exhausted, and every accepted
+or rejected image as it happens. On a retry or after a worker restart
+the pipeline takes the recorded outputs instead of redoing the stage:
+complete term / URL lists are reused, images already on disk are kept
+and URLs already tried are not fetched again, and a request whose email
+went out is not emailed twice.
+
+Checkpoints are stored by the request service (see
+DatabaseManager.save_checkpoint); on_change is called after every
+update so the pipeline doesn't need to know where.
+"""
+
+import json
+import os
+from dataclasses import dataclass, field, fields
+from typing import Callable, List, Optional
+
+STAGES = ("terms", "urls", "downloads", "delivered")
+
+
+@dataclass
+class RequestCheckpoint:
+    """Progress of one request"""
+    request_id: str
+    user_id: str = ""
+    prompt: str = ""
+    num_images: int = 0
+    mode: str = "async"
+    status: str = "pending"
+    error: Optional[str] = None
+    # Completed stages, see STAGES
+    completed: List[str] = field(default_factory=list)
+    terms: List[str] = field(default_factory=list)
+    urls: List[str] = field(default_factory=list)
+    # [index, url, path] of accepted images
+    images: List[list] = field(default_factory=list)
+    # URLs downloaded already, whether accepted or not
+    tried: List[str] = field(default_factory=list)
+    # First unused image index; file names are numbered by index
+    next_index: int = 0
+    on_change: Optional[Callable[[], None]] = field(
+        default=None, repr=False, compare=False
+    )
+
+    def done(self, stage: str) -> bool:
+        return stage in self.completed
+
+    def complete(self, stage: str):
+        if stage not in self.completed:
+            self.completed.append(stage)
+        self.save()
+
+    def save(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    def record_terms(self, terms: List[str]):
+        self.terms = list(terms)
+        self.complete("terms")
+
+    def record_urls(self, urls: List[str]):
+        self.urls = list(urls)
+        self.complete("urls")
+
+    def record_image(self, index: int, url: str, path: Optional[str]):
+        """Record a downloaded image; path is None if it was rejected"""
+        self.tried.append(url)
+        self.next_index = max(self.next_index, index + 1)
+        if path is not None:
+            self.images.append([index, url, path])
+        self.save()
+
+    def image_paths(self) -> List[str]:
+        """Accepted images that are still on disk, in discovery order"""
+        return [path for path in self.recorded_image_paths() if os.path.exists(path)]
+
+    def recorded_image_paths(self) -> List[str]:
+        """
+        Accepted images in discovery order, whether or not they are on
+        this node's disk (with remote storage they are in the bucket)
+        """
+        return [path for _, _, path in sorted(self.images)]
+
+    def move_images(self, old_folder: str, new_folder: str):
+        """Point the recorded images inside old_folder at new_folder"""
+        old_folder = os.path.abspath(old_folder)
+        for image in self.images:
+            path = os.path.abspath(image[2])
+            if os.path.commonpath([old_folder, path]) == old_folder:
+                image[2] = os.path.join(new_folder, os.path.relpath(path, old_folder))
+
+    def to_json(self) -> str:
+        # Not asdict(): that would deep-copy whatever on_change is bound to
+        return json.dumps({
+            f.name: getattr(self, f.name)
+            for f in fields(self) if f.name != "on_change"
+        })
+
+    @classmethod
+    def from_json(cls, text: str) -> "RequestCheckpoint":
+        names = {f.name for f in fields(cls)} - {"on_change"}
+        data = json.loads(text)
+        return cls(**{key: value for key, value in data.items() if key in names})
@@ -1,13 +1,63 @@
 import os
 import asyncio
+import mimetypes
+import time
 import aiohttp
-import re
-from typing import List
+from contextlib import aclosing
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Optional, Union
+from urllib.parse import urlparse
 from dotenv import load_dotenv
 
+from ..core.config import settings
+from ..utils.download_layout import request_folder
+from ..utils.storage import key_for, storage
+from .checkpoints import RequestCheckpoint
+from .quota_manager import quota_manager, QuotaExhaustedError
+from .resilience import get_provider_guard, CircuitOpenError
+from .providers import (
+    MOCK_IMAGE_HOST, MockProvider, PerplexityImagesProvider, ProviderError,
+    get_provider_class, normalize_image_url, stream_image_search
+)
+from .image_validation import (
+    PerceptualDeduplicator, get_process_pool, validate_and_hash
+)
+from .term_parser import (
+    SEARCH_TERMS_SCHEMA, StreamingTermParser, iter_sse_content,
+    parse_search_terms
+)
+
 # Load environment variables
 load_dotenv()
 
+
+# File extensions for the accepted image content types
+IMAGE_CONTENT_TYPES = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/webp': '.webp',
+    'image/avif': '.avif',
+    'image/bmp': '.bmp',
+}
+
+
+class DownloadRejected(Exception):
+    """A remote file that is not an acceptable image"""
+    pass
+
+
+@dataclass
+class DownloadedImage:
+    """A file produced by the download stage"""
+    url: str
+    path: str
+    # True for generated stand-ins that are not real downloads
+    placeholder: bool = False
+    bytes: int = 0
+    seconds: float = 0.0
+
+
 class PerplexityImageDownloader:
     """
     A class to download images based on user requests.
@@ -16,44 +66,36 @@ class PerplexityImageDownloader:
     an image search service to find and download relevant images.
     """
 
-    def __init__(self):
+    def __init__(self, single_hop: Optional[bool] = None):
+        """
+        Args:
+            single_hop: Take image URLs straight from a Perplexity completion
+                made with return_images instead of asking for search terms
+                first. Defaults to settings.perplexity_single_hop.
+        """
         self.api_key = os.environ.get("PERPLEXITY_API_KEY")
         if not self.api_key:
             raise ValueError("PERPLEXITY_API_KEY environment variable is not set")
 
-        self.perplexity_base_url = "https://api.perplexity.ai/chat/completions"
+        self.perplexity_base_url = f"{settings.perplexity_api_base}/chat/completions"
+        self.single_hop = settings.perplexity_single_hop if single_hop is None else single_hop
         self.session = None
+        self.last_pipeline_stats = {}
 
     async def __aenter__(self):
-        self.session = aiohttp.ClientSession()
+        # Bounded timeouts so a slow provider trips its circuit breaker
+        # instead of holding the request for aiohttp's 5 minute default
+        timeout = aiohttp.ClientTimeout(
+            total=settings.external_request_timeout,
+            connect=settings.external_connect_timeout
+        )
+        self.session = aiohttp.ClientSession(timeout=timeout)
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         if self.session:
             await self.session.close()
 
-    async def search_and_download_images(self, query: str, num_images: int = 10) -> List[str]:
-        """
-        Search for images based on the query and download them.
-
-        Args:
-            query: The search query for images
-            num_images: Number of images to download (default 10)
-
-        Returns:
-            List of file paths to downloaded images
-        """
-        # Use Perplexity to get search terms or related topics
-        search_terms = await self.get_search_terms_from_perplexity(query)
-
-        # Use search terms to find image URLs
-        image_urls = await self.search_for_image_urls(search_terms, num_images)
-
-        # Download the images
-        downloaded_paths = await self.download_images(image_urls)
-
-        return downloaded_paths
-
     async def _create_black_square_image(self, filepath: str, size: int = 224):
         """
         Create a black square image and save it to the specified filepath.
@@ -71,7 +113,7 @@ class PerplexityImageDownloader:
         # Save the image
         img.save(filepath)
 
-    async def search_and_download_images(self, query: str, num_images: int = 10, user_name: str = "default_user", request_id: str = "default_request") -> List[str]:
+    async def search_and_download_images(self, query: str, num_images: int = 10, user_name: str = "default_user", request_id: str = "default_request", checkpoint: Optional[RequestCheckpoint] = None) -> List[str]:
         """
         Search for images based on the query and download them.
 
@@ -80,28 +122,279 @@ class PerplexityImageDownloader:
             num_images: Number of images to download (default 10)
             user_name: Name of the user making the request
             request_id: ID of the request
+            checkpoint: Progress of an earlier attempt to resume from;
+                updated as stages complete
 
         Returns:
             List of file paths to downloaded images
         """
-        # Use Perplexity to get search terms or related topics
-        search_terms = await self.get_search_terms_from_perplexity(query)
+        if checkpoint is None:
+            checkpoint = RequestCheckpoint(request_id, prompt=query, num_images=num_images)
+
+        # Images accepted by an earlier attempt are kept
+        kept = checkpoint.image_paths()
+        if len(kept) >= num_images:
+            return kept[:num_images]
+        num_images -= len(kept)
+
+        # Spare URLs replace images rejected by validation / de-duplication
+        search_limit = num_images
+        if settings.image_validation_enabled:
+            search_limit += settings.image_replacement_budget
+
+        if checkpoint.done("urls"):
+            image_urls = [url for url in checkpoint.urls if url not in checkpoint.tried]
+        elif self.single_hop:
+            # One completion returns the image URLs directly
+            image_urls = await self.get_image_urls_from_perplexity(query, search_limit)
+            checkpoint.record_urls(image_urls)
+        else:
+            if checkpoint.done("terms"):
+                search_terms = list(checkpoint.terms)
+            else:
+                # Use Perplexity to get search terms or related topics; terms
+                # are streamed so the image search starts with the first one
+                search_terms = self._checkpointed(
+                    self.stream_search_terms_from_perplexity(query), checkpoint.record_terms
+                )
+
+            # Use search terms to find image URLs, as they are found
+            image_urls = self._checkpointed(
+                self.stream_image_urls(search_terms, search_limit), checkpoint.record_urls,
+                skip=set(checkpoint.tried)
+            )
+
+        # Download each image as soon as its URL is discovered
+        return kept + await self.run_download_pipeline(image_urls, user_name, request_id, num_images, checkpoint)
+
+    @staticmethod
+    async def _checkpointed(items: AsyncIterator[str], record, skip=()) -> AsyncIterator[str]:
+        """
+        Pass a stream through and record it once it is exhausted; streams
+        closed early (enough images) stay unrecorded. Items in skip are
+        recorded but not yielded.
+        """
+        seen = []
+        async with aclosing(items) as stream:
+            async for item in stream:
+                seen.append(item)
+                if item not in skip:
+                    yield item
+        record(seen)
+
+    async def run_download_pipeline(self, image_urls: Union[List[str], AsyncIterator[str]], user_name: str = "default_user", request_id: str = "default_request", num_images: Optional[int] = None, checkpoint: Optional[RequestCheckpoint] = None) -> List[str]:
+        """
+        Download images while their URLs are still being discovered.
+
+        A producer task feeds URLs into a bounded queue and
+        settings.download_concurrency workers download them, so the first
+        image is fetched while later search pages are still in flight. The
+        bounded queue pauses the search when downloads fall behind.
+
+        Downloaded files are validated and perceptually de-duplicated (see
+        image_validation); rejected files are deleted and replaced by the
+        next discovered URL, so image_urls should provide a few spare URLs.
+
+        Args:
+            image_urls: List or async iterator of image URLs
+            user_name: Name of the user making the request
+            request_id: ID of the request
+            num_images: Number of images to keep, defaults to all URLs
+            checkpoint: Records every downloaded image; numbering of the
+                files continues after the ones of earlier attempts
+
+        Returns:
+            List of file paths, in the order the URLs were discovered
+        """
+        folder_path = self._request_folder(user_name, request_id)
+        queue = asyncio.Queue(maxsize=settings.download_queue_size)
+        workers = settings.download_concurrency
+        wanted = num_images if num_images is not None else float('inf')
+        deduplicator = PerceptualDeduplicator(settings.image_dedup_threshold)
+        results = {}
+        state = {"in_flight": 0, "rejected": 0, "bytes": 0}
+        # Downloads only start while accepted + in-flight images are short
+        # of the target, so spare URLs are not fetched needlessly
+        capacity = asyncio.Condition()
+        started = time.monotonic()
+        timings = {}
+
+        async def produce():
+            index = checkpoint.next_index if checkpoint else 0
+            try:
+                if isinstance(image_urls, list):
+                    for url in image_urls:
+                        await queue.put((index, url))
+                        index += 1
+                else:
+                    async with aclosing(image_urls) as urls:
+                        async for url in urls:
+                            await queue.put((index, url))
+                            index += 1
+            except Exception as e:
+                print(f"Image search failed: {str(e)}")
+            # One stop marker per consumer
+            for _ in range(workers):
+                await queue.put(None)
+
+        async def consume():
+            while True:
+                async with capacity:
+                    await capacity.wait_for(
+                        lambda: len(results) >= wanted or len(results) + state["in_flight"] < wanted
+                    )
+                    if len(results) >= wanted:
+                        return
+                    state["in_flight"] += 1
+
+                accepted = False
+                try:
+                    item = await queue.get()
+                    if item is None:
+                        return
+                    index, url = item
+                    image = await self._download_image(index, url, folder_path)
+                    if image is not None:
+                        accepted = await self._accept_image(image, deduplicator)
+                        if accepted:
+                            accepted = await self._store_image(image)
+                        state["bytes"] += image.bytes
+                    if accepted:
+                        results[index] = image.path
+                        timings.setdefault("first_image", time.monotonic() - started)
+                    else:
+                        state["rejected"] += 1
+                    if checkpoint is not None:
+                        checkpoint.record_image(index, url, image.path if accepted else None)
+                finally:
+                    async with capacity:
+                        state["in_flight"] -= 1
+                        capacity.notify_all()
+
+        producer = asyncio.create_task(produce())
+        consumers = [asyncio.create_task(consume()) for _ in range(workers)]
+        try:
+            await asyncio.gather(*consumers)
+        finally:
+            # The producer may still be blocked on a full queue once enough
+            # images have been accepted
+            for task in [producer, *consumers]:
+                task.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+
+        self.last_pipeline_stats = {
+            "images": len(results),
+            "rejected": state["rejected"],
+            "bytes": state["bytes"],
+            "time_to_first_image": timings.get("first_image"),
+            "total_time": time.monotonic() - started,
+        }
+        print(f"Download pipeline finished: {self.last_pipeline_stats}")
+
+        return [results[index] for index in sorted(results)]
+
+    async def _store_image(self, image: "DownloadedImage") -> bool:
+        """
+        Hand an accepted image to the storage backend.
+
+        Returns:
+            False if it could not be stored; the image is then replaced
+            like a rejected one
+        """
+        try:
+            content_type = mimetypes.guess_type(image.path)[0]
+            await storage.save_file(image.path, key_for(image.path), content_type)
+            return True
+        except Exception as e:
+            print(f"Storing image {image.path} failed: {str(e)}")
+            try:
+                os.remove(image.path)
+            except OSError:
+                pass
+            return False
+
+    async def _accept_image(self, image: "DownloadedImage", deduplicator: PerceptualDeduplicator) -> bool:
+        """
+        Validate a downloaded image and drop it if it is broken or a near
+        duplicate of an image already accepted for this request.
+
+        Placeholders (black squares, error notes) are always kept.
+        """
+        if image.placeholder or not settings.image_validation_enabled:
+            return True
+
+        loop = asyncio.get_running_loop()
+        check = await loop.run_in_executor(
+            get_process_pool(), validate_and_hash, image.path, settings.image_hash_method
+        )
+
+        if not check.valid:
+            print(f"Dropping invalid image {image.url}: {check.error}")
+        elif not deduplicator.add(check.hash):
+            print(f"Dropping near-duplicate image {image.url}")
+        else:
+            return True
+
+        try:
+            os.remove(image.path)
+        except OSError:
+            pass
+        return False
+
+    async def get_image_urls_from_perplexity(self, query: str, num_images: int = 10) -> List[str]:
+        """
+        Get image URLs in a single hop from a sonar completion with
+        return_images enabled. If it returns too few images, the rest are
+        topped up from the image search providers using the query itself.
+
+        Args:
+            query: The search query for images
+            num_images: Number of image URLs wanted
+
+        Returns:
+            List of image URLs
+        """
+        try:
+            image_urls = await PerplexityImagesProvider(self.session).search(query, num_images)
+        except Exception as e:
+            print(f"Error getting images from Perplexity: {str(e)}")
+            image_urls = []
 
-        # Use search terms to find image URLs
-        image_urls = await self.search_for_image_urls(search_terms, num_images)
+        if len(image_urls) >= num_images:
+            return image_urls[:num_images]
 
-        # Download the images
-        downloaded_paths = await self.download_images(image_urls, user_name, request_id)
+        print(f"Perplexity returned {len(image_urls)} images, topping up {num_images - len(image_urls)} from image search")
+        seen = {normalize_image_url(url) for url in image_urls}
+        for url in await self.search_for_image_urls([query], num_images):
+            if len(image_urls) >= num_images:
+                break
+            if normalize_image_url(url) not in seen:
+                seen.add(normalize_image_url(url))
+                image_urls.append(url)
 
-        return downloaded_paths
+        return image_urls
 
     async def get_search_terms_from_perplexity(self, query: str) -> List[str]:
         """
         Use Perplexity API to get relevant search terms or topics based on the query.
         """
+        return [term async for term in self.stream_search_terms_from_perplexity(query)]
+
+    async def stream_search_terms_from_perplexity(self, query: str) -> AsyncIterator[str]:
+        """
+        Stream search terms from Perplexity as they are generated.
+
+        The completion is requested as structured JSON output
+        ({"terms": [...]}) with streaming enabled, and each term is yielded
+        as soon as it is complete, so image searches can start while the
+        rest of the answer is still being generated. Falls back to the
+        line-based parser for non-JSON answers and to the original query
+        on errors.
+        """
         headers = {
             "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream"
         }
 
         # Ask Perplexity for related search terms or image suggestions
@@ -112,145 +405,127 @@ class PerplexityImageDownloader:
             "messages": [
                 {"role": "user", "content": search_query}
             ],
-            "temperature": 0.2
+            "temperature": 0.2,
+            "stream": True,
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {"schema": SEARCH_TERMS_SCHEMA}
+            }
         }
 
+        parser = StreamingTermParser()
+        content = []
+
         try:
-            async with self.session.post(self.perplexity_base_url, json=payload, headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-
-                    if 'choices' in data and len(data['choices']) > 0:
-                        content = data['choices'][0]['message']['content']
-
-                        # Extract search terms from the response
-                        # Look for numbered lists or comma-separated terms
-                        # This is a simplified extraction - in practice, you'd need more robust parsing
-                        lines = content.split('\n')
-                        search_terms = []
-
-                        for line in lines:
-                            # Look for lines that might contain search terms
-                            # Remove numbering like "1.", "2.", etc.
-                            cleaned_line = re.sub(r'^\d+\.\s*', '', line.strip())
-                            if len(cleaned_line) > 3:  # At least 3 chars to be meaningful
-                                search_terms.append(cleaned_line)
-
-                        # If no numbered list found, try to split by commas
-                        if not search_terms:
-                            potential_terms = [term.strip() for term in content.split(',')]
-                            search_terms = [term for term in potential_terms if len(term) > 3]
-
-                        return search_terms[:10]  # Return max 10 terms
-                else:
-                    print(f"Perplexity API Error: {response.status}")
-                    return [query]  # Fallback to original query
+            # LLM completions are not hedged: a duplicate costs a full completion
+            async with get_provider_guard("perplexity").breaker.protect(), \
+                    quota_manager.slot("perplexity") as quota, \
+                    self.session.post(self.perplexity_base_url, json=payload, headers=headers) as response:
+                await quota.record(response.status, response.headers)
+                if response.status != 200:
+                    raise ProviderError(f"Perplexity API Error: {response.status}")
+
+                async for delta in iter_sse_content(response):
+                    content.append(delta)
+                    for term in parser.feed(delta):
+                        yield term
+                    if parser.done:
+                        break
+        except (QuotaExhaustedError, CircuitOpenError) as e:
+            print(f"Skipping Perplexity call: {str(e)}")
         except Exception as e:
             print(f"Error getting search terms from Perplexity: {str(e)}")
-            return [query]  # Fallback to original query
 
-    async def search_for_image_urls(self, search_terms: List[str], num_images: int = 10) -> List[str]:
-        """
-        Search for image URLs using search terms.
-        This implementation includes integration with a real image search API.
-        """
-        image_urls = []
-
-        # In a real implementation, you would use an image search API like:
-        # - Google Custom Search API with Image Search
-        # - Unsplash API
-        # - Pexels API
-        # - Bing Image Search API
-        # etc.
-
-        # For this implementation, we'll use Unsplash API as an example
-        # You would need to add UNSPLASH_ACCESS_KEY to your .env file
-        unsplash_access_key = os.environ.get("UNSPLASH_ACCESS_KEY")
-
-        if unsplash_access_key:
-            # Use Unsplash API if available
-            image_urls = await self.search_unsplash_images(search_terms, num_images, unsplash_access_key)
-        else:
-            # Fallback to mock implementation if no image API key is available
-            print("Unsplash API key not found. Using mock implementation.")
-            for term in search_terms:
-                term_clean = re.sub(r'[^\w\s-]', '', term.replace(' ', '_')).lower()
-
-                for i in range(min(3, num_images - len(image_urls))):
-                    if len(image_urls) >= num_images:
-                        break
+        if parser.terms:
+            return
 
-                    # Mock image URL - in reality, you'd get these from an image search API
-                    mock_url = f"https://example-images.com/search?q={term_clean}&img={i+1}.jpg"
-                    image_urls.append(mock_url)
-
-                    if len(image_urls) >= num_images:
-                        break
-
-                if len(image_urls) >= num_images:
-                    break
+        # Not structured output, extract terms from the plain text instead
+        search_terms = parse_search_terms(''.join(content)) or [query]
+        for term in search_terms:
+            yield term
 
-            # If we don't have enough images, try to get more from the original query
-            if len(image_urls) < num_images:
-                original_query_clean = re.sub(r'[^\w\s-]', '', search_terms[0].replace(' ', '_')).lower() if search_terms else 'image'
-                for i in range(len(image_urls), num_images):
-                    mock_url = f"https://example-images.com/search?q={original_query_clean}&img={i+1}.jpg"
-                    image_urls.append(mock_url)
+    async def search_for_image_urls(self, search_terms: Union[List[str], AsyncIterator[str]], num_images: int = 10) -> List[str]:
+        """
+        Search for image URLs using search terms.
 
-        return image_urls[:num_images]
+        See stream_image_urls() for details.
 
-    async def search_unsplash_images(self, search_terms: List[str], num_images: int, access_key: str) -> List[str]:
-        """
-        Search for images using Unsplash API.
+        Returns:
+            List of image URLs
         """
-        unsplash_base_url = "https://api.unsplash.com/search/photos"
-        image_urls = []
+        async with aclosing(self.stream_image_urls(search_terms, num_images)) as urls:
+            return [url async for url in urls]
 
-        for term in search_terms:
-            if len(image_urls) >= num_images:
-                break
-
-            params = {
-                "query": term,
-                "per_page": min(10, num_images - len(image_urls)),  # Up to 10 per request
-                "orientation": "all"
-            }
+    async def stream_image_urls(self, search_terms: Union[List[str], AsyncIterator[str]], num_images: int = 10) -> AsyncIterator[str]:
+        """
+        Search for image URLs using search terms, yielding each URL as soon
+        as it is found.
 
-            headers = {
-                "Authorization": f"Client-ID {access_key}"
-            }
+        Every configured provider from settings.image_search_providers
+        (Unsplash, Pexels, Bing, ...) is queried at once; results are merged
+        and de-duplicated in the order they arrive. Missing images are
+        filled with mock URLs.
 
-            try:
-                async with self.session.get(unsplash_base_url, params=params, headers=headers) as response:
-                    if response.status == 200:
-                        data = await response.json()
-
-                        if 'results' in data:
-                            for photo in data['results']:
-                                if len(image_urls) >= num_images:
-                                    break
-
-                                # Use the regular resolution image (1080px wide)
-                                image_url = photo.get('urls', {}).get('regular', '')
-                                if image_url:
-                                    image_urls.append(image_url)
-                    else:
-                        print(f"Unsplash API Error: {response.status}")
-                        # Fallback to mock URLs if API fails
+        Args:
+            search_terms: List of terms, or an async iterator of terms (e.g.
+                from stream_search_terms_from_perplexity) so searches start
+                as soon as the first term is available
+            num_images: Number of image URLs wanted
+        """
+        found = 0
+        mock = MockProvider(self.session)
+        received_terms = []
+
+        async def tracked_terms():
+            if isinstance(search_terms, list):
+                for term in search_terms:
+                    received_terms.append(term)
+                    yield term
+            else:
+                async for term in search_terms:
+                    received_terms.append(term)
+                    yield term
+
+        providers = [
+            get_provider_class(name)(self.session)
+            for name in settings.image_search_providers
+        ]
+        providers = [provider for provider in providers if provider.is_configured()]
+
+        if providers:
+            async with aclosing(stream_image_search(
+                providers, tracked_terms(), num_images,
+                deadline=settings.image_search_deadline_seconds
+            )) as urls:
+                async for url in urls:
+                    found += 1
+                    yield url
+        else:
+            # Fallback to mock implementation if no image API key is available
+            print("No image search API keys found. Using mock implementation.")
+            async with aclosing(tracked_terms()) as terms:
+                async for term in terms:
+                    for url in await mock.search(term, min(3, num_images - found)):
+                        found += 1
+                        yield url
+                    if found >= num_images:
                         break
-            except Exception as e:
-                print(f"Error searching Unsplash for '{term}': {str(e)}")
-                # Continue with other search terms
 
         # If we still don't have enough images, use mock implementation as fallback
-        if len(image_urls) < num_images:
-            print(f"Only found {len(image_urls)} images from Unsplash, generating mock URLs for remaining {num_images - len(image_urls)} images")
-            original_query_clean = re.sub(r'[^\w\s-]', '', search_terms[0].replace(' ', '_')).lower() if search_terms else 'image'
-            for i in range(len(image_urls), num_images):
-                mock_url = f"https://example-images.com/search?q={original_query_clean}&img={i+1}.jpg"
-                image_urls.append(mock_url)
-
-        return image_urls
+        if found < num_images:
+            print(f"Only found {found} images, generating mock URLs for remaining {num_images - found} images")
+            for url in await mock.search(
+                received_terms[0] if received_terms else 'image',
+                num_images - found, start=found
+            ):
+                yield url
+
+    def _request_folder(self, user_name: str, request_id: str) -> str:
+        """Create and return the folder for a request's images"""
+        # Sharded by request ID, or downloads/user_name/request_id
+        folder_path = request_folder(user_name, request_id)
+        os.makedirs(folder_path, exist_ok=True)
+        return folder_path
 
     async def download_images(self, image_urls: List[str], user_name: str = "default_user", request_id: str = "default_request") -> List[str]:
         """
@@ -264,35 +539,128 @@ class PerplexityImageDownloader:
         Returns:
             List of file paths to downloaded images
         """
-        downloaded_paths = []
+        folder_path = self._request_folder(user_name, request_id)
+        semaphore = asyncio.Semaphore(settings.download_concurrency)
 
-        # Create the folder structure: downloads/user_name/request_id
-        folder_path = os.path.join("downloads", user_name, request_id)
-        os.makedirs(folder_path, exist_ok=True)
+        async def bounded_download(i: int, url: str) -> Optional[DownloadedImage]:
+            async with semaphore:
+                return await self._download_image(i, url, folder_path)
+
+        images = await asyncio.gather(*(
+            bounded_download(i, url) for i, url in enumerate(image_urls)
+        ))
+        return [image.path for image in images if image is not None]
+
+    async def _stream_image(self, i: int, url: str, folder_path: str) -> DownloadedImage:
+        """
+        Stream a remote image to disk in fixed-size chunks.
+
+        The body goes to a temporary file that is renamed into place once
+        complete, so memory use per download is one chunk and no partial
+        file is ever visible under the final name. Transfers are aborted
+        as soon as the Content-Type is not an image or the size exceeds
+        settings.max_image_bytes, whether announced by Content-Length or
+        only noticed while reading.
+
+        Args:
+            i: Index of the image within the request
+            url: Image URL
+            folder_path: Request folder
+
+        Returns:
+            DownloadedImage with the size and transfer time
 
-        for i, url in enumerate(image_urls):
+        Raises:
+            DownloadRejected: If the response is not an acceptable image
+        """
+        max_bytes = settings.max_image_bytes
+        temp_path = os.path.join(folder_path, f".img_{i+1:02d}.part")
+        started = time.monotonic()
+        received = 0
+
+        try:
+            async with self.session.get(url) as response:
+                if response.status != 200:
+                    raise DownloadRejected(f"HTTP {response.status}")
+
+                content_type = response.content_type.lower()
+                extension = IMAGE_CONTENT_TYPES.get(content_type)
+                if extension is None:
+                    raise DownloadRejected(f"Unexpected Content-Type {content_type!r}")
+
+                if response.content_length is not None and response.content_length > max_bytes:
+                    raise DownloadRejected(
+                        f"Content-Length {response.content_length} exceeds {max_bytes} bytes"
+                    )
+
+                with open(temp_path, 'wb') as f:
+                    async for chunk in response.content.iter_chunked(settings.download_chunk_size):
+                        received += len(chunk)
+                        # Content-Length may be missing or wrong
+                        if received > max_bytes:
+                            raise DownloadRejected(f"Body exceeds {max_bytes} bytes")
+                        f.write(chunk)
+
+            filepath = os.path.join(folder_path, f"img_{i+1:02d}{extension}")
+            os.replace(temp_path, filepath)
+        except BaseException:
             try:
-                # Generate a unique filename based on the URL or index
-                filename = f"black_square_img_{i+1:02d}.jpg"
-                filepath = os.path.join(folder_path, filename)
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
 
-                # Create a black square image instead of downloading the actual image
-                await self._create_black_square_image(filepath)
+        seconds = time.monotonic() - started
+        throughput = received / seconds / 1024 if seconds > 0 else 0.0
+        print(f"Downloaded image {i+1}: {filepath} ({received} bytes, {throughput:.0f} KiB/s)")
 
-                print(f"Created black square image {i+1}/{len(image_urls)}: {filepath}")
+        return DownloadedImage(url, filepath, bytes=received, seconds=seconds)
+
+    async def _download_image(self, i: int, url: str, folder_path: str) -> Optional["DownloadedImage"]:
+        """
+        Download a single image into the request folder.
 
-                downloaded_paths.append(filepath)
+        Real downloads that fail or are rejected are not replaced by a
+        placeholder: the pipeline counts them as rejected and takes the
+        next URL instead. Mock URLs, and every URL while
+        settings.download_real_images is off, get a placeholder.
 
+        Args:
+            i: Index of the image within the request
+            url: Image URL
+            folder_path: Request folder
+
+        Returns:
+            DownloadedImage with the path of the downloaded image or of a
+            placeholder file, or None if the download failed
+        """
+        if settings.download_real_images and urlparse(url).hostname != MOCK_IMAGE_HOST:
+            try:
+                return await self._stream_image(i, url, folder_path)
             except Exception as e:
-                print(f"Error processing image from {url}: {str(e)}")
-                # Create a placeholder file even if there's an error
-                error_filename = f"perplexity_error_img_{i+1:02d}.txt"
-                error_filepath = os.path.join(folder_path, error_filename)
-                with open(error_filepath, 'w') as f:
-                    f.write(f"Error downloading image from URL: {url}\nError: {str(e)}\n")
-                downloaded_paths.append(error_filepath)
-
-        return downloaded_paths
+                print(f"Download of image {i+1} from {url} failed: {str(e)}")
+                return None
+
+        try:
+            # Generate a unique filename based on the URL or index
+            filename = f"black_square_img_{i+1:02d}.jpg"
+            filepath = os.path.join(folder_path, filename)
+
+            # Create a black square image instead of downloading the actual image
+            await self._create_black_square_image(filepath)
+
+            print(f"Created black square image {i+1}: {filepath}")
+
+            return DownloadedImage(url, filepath, placeholder=True)
+
+        except Exception as e:
+            print(f"Error processing image from {url}: {str(e)}")
+            # Create a placeholder file even if there's an error
+            error_filename = f"perplexity_error_img_{i+1:02d}.txt"
+            error_filepath = os.path.join(folder_path, error_filename)
+            with open(error_filepath, 'w') as f:
+                f.write(f"Error downloading image from URL: {url}\nError: {str(e)}\n")
+            return DownloadedImage(url, error_filepath, placeholder=True)
 
 
 # Example usage
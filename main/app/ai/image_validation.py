@@ -0,0 +1,238 @@
+"""
+Validation and perceptual de-duplication of downloaded images.
+
+Every downloaded file is first checked cheaply: the magic bytes must
+match a supported image format and the dimensions are read from the
+format header, without decoding any pixel data. Files that pass are
+perceptually hashed (dHash or pHash, vectorized with NumPy) so near
+duplicates, e.g. the same photo at a different size or crop returned
+for two search terms, can be dropped before they are emailed.
+
+The CPU-bound part runs in a process pool; validate_and_hash() is a
+module-level function so it can be pickled to the workers.
+"""
+
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from ..core.config import settings
+
+# Bytes read from the start of a file for header checks
+HEADER_BYTES = 64 * 1024
+
+
+@dataclass
+class ImageCheck:
+    """Result of validating (and hashing) one image file"""
+    path: str
+    valid: bool
+    format: Optional[str] = None
+    width: int = 0
+    height: int = 0
+    hash: Optional[int] = None
+    error: Optional[str] = None
+
+
+def sniff_format(header: bytes) -> Optional[str]:
+    """Identify the image format from its magic bytes"""
+    if header.startswith(b'\xff\xd8\xff'):
+        return "jpeg"
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return "png"
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return "gif"
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return "webp"
+    if header[4:8] == b'ftyp' and header[8:12] in (b'avif', b'avis'):
+        return "avif"
+    if header.startswith(b'BM'):
+        return "bmp"
+    return None
+
+
+def _jpeg_size(header: bytes) -> Optional[Tuple[int, int]]:
+    """Read the frame size from the first SOF marker of a JPEG"""
+    pos = 2
+    while pos + 9 < len(header):
+        if header[pos] != 0xFF:
+            return None
+        marker = header[pos + 1]
+        if marker == 0xFF:
+            # Fill byte
+            pos += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            # Markers without a length field
+            pos += 2
+            continue
+        length = struct.unpack('>H', header[pos + 2:pos + 4])[0]
+        # SOF0..SOF15, except DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack('>HH', header[pos + 5:pos + 9])
+            return width, height
+        pos += 2 + length
+    return None
+
+
+def read_dimensions(fmt: str, header: bytes) -> Optional[Tuple[int, int]]:
+    """Read (width, height) from the format header without decoding"""
+    try:
+        if fmt == "png":
+            return struct.unpack('>II', header[16:24])
+        if fmt == "gif":
+            return struct.unpack('<HH', header[6:10])
+        if fmt == "bmp":
+            width, height = struct.unpack('<ii', header[18:26])
+            return width, abs(height)
+        if fmt == "jpeg":
+            return _jpeg_size(header)
+        if fmt == "webp":
+            chunk = header[12:16]
+            if chunk == b'VP8 ':
+                width, height = struct.unpack('<HH', header[26:30])
+                return width & 0x3FFF, height & 0x3FFF
+            if chunk == b'VP8L':
+                bits = int.from_bytes(header[21:25], 'little')
+                return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+            if chunk == b'VP8X':
+                width = int.from_bytes(header[24:27], 'little') + 1
+                height = int.from_bytes(header[27:30], 'little') + 1
+                return width, height
+        if fmt == "avif":
+            # Dimensions live in the ispe box, which may be anywhere in meta
+            pos = header.find(b'ispe')
+            if pos != -1:
+                return struct.unpack('>II', header[pos + 8:pos + 16])
+    except struct.error:
+        return None
+    return None
+
+
+def _load_grayscale(path: str, width: int, height: int):
+    """Decode an image into a small grayscale NumPy array"""
+    import numpy as np
+    from PIL import Image
+
+    with Image.open(path) as img:
+        # Let the JPEG decoder skip most of the work for a tiny target
+        img.draft('L', (width * 4, height * 4))
+        img = img.convert('L').resize((width, height), Image.BILINEAR)
+        return np.asarray(img, dtype=np.float32)
+
+
+def _pack_bits(bits) -> int:
+    import numpy as np
+
+    return int.from_bytes(np.packbits(bits.flatten()).tobytes(), 'big')
+
+
+def dhash(path: str, hash_size: int = 8) -> int:
+    """Difference hash: sign of horizontal gradients on a tiny image"""
+    pixels = _load_grayscale(path, hash_size + 1, hash_size)
+    return _pack_bits(pixels[:, 1:] > pixels[:, :-1])
+
+
+def _dct_matrix(n: int):
+    import numpy as np
+
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+def phash(path: str, hash_size: int = 8, highfreq_factor: int = 4) -> int:
+    """Perceptual hash: low-frequency DCT coefficients above the median"""
+    import numpy as np
+
+    size = hash_size * highfreq_factor
+    pixels = _load_grayscale(path, size, size)
+    dct = _dct_matrix(size)
+    coefficients = (dct @ pixels @ dct.T)[:hash_size, :hash_size]
+    return _pack_bits(coefficients > np.median(coefficients))
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def validate_and_hash(
+    path: str, method: str = "dhash", min_side: int = 32
+) -> ImageCheck:
+    """
+    Validate an image file and compute its perceptual hash.
+
+    Runs in a worker process.
+    """
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_BYTES)
+    except OSError as e:
+        return ImageCheck(path, False, error=str(e))
+
+    fmt = sniff_format(header)
+    if fmt is None:
+        return ImageCheck(path, False, error="Not a supported image format")
+
+    dimensions = read_dimensions(fmt, header)
+    if dimensions is None:
+        return ImageCheck(path, False, fmt, error="Unreadable image header")
+    width, height = dimensions
+    if min(width, height) < min_side:
+        return ImageCheck(
+            path, False, fmt, width, height,
+            error=f"Image too small ({width}x{height})"
+        )
+
+    try:
+        image_hash = phash(path) if method == "phash" else dhash(path)
+    except Exception as e:
+        return ImageCheck(
+            path, False, fmt, width, height, error=f"Decode failed: {e}"
+        )
+
+    return ImageCheck(path, True, fmt, width, height, image_hash)
+
+
+class PerceptualDeduplicator:
+    """Remembers accepted hashes and flags near duplicates"""
+
+    def __init__(self, threshold: int):
+        self.threshold = threshold
+        self._hashes: List[int] = []
+
+    def add(self, image_hash: int) -> bool:
+        """
+        Record a hash.
+
+        Returns:
+            bool: False if it is within threshold of an accepted hash
+        """
+        for accepted in self._hashes:
+            if hamming_distance(accepted, image_hash) <= self.threshold:
+                return False
+        self._hashes.append(image_hash)
+        return True
+
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Shared process pool for CPU-bound image work, created on first use"""
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=settings.image_worker_processes
+        )
+    return _process_pool
+
+
+def shutdown_process_pool():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
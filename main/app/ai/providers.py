@@ -0,0 +1,420 @@
+"""
+Image search providers and parallel multi-provider aggregation.
+
+Each provider implements ImageSearchProvider.search() for a single term
+and registers itself by name with @register_provider. The aggregator
+queries every configured provider at once, merges results in the order
+they arrive, drops duplicates and stops as soon as enough unique URLs
+are collected or the deadline passes. Whatever is still missing is
+topped up by the mock provider, as before.
+"""
+
+import asyncio
+import os
+import re
+import time
+from abc import ABC, abstractmethod
+from contextlib import aclosing
+from typing import (
+    AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Type, Union
+)
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from ..core.config import settings
+from .quota_manager import quota_manager, QuotaExhaustedError
+from .resilience import get_provider_guard, CircuitOpenError
+
+
+class ProviderError(Exception):
+    """Raised when an external provider returns an error response"""
+
+
+_PROVIDERS: Dict[str, Type["ImageSearchProvider"]] = {}
+
+
+def register_provider(cls: Type["ImageSearchProvider"]):
+    """Class decorator that adds a provider to the registry"""
+    _PROVIDERS[cls.name] = cls
+    return cls
+
+
+def get_provider_class(name: str) -> Type["ImageSearchProvider"]:
+    if name not in _PROVIDERS:
+        raise ValueError(f"Unknown image search provider: {name}")
+    return _PROVIDERS[name]
+
+
+def available_providers() -> List[str]:
+    """Names of all registered providers"""
+    return list(_PROVIDERS)
+
+
+class ImageSearchProvider(ABC):
+    """
+    Base class for image search providers.
+
+    Subclasses set name (the registry key), hedge (whether duplicate
+    requests are cheap and safe) and implement _fetch().
+    """
+
+    name = ""
+    hedge = True
+
+    def __init__(self, session):
+        self.session = session
+
+    def is_configured(self) -> bool:
+        """Whether the provider has the credentials it needs"""
+        return True
+
+    @abstractmethod
+    async def _fetch(self, term: str, count: int, priority: int) -> List[str]:
+        """Fetch up to count image URLs for a term from the provider"""
+
+    async def search(
+        self, term: str, count: int, required: bool = True
+    ) -> List[str]:
+        """
+        Search for up to count image URLs for a term.
+
+        Args:
+            term: Search term
+            count: Maximum number of URLs to return
+            required: False for top-up searches, which are dropped first
+                when the provider's quota runs low
+
+        Returns:
+            List of image URLs
+        """
+        async def attempt(number: int) -> List[str]:
+            # Hedged duplicates are always optional
+            priority = 0 if required and number == 0 else 1
+            urls = await self._fetch(term, count, priority)
+            return [url for url in urls if url][:count]
+
+        return await get_provider_guard(self.name).call(
+            attempt, hedge=self.hedge
+        )
+
+    async def _get_json(
+        self, url: str, priority: int, params: dict, headers: dict
+    ) -> dict:
+        """GET a JSON document through the provider's quota"""
+        async with quota_manager.slot(self.name, priority) as quota, \
+                self.session.get(url, params=params, headers=headers) as response:
+            await quota.record(response.status, response.headers)
+            if response.status != 200:
+                raise ProviderError(
+                    f"{self.name.capitalize()} API Error: {response.status}"
+                )
+            return await response.json()
+
+
+@register_provider
+class UnsplashProvider(ImageSearchProvider):
+    name = "unsplash"
+
+    @property
+    def search_url(self) -> str:
+        return f"{settings.unsplash_api_base}/search/photos"
+
+    def is_configured(self) -> bool:
+        return bool(os.environ.get("UNSPLASH_ACCESS_KEY"))
+
+    async def _fetch(self, term: str, count: int, priority: int) -> List[str]:
+        data = await self._get_json(
+            self.search_url, priority,
+            params={
+                "query": term,
+                "per_page": min(10, count),  # Up to 10 per request
+                "orientation": "all"
+            },
+            headers={
+                "Authorization":
+                    f"Client-ID {os.environ.get('UNSPLASH_ACCESS_KEY')}"
+            }
+        )
+        # Use the regular resolution image (1080px wide)
+        return [
+            photo.get('urls', {}).get('regular', '')
+            for photo in data.get('results', [])
+        ]
+
+
+@register_provider
+class PexelsProvider(ImageSearchProvider):
+    name = "pexels"
+
+    @property
+    def search_url(self) -> str:
+        return f"{settings.pexels_api_base}/v1/search"
+
+    def is_configured(self) -> bool:
+        return bool(os.environ.get("PEXELS_API_KEY"))
+
+    async def _fetch(self, term: str, count: int, priority: int) -> List[str]:
+        data = await self._get_json(
+            self.search_url, priority,
+            params={"query": term, "per_page": min(80, count)},
+            headers={"Authorization": os.environ.get("PEXELS_API_KEY")}
+        )
+        # "large" is 940px wide, comparable to Unsplash "regular"
+        return [
+            photo.get('src', {}).get('large', '')
+            for photo in data.get('photos', [])
+        ]
+
+
+@register_provider
+class BingProvider(ImageSearchProvider):
+    name = "bing"
+
+    @property
+    def search_url(self) -> str:
+        return f"{settings.bing_api_base}/v7.0/images/search"
+
+    def is_configured(self) -> bool:
+        return bool(os.environ.get("BING_SEARCH_API_KEY"))
+
+    async def _fetch(self, term: str, count: int, priority: int) -> List[str]:
+        data = await self._get_json(
+            self.search_url, priority,
+            params={"q": term, "count": min(150, count), "safeSearch": "Strict"},
+            headers={
+                "Ocp-Apim-Subscription-Key":
+                    os.environ.get("BING_SEARCH_API_KEY")
+            }
+        )
+        return [image.get('contentUrl', '') for image in data.get('value', [])]
+
+
+def extract_perplexity_images(data: dict) -> List[str]:
+    """Pull image URLs out of a sonar completion made with return_images"""
+    urls = []
+    for image in data.get('images') or []:
+        if isinstance(image, str):
+            urls.append(image)
+        elif isinstance(image, dict):
+            urls.append(image.get('image_url') or image.get('url') or '')
+    return [url for url in urls if url]
+
+
+@register_provider
+class PerplexityImagesProvider(ImageSearchProvider):
+    """Image results returned by a sonar completion with return_images"""
+
+    name = "perplexity"
+    # A duplicate costs a whole completion
+    hedge = False
+
+    @property
+    def completions_url(self) -> str:
+        return f"{settings.perplexity_api_base}/chat/completions"
+
+    def is_configured(self) -> bool:
+        return bool(os.environ.get("PERPLEXITY_API_KEY"))
+
+    async def _fetch(self, term: str, count: int, priority: int) -> List[str]:
+        payload = {
+            "model": "sonar",
+            "return_images": True,
+            "messages": [
+                {"role": "user", "content": f"Show me at least {count} images of {term}"}
+            ],
+        }
+        headers = {
+            "Authorization": f"Bearer {os.environ.get('PERPLEXITY_API_KEY')}",
+            "Content-Type": "application/json"
+        }
+        async with quota_manager.slot(self.name, priority) as quota, \
+                self.session.post(self.completions_url, json=payload, headers=headers) as response:
+            await quota.record(response.status, response.headers)
+            if response.status != 200:
+                raise ProviderError(f"Perplexity API Error: {response.status}")
+            data = await response.json()
+        return extract_perplexity_images(data)
+
+
+def _clean_term(term: str) -> str:
+    return re.sub(r'[^\w\s-]', '', term.replace(' ', '_')).lower()
+
+
+# Host of the placeholder URLs produced by MockProvider
+MOCK_IMAGE_HOST = "example-images.com"
+
+
+@register_provider
+class MockProvider(ImageSearchProvider):
+    """Deterministic placeholder URLs, used for tests and as a fallback"""
+
+    name = "mock"
+    hedge = False
+
+    async def _fetch(self, term: str, count: int, priority: int) -> List[str]:
+        return await self.search(term, count)
+
+    async def search(
+        self, term: str, count: int, required: bool = True, start: int = 0
+    ) -> List[str]:
+        # No guard or quota: placeholders can't fail or run out
+        term_clean = _clean_term(term) or 'image'
+        # Mock image URL - in reality, you'd get these from an image search API
+        return [
+            f"https://{MOCK_IMAGE_HOST}/search?q={term_clean}&img={i + 1}.jpg"
+            for i in range(start, start + count)
+        ]
+
+
+# Tracking parameters that differ between otherwise identical image URLs
+_IGNORED_PARAMS = {"ixid", "ixlib", "utm_source", "utm_medium", "utm_campaign"}
+
+
+def normalize_image_url(url: str) -> str:
+    """Canonical form of an image URL used for de-duplication"""
+    parts = urlsplit(url.strip())
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query)
+        if key.lower() not in _IGNORED_PARAMS
+    )
+    return urlunsplit((
+        parts.scheme.lower(), parts.netloc.lower(), parts.path,
+        urlencode(query), ''
+    ))
+
+
+async def _feed_terms(
+    search_terms: Union[Iterable[str], AsyncIterable[str]],
+    queues: List[asyncio.Queue],
+):
+    """Broadcast each search term to every provider as it arrives"""
+    try:
+        if isinstance(search_terms, AsyncIterable):
+            async for term in search_terms:
+                for queue in queues:
+                    queue.put_nowait(term)
+        else:
+            for term in search_terms:
+                for queue in queues:
+                    queue.put_nowait(term)
+    finally:
+        for queue in queues:
+            queue.put_nowait(None)
+
+
+async def _provider_worker(
+    provider: ImageSearchProvider,
+    terms: asyncio.Queue,
+    num_images: int,
+    results: asyncio.Queue,
+):
+    """Search terms with one provider, streaming batches to results"""
+    try:
+        index = 0
+        while True:
+            term = await terms.get()
+            if term is None:
+                break
+            try:
+                urls = await provider.search(
+                    term, min(10, num_images), required=index == 0
+                )
+            except (QuotaExhaustedError, CircuitOpenError, ProviderError) as e:
+                print(f"Stopping {provider.name} search: {str(e)}")
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error searching {provider.name} for '{term}': {str(e)}")
+                # Continue with other search terms
+                continue
+            finally:
+                index += 1
+            results.put_nowait((provider.name, urls))
+    finally:
+        results.put_nowait((provider.name, None))
+
+
+async def stream_image_search(
+    providers: List[ImageSearchProvider],
+    search_terms: Union[Iterable[str], AsyncIterable[str]],
+    num_images: int,
+    deadline: Optional[float] = None,
+) -> AsyncIterator[str]:
+    """
+    Query all providers concurrently and yield unique URLs as they arrive.
+
+    Args:
+        providers: Providers to query
+        search_terms: Terms to search, in order of relevance. May be an
+            async iterable, in which case each provider starts searching
+            as soon as the first term arrives.
+        num_images: Number of unique URLs wanted
+        deadline: Seconds to wait for results, None waits for all
+            providers to finish
+
+    Yields:
+        Up to num_images unique URLs, in the order they arrived
+    """
+    if not providers:
+        return
+
+    results: asyncio.Queue = asyncio.Queue()
+    term_queues = [asyncio.Queue() for _ in providers]
+    tasks = [asyncio.create_task(_feed_terms(search_terms, term_queues))]
+    tasks += [
+        asyncio.create_task(
+            _provider_worker(provider, queue, num_images, results)
+        )
+        for provider, queue in zip(providers, term_queues)
+    ]
+
+    seen = set()
+    running = len(providers)
+    expires_at = time.monotonic() + deadline if deadline is not None else None
+
+    try:
+        while running and len(seen) < num_images:
+            timeout = None
+            if expires_at is not None:
+                timeout = expires_at - time.monotonic()
+                if timeout <= 0:
+                    break
+            try:
+                name, urls = await asyncio.wait_for(results.get(), timeout)
+            except asyncio.TimeoutError:
+                print("Image search deadline reached, using partial results")
+                break
+
+            if urls is None:
+                running -= 1
+                continue
+
+            for url in urls:
+                key = normalize_image_url(url)
+                if key not in seen and len(seen) < num_images:
+                    seen.add(key)
+                    yield url
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def aggregate_image_search(
+    providers: List[ImageSearchProvider],
+    search_terms: Union[Iterable[str], AsyncIterable[str]],
+    num_images: int,
+    deadline: Optional[float] = None,
+) -> List[str]:
+    """
+    Query all providers concurrently and merge their results.
+
+    Same arguments as stream_image_search().
+
+    Returns:
+        Up to num_images unique URLs, in the order they arrived
+    """
+    async with aclosing(stream_image_search(
+        providers, search_terms, num_images, deadline
+    )) as urls:
+        return [url async for url in urls]
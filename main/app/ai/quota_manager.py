@@ -0,0 +1,398 @@
+"""
+Outbound quota management for external APIs (Perplexity, Unsplash).
+
+Every outgoing call reserves a slot from the provider's quota before it
+is sent. Reservations are paced: calls are spaced at least
+1 / requests_per_second apart, so the budget of the current window
+(known from X-Ratelimit-* response headers) can be spent in bursts
+until only the reserve is left. When the budget runs that low, only
+high priority calls (priority 0) are let through, spread so the reserve
+lasts until the window resets, and the rest fail fast with
+QuotaExhaustedError so callers can use their fallback instead of
+burning the last requests.
+
+With the "redis" backend the state is kept in a Redis hash and updated
+by Lua scripts, so all workers share the same budget and pacing.
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Dict, Mapping, Optional, Tuple
+
+from ..core.config import settings
+from ..database.dependencies import connections
+
+logger = logging.getLogger(__name__)
+
+
+class QuotaExhaustedError(Exception):
+    """Raised when a provider call cannot be made within its quota"""
+
+    def __init__(self, provider: str, retry_after: Optional[float] = None):
+        self.provider = provider
+        self.retry_after = retry_after
+        message = f"Quota exhausted for {provider}"
+        if retry_after is not None:
+            message += f", retry in {retry_after:.1f}s"
+        super().__init__(message)
+
+
+@dataclass
+class ProviderLimits:
+    """Static limits for a provider"""
+    requests_per_second: float
+    requests_per_window: Optional[int] = None
+    window_seconds: float = 3600.0
+
+
+@dataclass
+class QuotaState:
+    """Dynamic quota state for a provider"""
+    remaining: Optional[int] = None
+    reset_at: Optional[float] = None
+    next_slot: float = 0.0
+
+
+# KEYS[1] - state hash
+# ARGV[1] - min interval between calls, ARGV[2] - reserved budget,
+# ARGV[3] - priority, ARGV[4] - max wait, ARGV[5] - calls per window
+# (0 if unknown), ARGV[6] - window length in seconds
+# Returns {granted (0/1), wait_seconds (string)}
+RESERVE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local min_interval = tonumber(ARGV[1])
+local reserve = tonumber(ARGV[2])
+local priority = tonumber(ARGV[3])
+local max_wait = tonumber(ARGV[4])
+local window_limit = tonumber(ARGV[5])
+local window_seconds = tonumber(ARGV[6])
+
+local state = redis.call('HMGET', KEYS[1], 'remaining', 'reset_at', 'next_slot')
+local remaining = tonumber(state[1])
+local reset_at = tonumber(state[2])
+local next_slot = tonumber(state[3]) or 0
+
+if reset_at ~= nil and now >= reset_at then
+    remaining = nil
+    reset_at = nil
+end
+if remaining == nil and window_limit > 0 then
+    remaining = window_limit
+    reset_at = now + window_seconds
+end
+
+local interval = min_interval
+if remaining ~= nil then
+    local until_reset = -1
+    if reset_at ~= nil then
+        until_reset = reset_at - now
+    end
+    if remaining <= 0 or (remaining <= reserve and priority > 0) then
+        return {0, tostring(until_reset)}
+    end
+    if remaining <= reserve and reset_at ~= nil then
+        interval = math.max(interval, until_reset / remaining)
+    end
+end
+
+local start = math.max(now, next_slot)
+if start - now > max_wait then
+    return {0, tostring(start - now)}
+end
+
+redis.call('HSET', KEYS[1], 'next_slot', tostring(start + interval))
+if remaining ~= nil then
+    redis.call('HSET', KEYS[1], 'remaining', tostring(remaining - 1))
+end
+if reset_at ~= nil then
+    redis.call('HSET', KEYS[1], 'reset_at', tostring(reset_at))
+end
+redis.call('EXPIRE', KEYS[1], math.ceil(window_seconds))
+return {1, tostring(start - now)}
+"""
+
+
+def _parse_float(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def parse_rate_limit_headers(
+    headers: Mapping[str, str], now: float, window_seconds: float
+) -> Dict[str, float]:
+    """
+    Extract remaining budget and reset time from rate limit headers.
+
+    Understands X-Ratelimit-Remaining (Unsplash),
+    X-Ratelimit-Remaining-Requests (Perplexity / OpenAI style),
+    X-Ratelimit-Reset (seconds, or an epoch timestamp) and Retry-After.
+
+    Returns:
+        Dict with "remaining" and/or "reset_at" keys
+    """
+    lowered = {k.lower(): v for k, v in headers.items()}
+    result = {}
+
+    remaining = _parse_float(
+        lowered.get("x-ratelimit-remaining")
+        or lowered.get("x-ratelimit-remaining-requests")
+    )
+    if remaining is not None:
+        result["remaining"] = int(remaining)
+
+    reset = _parse_float(
+        lowered.get("x-ratelimit-reset")
+        or lowered.get("x-ratelimit-reset-requests")
+        or lowered.get("retry-after")
+    )
+    if reset is not None:
+        # Large values are absolute epoch timestamps, small ones are deltas
+        result["reset_at"] = reset if reset > 1e9 else now + reset
+    elif remaining is not None:
+        result["reset_at"] = now + window_seconds
+
+    return result
+
+
+class QuotaManager:
+    """
+    Tracks and paces outbound calls per provider.
+
+    Usage:
+        async with quota_manager.slot("unsplash", priority=1) as s:
+            async with session.get(...) as response:
+                await s.record(response.status, response.headers)
+    """
+
+    # How long to stay on the in-memory fallback after a Redis error
+    REDIS_RETRY_INTERVAL = 30.0
+
+    def __init__(
+        self,
+        backend: str = "memory",
+        redis_url: Optional[str] = None,
+        reserve: int = 5,
+        max_wait: float = 10.0,
+        key_prefix: str = "quota",
+    ):
+        self.backend = backend
+        self.redis_url = redis_url
+        self.reserved_budget = reserve
+        self.max_wait = max_wait
+        self.key_prefix = key_prefix
+        self._limits: Dict[str, ProviderLimits] = {}
+        self._states: Dict[str, QuotaState] = {}
+        self._redis = None
+        self._redis_disabled_until = 0.0
+
+    def register(self, provider: str, limits: ProviderLimits):
+        """Register (or replace) the static limits of a provider"""
+        self._limits[provider] = limits
+        self._states.setdefault(provider, QuotaState())
+
+    def _get_redis(self):
+        """The shared Redis pool, else a lazily created client, if enabled"""
+        if self.backend != "redis" or not self.redis_url:
+            return None
+        if time.monotonic() < self._redis_disabled_until:
+            return None
+        # The app lifespan opens one pool per process; share it
+        shared = connections.shared_redis(self.redis_url)
+        if shared is not None:
+            return shared
+        if self._redis is None:
+            try:
+                import redis.asyncio as aioredis
+            except ImportError:
+                logger.warning(
+                    "redis package not installed, using in-memory quotas"
+                )
+                self.backend = "memory"
+                return None
+            self._redis = aioredis.from_url(self.redis_url)
+        return self._redis
+
+    def _disable_redis(self, error: Exception):
+        logger.warning(
+            f"Redis quota store unavailable, falling back to in-memory "
+            f"state: {str(error)}"
+        )
+        self._redis_disabled_until = (
+            time.monotonic() + self.REDIS_RETRY_INTERVAL
+        )
+
+    def _reserve_local(
+        self, provider: str, priority: int, now: float
+    ) -> Tuple[bool, float]:
+        limits = self._limits[provider]
+        state = self._states[provider]
+
+        if state.reset_at is not None and now >= state.reset_at:
+            state.remaining = None
+            state.reset_at = None
+        if state.remaining is None and limits.requests_per_window:
+            state.remaining = limits.requests_per_window
+            state.reset_at = now + limits.window_seconds
+
+        interval = 1.0 / limits.requests_per_second
+        if state.remaining is not None:
+            until_reset = (
+                state.reset_at - now if state.reset_at is not None else -1
+            )
+            if state.remaining <= 0 or (
+                state.remaining <= self.reserved_budget and priority > 0
+            ):
+                return False, until_reset
+            # Calls outside the reserve burst at the provider's rate;
+            # only the reserve is spread over the rest of the window
+            if (
+                state.remaining <= self.reserved_budget
+                and state.reset_at is not None
+            ):
+                interval = max(interval, until_reset / state.remaining)
+
+        start = max(now, state.next_slot)
+        if start - now > self.max_wait:
+            return False, start - now
+
+        state.next_slot = start + interval
+        if state.remaining is not None:
+            state.remaining -= 1
+        return True, start - now
+
+    async def reserve(self, provider: str, priority: int = 0) -> float:
+        """
+        Reserve a call slot for the provider and wait until it is due.
+
+        Args:
+            provider: Registered provider name
+            priority: 0 for calls that must go through, higher values
+                for optional calls that are dropped when budget is low
+
+        Returns:
+            float: Seconds spent waiting for the slot
+
+        Raises:
+            QuotaExhaustedError: If no slot is available
+        """
+        if provider not in self._limits:
+            return 0.0
+        limits = self._limits[provider]
+
+        granted, wait = None, 0.0
+        redis_client = self._get_redis()
+        if redis_client is not None:
+            try:
+                granted, wait = await redis_client.eval(
+                    RESERVE_SCRIPT, 1, f"{self.key_prefix}:{provider}",
+                    1.0 / limits.requests_per_second, self.reserved_budget,
+                    priority, self.max_wait,
+                    limits.requests_per_window or 0, limits.window_seconds
+                )
+                granted, wait = bool(int(granted)), float(wait)
+            except Exception as e:
+                self._disable_redis(e)
+                granted = None
+
+        if granted is None:
+            granted, wait = self._reserve_local(
+                provider, priority, time.time()
+            )
+
+        if not granted:
+            raise QuotaExhaustedError(
+                provider, wait if wait is not None and wait >= 0 else None
+            )
+
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    async def record_response(
+        self, provider: str, status: int, headers: Mapping[str, str]
+    ):
+        """Update the provider budget from an API response"""
+        if provider not in self._limits:
+            return
+        limits = self._limits[provider]
+        now = time.time()
+        update = parse_rate_limit_headers(
+            headers, now, limits.window_seconds
+        )
+
+        if status == 429:
+            update["remaining"] = 0
+            update.setdefault("reset_at", now + limits.window_seconds)
+            logger.warning(
+                f"{provider} rate limit hit, backing off until "
+                f"{update['reset_at'] - now:.0f}s from now"
+            )
+
+        if not update:
+            return
+
+        state = self._states[provider]
+        if "remaining" in update:
+            state.remaining = update["remaining"]
+        if "reset_at" in update:
+            state.reset_at = update["reset_at"]
+
+        redis_client = self._get_redis()
+        if redis_client is not None:
+            try:
+                await redis_client.hset(
+                    f"{self.key_prefix}:{provider}",
+                    mapping={k: str(v) for k, v in update.items()}
+                )
+            except Exception as e:
+                self._disable_redis(e)
+
+    @asynccontextmanager
+    async def slot(self, provider: str, priority: int = 0):
+        """Context manager that reserves a slot and records the response"""
+        await self.reserve(provider, priority)
+        yield _SlotRecorder(self, provider)
+
+
+class _SlotRecorder:
+    """Handle passed to callers so they can report the response"""
+
+    def __init__(self, manager: QuotaManager, provider: str):
+        self._manager = manager
+        self._provider = provider
+
+    async def record(self, status: int, headers: Mapping[str, str]):
+        await self._manager.record_response(self._provider, status, headers)
+
+
+# Global quota manager instance
+quota_manager = QuotaManager(
+    backend=settings.quota_backend,
+    redis_url=settings.redis_url,
+    reserve=settings.quota_reserve,
+    max_wait=settings.quota_max_wait_seconds,
+)
+quota_manager.register("perplexity", ProviderLimits(
+    requests_per_second=settings.perplexity_requests_per_second,
+    requests_per_window=settings.perplexity_requests_per_minute,
+    window_seconds=60.0,
+))
+quota_manager.register("unsplash", ProviderLimits(
+    requests_per_second=settings.unsplash_requests_per_second,
+    requests_per_window=settings.unsplash_requests_per_hour,
+    window_seconds=3600.0,
+))
+quota_manager.register("pexels", ProviderLimits(
+    requests_per_second=settings.pexels_requests_per_second,
+    requests_per_window=settings.pexels_requests_per_hour,
+    window_seconds=3600.0,
+))
+quota_manager.register("bing", ProviderLimits(
+    requests_per_second=settings.bing_requests_per_second,
+))
@@ -0,0 +1,219 @@
+"""
+Resized, re-encoded renditions of downloaded images for delivery.
+
+Originals are kept as downloaded; what gets emailed is a rendition with
+a bounded width in a modern format (WebP by default), usually several
+times smaller. Renditions are cached by the SHA-256 of the source bytes
+plus the rendition spec, so an image that shows up in many requests
+(including the black-square placeholders) is only encoded once.
+
+Encoding runs in the shared image process pool, a batch of images per
+task to amortize the inter-process overhead. All resizing goes through
+Image.thumbnail with a JPEG draft, which is what Pillow-SIMD speeds up
+when it is installed in place of Pillow.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+from dataclasses import dataclass
+from typing import List, Optional
+
+from ..core.config import settings
+from .image_validation import get_process_pool
+
+logger = logging.getLogger(__name__)
+
+# Pillow format name and file extension per configured format
+RENDITION_FORMATS = {
+    "webp": ("WEBP", ".webp"),
+    "avif": ("AVIF", ".avif"),
+    "jpeg": ("JPEG", ".jpg"),
+    "jpg": ("JPEG", ".jpg"),
+}
+
+
+@dataclass(frozen=True)
+class RenditionSpec:
+    """Target size, format and quality of a rendition"""
+    width: int
+    format: str = "webp"
+    quality: int = 75
+
+    @classmethod
+    def from_settings(cls) -> "RenditionSpec":
+        return cls(
+            width=settings.rendition_width,
+            format=settings.rendition_format.lower(),
+            quality=settings.rendition_quality,
+        )
+
+
+def content_hash(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _pillow_format(name: str):
+    """Resolve a format name, falling back to JPEG if Pillow can't save it"""
+    from PIL import Image
+
+    pil_format, extension = RENDITION_FORMATS.get(name, RENDITION_FORMATS["jpeg"])
+    Image.init()
+    if pil_format not in Image.SAVE:
+        return RENDITION_FORMATS["jpeg"]
+    return pil_format, extension
+
+
+def render(source: str, cache_dir: str, spec: RenditionSpec) -> str:
+    """
+    Create (or reuse) the rendition of one image.
+
+    Runs in a worker process.
+
+    Returns:
+        Path of the rendition in the cache directory
+    """
+    from PIL import Image
+
+    pil_format, extension = _pillow_format(spec.format)
+    key = f"{content_hash(source)}_w{spec.width}_q{spec.quality}{extension}"
+    target = os.path.join(cache_dir, key[:2], key)
+    if os.path.exists(target):
+        return target
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with Image.open(source) as img:
+        # Let the JPEG decoder downscale by up to 8x while decoding
+        img.draft('RGB', (spec.width, spec.width))
+        # Renditions are never larger than the original
+        img.thumbnail((spec.width, spec.width * 4), Image.LANCZOS)
+        if img.mode not in ('RGB', 'L') and pil_format == 'JPEG':
+            img = img.convert('RGB')
+        elif img.mode not in ('RGB', 'RGBA', 'L'):
+            img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+
+        temp = f"{target}.{os.getpid()}.tmp"
+        img.save(temp, pil_format, quality=spec.quality)
+    # Another worker may have produced the same rendition meanwhile;
+    # both are identical, so the last rename wins
+    os.replace(temp, target)
+    return target
+
+
+def render_batch(
+    sources: List[str], cache_dir: str, spec: RenditionSpec
+) -> List[Optional[str]]:
+    """
+    Render several images in one worker task.
+
+    Returns:
+        Rendition path per source, or None where the source could not
+        be rendered
+    """
+    results = []
+    for source in sources:
+        try:
+            results.append(render(source, cache_dir, spec))
+        except Exception:
+            results.append(None)
+    return results
+
+
+def _link(cached: str, destination: str):
+    """Expose a cached rendition under a request-local name"""
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(cached, destination)
+    except OSError:
+        shutil.copyfile(cached, destination)
+
+
+def rendition_cache_dir() -> str:
+    """The configured rendition cache, else .renditions in downloads_dir"""
+    return settings.rendition_cache_dir or os.path.join(
+        settings.downloads_dir, ".renditions"
+    )
+
+
+class RenditionEngine:
+    """Creates delivery renditions for the images of a request"""
+
+    def __init__(self, cache_dir: Optional[str] = None,
+                 batch_size: Optional[int] = None):
+        self._cache_dir = cache_dir
+        self.batch_size = batch_size or settings.rendition_batch_size
+
+    @property
+    def cache_dir(self) -> str:
+        # Resolved on use, so the cache follows downloads_dir
+        return self._cache_dir or rendition_cache_dir()
+
+    async def create_renditions(
+        self, image_paths: List[str], spec: Optional[RenditionSpec] = None
+    ) -> List[str]:
+        """
+        Create renditions for a request's images.
+
+        Each rendition is placed next to its original, in a renditions/
+        subfolder with the original's name and the new extension. Files
+        that are not images (e.g. error notes) or fail to render are
+        returned unchanged.
+
+        Args:
+            image_paths: Paths of the downloaded images
+            spec: Rendition spec, defaults to the configured one
+
+        Returns:
+            List of paths to deliver, in the order of image_paths
+        """
+        spec = spec or RenditionSpec.from_settings()
+        loop = asyncio.get_running_loop()
+        pool = get_process_pool()
+
+        batches = [
+            image_paths[i:i + self.batch_size]
+            for i in range(0, len(image_paths), self.batch_size)
+        ]
+        rendered = await asyncio.gather(*(
+            loop.run_in_executor(pool, render_batch, batch, self.cache_dir, spec)
+            for batch in batches
+        ))
+
+        delivered = []
+        original_bytes = rendition_bytes = 0
+        for source, cached in zip(
+            image_paths, (path for batch in rendered for path in batch)
+        ):
+            if cached is None:
+                delivered.append(source)
+                continue
+
+            folder = os.path.join(os.path.dirname(source), "renditions")
+            os.makedirs(folder, exist_ok=True)
+            stem = os.path.splitext(os.path.basename(source))[0]
+            destination = os.path.join(
+                folder, stem + os.path.splitext(cached)[1]
+            )
+            _link(cached, destination)
+            delivered.append(destination)
+
+            original_bytes += os.path.getsize(source)
+            rendition_bytes += os.path.getsize(destination)
+
+        logger.info(
+            f"Rendered {len(image_paths)} images as {spec.format} "
+            f"{spec.width}px: {original_bytes} -> {rendition_bytes} bytes"
+        )
+        return delivered
+
+
+# Global rendition engine instance
+rendition_engine = RenditionEngine()
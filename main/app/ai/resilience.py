@@ -0,0 +1,263 @@
+"""
+Circuit breakers and hedged requests for external providers.
+
+A CircuitBreaker counts consecutive failures of a provider. Once the
+threshold is reached it opens and calls fail immediately with
+CircuitOpenError, so requests use their fallback right away instead of
+waiting out a timeout. After the recovery period a single probe call is
+let through (half-open); its outcome closes or re-opens the circuit.
+
+hedged() starts a second, identical attempt if the first one has not
+finished after a latency threshold (typically a high percentile taken
+from a LatencyTracker) and returns whichever finishes first. This trims
+the tail latency caused by a slow upstream replica.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+from ..core.config import settings
+from .quota_manager import QuotaExhaustedError
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected by an open circuit"""
+
+    def __init__(self, name: str, retry_after: float):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(
+            f"Circuit for {name} is open, retry in {retry_after:.1f}s"
+        )
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with half-open probing"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        half_open_max_calls: int = 1,
+        excluded_exceptions: tuple = (),
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        # Errors that say nothing about the provider's health
+        self.excluded_exceptions = excluded_exceptions
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+
+    def allow(self) -> bool:
+        """Check whether a call may be made right now"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.recovery_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._half_open_calls = 0
+            logger.info(f"Circuit for {self.name} is half-open, probing")
+
+        if self.state == self.HALF_OPEN:
+            if self._half_open_calls >= self.half_open_max_calls:
+                return False
+            self._half_open_calls += 1
+
+        return True
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info(f"Circuit for {self.name} closed")
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if (
+            self.state == self.HALF_OPEN
+            or self.failures >= self.failure_threshold
+        ):
+            if self.state != self.OPEN:
+                logger.warning(
+                    f"Circuit for {self.name} opened after "
+                    f"{self.failures} failures"
+                )
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+    def retry_after(self) -> float:
+        """Seconds until the next probe is allowed"""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(
+            0.0, self.recovery_timeout - (time.monotonic() - self._opened_at)
+        )
+
+    @asynccontextmanager
+    async def protect(self):
+        """
+        Context manager form of call(), for work that cannot be wrapped in
+        a single coroutine (e.g. consuming a streamed response).
+
+        Raises:
+            CircuitOpenError: If the circuit does not allow the call
+        """
+        if not self.allow():
+            raise CircuitOpenError(self.name, self.retry_after())
+        try:
+            yield
+        except (
+            asyncio.CancelledError, GeneratorExit, *self.excluded_exceptions
+        ):
+            # Not a provider failure, but a half-open probe slot must not
+            # be lost
+            if self.state == self.HALF_OPEN:
+                self._half_open_calls -= 1
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+
+    async def call(self, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run func through the breaker.
+
+        Raises:
+            CircuitOpenError: If the circuit does not allow the call
+        """
+        async with self.protect():
+            return await func()
+
+
+class LatencyTracker:
+    """Sliding window of recent call latencies"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """Latency at the given percentile, None until enough samples"""
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(len(ordered) * pct / 100.0))
+        return ordered[index]
+
+
+async def hedged(
+    call_factory: Callable[[int], Awaitable[T]],
+    hedge_after: Optional[float],
+    max_attempts: int = 2,
+) -> T:
+    """
+    Run call_factory(0) and, if it is still running after hedge_after
+    seconds, start call_factory(1) and so on up to max_attempts.
+
+    Args:
+        call_factory: Creates the coroutine for the given attempt number
+        hedge_after: Delay before each extra attempt, None disables
+            hedging
+        max_attempts: Maximum number of concurrent attempts
+
+    Returns:
+        The result of the first attempt that succeeds. If every attempt
+        fails, the last error is raised.
+    """
+    if hedge_after is None or max_attempts <= 1:
+        return await call_factory(0)
+
+    pending = {asyncio.ensure_future(call_factory(0))}
+    attempts = 1
+    last_error = None
+
+    try:
+        while pending:
+            timeout = hedge_after if attempts < max_attempts else None
+            done, pending = await asyncio.wait(
+                pending, timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                last_error = task.exception()
+
+            # Start another attempt on timeout, or right away if the
+            # previous attempt failed and no other one is running
+            if attempts < max_attempts and (not done or not pending):
+                pending.add(asyncio.ensure_future(call_factory(attempts)))
+                attempts += 1
+    finally:
+        for task in pending:
+            task.cancel()
+
+    raise last_error
+
+
+class ProviderGuard:
+    """Circuit breaker and latency tracker for a single provider"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.breaker = CircuitBreaker(
+            name,
+            failure_threshold=settings.circuit_failure_threshold,
+            recovery_timeout=settings.circuit_recovery_seconds,
+            excluded_exceptions=(QuotaExhaustedError,),
+        )
+        self.latency = LatencyTracker()
+
+    def hedge_delay(self) -> Optional[float]:
+        """Hedging threshold for this provider, None if disabled"""
+        if not settings.hedge_requests:
+            return None
+        return self.latency.percentile(settings.hedge_percentile)
+
+    async def call(
+        self,
+        call_factory: Callable[[int], Awaitable[T]],
+        hedge: bool = False,
+    ) -> T:
+        """
+        Call the provider through its circuit breaker, optionally hedged.
+        """
+        async def timed(attempt: int) -> T:
+            started = time.monotonic()
+            result = await call_factory(attempt)
+            self.latency.record(time.monotonic() - started)
+            return result
+
+        hedge_after = self.hedge_delay() if hedge else None
+        return await self.breaker.call(lambda: hedged(timed, hedge_after))
+
+
+_guards: Dict[str, ProviderGuard] = {}
+
+
+def get_provider_guard(name: str) -> ProviderGuard:
+    """Get the shared guard for a provider, creating it on first use"""
+    if name not in _guards:
+        _guards[name] = ProviderGuard(name)
+    return _guards[name]
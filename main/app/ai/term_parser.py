@@ -0,0 +1,173 @@
+"""
+Parsing of search terms returned by Perplexity.
+
+The completion is requested as a JSON object of the form
+{"terms": ["...", "..."]} and streamed. StreamingTermParser scans the
+streamed text incrementally and emits every term as soon as its string
+literal is closed, so searches can start before the completion ends.
+parse_search_terms() is the old line/comma based parser, kept as a
+fallback for answers that are not JSON.
+"""
+
+import json
+import re
+from typing import AsyncIterator, List
+
+MAX_SEARCH_TERMS = 10
+
+# JSON schema for the structured output request
+SEARCH_TERMS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "terms": {
+            "type": "array",
+            "items": {"type": "string"},
+            "minItems": 1,
+            "maxItems": MAX_SEARCH_TERMS,
+        }
+    },
+    "required": ["terms"],
+}
+
+
+def parse_search_terms(content: str) -> List[str]:
+    """
+    Extract search terms from a free-text answer.
+
+    Looks for numbered lists or one term per line, and falls back to
+    comma-separated terms.
+    """
+    search_terms = []
+
+    for line in content.split('\n'):
+        # Remove numbering like "1.", "2.", etc.
+        cleaned_line = re.sub(r'^\d+\.\s*', '', line.strip())
+        if len(cleaned_line) > 3:  # At least 3 chars to be meaningful
+            search_terms.append(cleaned_line)
+
+    # If no numbered list found, try to split by commas
+    if not search_terms:
+        potential_terms = [term.strip() for term in content.split(',')]
+        search_terms = [term for term in potential_terms if len(term) > 3]
+
+    return search_terms[:MAX_SEARCH_TERMS]
+
+
+class StreamingTermParser:
+    """
+    Incremental parser for {"terms": [...]} documents.
+
+    Only string literals directly inside the array under the "terms" key
+    are emitted; everything else (other keys, markdown fences around the
+    JSON) is ignored.
+    """
+
+    def __init__(self, key: str = "terms", max_terms: int = MAX_SEARCH_TERMS):
+        self.key = key
+        self.max_terms = max_terms
+        self.terms: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._current: List[str] = []
+        self._last_string = None
+        self._pending_key = None
+        self._depth = 0
+        self._terms_depth = None
+
+    @property
+    def done(self) -> bool:
+        return len(self.terms) >= self.max_terms
+
+    def _close_string(self, new_terms: List[str]):
+        raw = ''.join(self._current)
+        try:
+            value = json.loads(f'"{raw}"')
+        except ValueError:
+            value = raw
+
+        if self._terms_depth is not None and self._depth == self._terms_depth:
+            term = value.strip()
+            if term and not self.done:
+                self.terms.append(term)
+                new_terms.append(term)
+            self._last_string = None
+        else:
+            self._last_string = value
+
+    def feed(self, chunk: str) -> List[str]:
+        """
+        Consume the next piece of streamed text.
+
+        Returns:
+            Terms completed by this chunk
+        """
+        new_terms: List[str] = []
+
+        for ch in chunk:
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                    self._current.append(ch)
+                elif ch == '\\':
+                    self._escape = True
+                    self._current.append(ch)
+                elif ch == '"':
+                    self._in_string = False
+                    self._close_string(new_terms)
+                else:
+                    self._current.append(ch)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._current = []
+            elif ch == ':':
+                self._pending_key = self._last_string
+            elif ch in '[{':
+                self._depth += 1
+                if (
+                    ch == '['
+                    and self._pending_key == self.key
+                    and self._terms_depth is None
+                ):
+                    self._terms_depth = self._depth
+                self._pending_key = None
+            elif ch in ']}':
+                if self._terms_depth == self._depth:
+                    self._terms_depth = None
+                self._depth = max(0, self._depth - 1)
+            elif ch == ',':
+                self._pending_key = None
+                self._last_string = None
+
+        return new_terms
+
+
+async def iter_sse_content(response) -> AsyncIterator[str]:
+    """
+    Yield content deltas from a streamed (server-sent events) chat
+    completion response.
+    """
+    async for raw_line in response.content:
+        line = raw_line.decode('utf-8', errors='replace').strip()
+        if not line.startswith('data:'):
+            continue
+
+        data = line[len('data:'):].strip()
+        if data == '[DONE]':
+            break
+
+        try:
+            event = json.loads(data)
+        except ValueError:
+            continue
+
+        for choice in event.get('choices') or []:
+            # Some servers repeat the accumulated text in "message", so it
+            # is only used when there is no delta at all
+            if 'delta' in choice:
+                content = (choice['delta'] or {}).get('content')
+            else:
+                content = (choice.get('message') or {}).get('content')
+            if content:
+                yield content
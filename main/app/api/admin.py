@@ -0,0 +1,60 @@
+import hmac
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
+from typing import Optional
+from ..core.config import settings
+from ..core.profiler import ProfilerBusy, profile
+
+
+async def require_admin(authorization: Optional[str] = Header(None)):
+    """Accept only "Authorization: Bearer <settings.admin_token>" """
+    scheme, _, token = (authorization or "").partition(" ")
+    if (
+        not settings.admin_token
+        or scheme.lower() != "bearer"
+        or not hmac.compare_digest(token.encode(), settings.admin_token.encode())
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin token required"
+        )
+
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+
+@router.get("/profile")
+async def profile_worker(
+    seconds: float = Query(10.0, gt=0),
+    format: str = Query("collapsed", pattern="^(collapsed|json)$"),
+    all_threads: bool = False
+):
+    """
+    Profile the worker that serves this request for some seconds.
+
+    format=collapsed returns the stack samples in collapsed-stack format
+    for flamegraph.pl / speedscope; format=json adds the event loop lag
+    and every stall longer than PROFILER_STALL_THRESHOLD_SECONDS with
+    the stack of the callback that blocked the loop.
+    """
+    if not settings.profiler_enabled:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profiler is disabled"
+        )
+    try:
+        profiler = await profile(
+            min(seconds, settings.profiler_max_seconds),
+            settings.profiler_interval_seconds,
+            settings.profiler_stall_threshold_seconds,
+            all_threads
+        )
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+    if format == "json":
+        return profiler.report()
+    return PlainTextResponse(
+        profiler.collapsed(),
+        headers={"Content-Disposition": 'attachment; filename="profile.collapsed"'}
+    )
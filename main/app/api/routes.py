@@ -1,16 +1,30 @@
-from fastapi import APIRouter, HTTPException, status
-from typing import List
+import mimetypes
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+from fastapi.responses import RedirectResponse
+from typing import List, Optional
 from uuid import UUID
 from ..schemas import (
     RegisterRequest, RegisterResponse,
     SearchRequest, SearchResponse, HealthCheck
 )
-from ..services.request_service import request_service
+from ..services.request_service import RequestBusy, SchedulerFull, request_service
+from ..core.rate_limit import admission_control, enforce_user_rate_limit
+from ..core.config import settings
+from ..core.idempotency import MAX_KEY_LENGTH, IdempotencyKeyReused
+from ..utils.bundles import bundle_extension, bundle_media_type
+from ..utils.file_response import RangeFileResponse
+from ..utils.storage import key_for, storage
 from datetime import datetime
 
 
 router = APIRouter()
 
+# Per-user limit is checked first so throttled users never take a slot
+request_limits = [
+    Depends(enforce_user_rate_limit),
+    Depends(admission_control),
+]
+
 
 @router.get("/health", response_model=HealthCheck)
 async def health_check():
@@ -21,11 +35,37 @@ async def health_check():
 @router.post(
     "/requests",
     response_model=SearchResponse,
-    status_code=status.HTTP_201_CREATED
+    status_code=status.HTTP_201_CREATED,
+    dependencies=request_limits
 )
-async def create_request(request: SearchRequest):
-    """Create a new request"""
-    return await request_service.create_request(request)
+async def create_request(
+    request: SearchRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """
+    Create a new request
+
+    Retries carrying the same Idempotency-Key header get the original
+    request back instead of starting a new one.
+    """
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= MAX_KEY_LENGTH:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters"
+        )
+    try:
+        return await request_service.create_request(request, idempotency_key)
+    except IdempotencyKeyReused as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(e)
+        )
+    except SchedulerFull as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": str(settings.scheduler_retry_after_seconds)}
+        )
 
 
 @router.get("/requests/{request_id}", response_model=SearchResponse)
@@ -40,6 +80,70 @@ async def get_request(request_id: UUID):
     return request
 
 
+@router.post("/requests/{request_id}/retry", response_model=SearchResponse)
+async def retry_request(request_id: UUID):
+    """Resume a failed request from the last stage it completed"""
+    try:
+        request = await request_service.resume_request(request_id)
+    except RequestBusy as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except SchedulerFull as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": str(settings.scheduler_retry_after_seconds)}
+        )
+    if not request:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Request not found"
+        )
+    return request
+
+
+@router.get("/requests/{request_id}/images/{index}")
+async def get_image(request_id: UUID, index: int):
+    """Download one image of a request"""
+    image_path = await request_service.get_image_path(request_id, index)
+    if not image_path:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Image not found"
+        )
+    presigned_url = storage.presigned_url(key_for(image_path))
+    if presigned_url:
+        # Object storage serves the file, this node stays out of the way
+        return RedirectResponse(presigned_url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
+
+    media_type = mimetypes.guess_type(image_path)[0] or "application/octet-stream"
+    # Images of a finished request never change
+    return RangeFileResponse(
+        image_path,
+        media_type=media_type,
+        cache_control="private, max-age=86400, immutable"
+    )
+
+
+@router.get("/requests/{request_id}/bundle")
+async def download_bundle(request_id: UUID):
+    """Download all images of a request as a single archive"""
+    bundle_path = await request_service.get_bundle(request_id)
+    if not bundle_path:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Bundle not found"
+        )
+    presigned_url = storage.presigned_url(key_for(bundle_path))
+    if presigned_url:
+        return RedirectResponse(presigned_url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
+
+    return RangeFileResponse(
+        bundle_path,
+        media_type=bundle_media_type(settings.bundle_format),
+        filename=f"snapnsend-{request_id}{bundle_extension(settings.bundle_format)}"
+    )
+
+
 @router.get("/requests", response_model=List[SearchResponse])
 async def list_requests():
     """List all requests"""
@@ -63,7 +167,8 @@ async def register(request: RegisterRequest):
 
 @router.post(
     "/request_by_email", response_model=SearchResponse,
-    status_code=status.HTTP_201_CREATED
+    status_code=status.HTTP_201_CREATED,
+    dependencies=request_limits
 )
 async def create_request_by_email(request: SearchRequest):
     """Create a new request by email"""
@@ -0,0 +1,153 @@
+"""
+Idempotent request submission.
+
+Clients send an Idempotency-Key header with POST /requests; the first
+request with a key reserves it for its request ID and retries with the
+same key get that request back (waiting for it in sync mode) instead
+of running the pipeline again.
+
+Keys are scoped per user and kept for settings.idempotency_ttl_seconds
+in Redis, through the shared pool from app.database.dependencies, so
+retries landing on another API node are recognized too. The
+reservation is a single SET NX. Without Redis the store falls back to
+process-local keys.
+
+Each key also stores a fingerprint of the request body; reusing a key
+for a different request is rejected.
+"""
+
+import hashlib
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+from .config import settings
+from ..database.dependencies import connections
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyKeyReused(ValueError):
+    """The key was already used for a request with a different body"""
+
+
+def fingerprint(body: str) -> str:
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    """
+    Maps idempotency keys to request IDs, in Redis with a local fallback.
+
+    Args:
+        ttl_seconds: How long keys are remembered
+        key_prefix: Prefix of the Redis keys
+    """
+
+    # How long to stay on the in-memory fallback after a Redis error
+    REDIS_RETRY_INTERVAL = 30.0
+
+    def __init__(self, ttl_seconds: int, key_prefix: str = "idempotency"):
+        self.ttl_seconds = ttl_seconds
+        self.key_prefix = key_prefix
+        # key -> (value, expires at)
+        self._memory: Dict[str, Tuple[str, float]] = {}
+        self._redis_disabled_until = 0.0
+        self._calls = 0
+
+    def _get_redis(self):
+        if time.monotonic() < self._redis_disabled_until:
+            return None
+        return connections.redis
+
+    def _disable_redis(self, error: Exception):
+        logger.warning(
+            f"Redis idempotency store unavailable, falling back to "
+            f"in-memory keys: {str(error)}"
+        )
+        self._redis_disabled_until = (
+            time.monotonic() + self.REDIS_RETRY_INTERVAL
+        )
+
+    def _reserve_local(self, key: str, value: str) -> Optional[str]:
+        now = time.monotonic()
+        self._calls += 1
+        if self._calls % 1000 == 0:
+            self._memory = {
+                k: entry for k, entry in self._memory.items() if entry[1] > now
+            }
+        entry = self._memory.get(key)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+        self._memory[key] = (value, now + self.ttl_seconds)
+        return None
+
+    async def reserve(self, key: str, request_id: str,
+                      body_fingerprint: str) -> Optional[str]:
+        """
+        Reserve a key for a new request, unless it is already taken.
+
+        Args:
+            key: Scoped idempotency key
+            request_id: ID of the new request
+            body_fingerprint: fingerprint() of the request body
+
+        Returns:
+            None if the key is now reserved for request_id, otherwise the
+            ID of the request that reserved it earlier
+
+        Raises:
+            IdempotencyKeyReused: If the earlier request had another body
+        """
+        value = f"{request_id}:{body_fingerprint}"
+        redis_key = f"{self.key_prefix}:{key}"
+        existing = None
+
+        redis_client = self._get_redis()
+        if redis_client is not None:
+            try:
+                # The key can expire between SET and GET; try again then
+                for _ in range(2):
+                    if await redis_client.set(
+                        redis_key, value, nx=True, ex=self.ttl_seconds
+                    ):
+                        return None
+                    existing = await redis_client.get(redis_key)
+                    if existing is not None:
+                        existing = existing.decode("utf-8")
+                        break
+                else:
+                    return None
+            except Exception as e:
+                self._disable_redis(e)
+                existing = None
+                redis_client = None
+
+        if redis_client is None:
+            existing = self._reserve_local(redis_key, value)
+            if existing is None:
+                return None
+
+        existing_id, _, existing_fingerprint = existing.partition(":")
+        if existing_fingerprint != body_fingerprint:
+            raise IdempotencyKeyReused(
+                "Idempotency-Key was already used for a different request"
+            )
+        return existing_id
+
+    async def release(self, key: str):
+        """Forget a key, e.g. when its request could not be started"""
+        redis_key = f"{self.key_prefix}:{key}"
+        self._memory.pop(redis_key, None)
+        redis_client = self._get_redis()
+        if redis_client is not None:
+            try:
+                await redis_client.delete(redis_key)
+            except Exception as e:
+                self._disable_redis(e)
+
+
+# Global idempotency store instance
+idempotency_store = IdempotencyStore(settings.idempotency_ttl_seconds)
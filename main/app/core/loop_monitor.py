@@ -0,0 +1,246 @@
+"""
+Event loop lag monitor and blocking call detector.
+
+A heartbeat coroutine sleeps settings.loop_monitor_interval_seconds at
+a time (at most half of settings.loop_monitor_threshold_seconds) and
+records how late it wakes up, which is how long other callbacks kept
+the loop busy (snapnsend_event_loop_lag_seconds). Stalls are measured
+from the last beat, the last time the loop is known to have made
+progress: a callback blocking longer than the threshold always leaves a
+gap between two beats longer than the threshold, wherever it started
+between them. A watchdog thread checks that the heartbeat keeps
+beating; while it is overdue the loop is stuck in one callback, and the
+watchdog captures the loop thread's stack and the task being run. When
+the loop recovers, the stall is logged with its duration, the route of
+the request (or the coroutine of a background task) and the blocking
+stack, and counted in snapnsend_event_loop_blocked_total by route.
+
+LoopMonitorMiddleware tells the monitor which request each task is
+serving; route templates are only resolved for stalls. The sampling
+profiler (app.core.profiler) measures lag with the same Heartbeat.
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+import weakref
+from typing import Callable, Optional
+
+from starlette.routing import Match
+
+from .config import settings
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+loop_lag_seconds = metrics.histogram(
+    "snapnsend_event_loop_lag_seconds",
+    "Delay of the event loop heartbeat beyond its sleep",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+loop_blocked_total = metrics.counter(
+    "snapnsend_event_loop_blocked_total",
+    "Times a callback blocked the event loop beyond the threshold",
+    ["route"],
+)
+loop_blocked_seconds = metrics.histogram(
+    "snapnsend_event_loop_blocked_seconds",
+    "Duration of event loop stalls",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+
+# Labels of stalls outside any HTTP request (image jobs, GC, ...) and
+# of stalls too short for the watchdog to see what was running
+BACKGROUND = "background"
+UNKNOWN = "unknown"
+
+
+class Heartbeat:
+    """
+    Coroutine that wakes up every interval and reports each gap.
+
+    The gap is measured from the previous beat (or start()), the last
+    time the loop is known to have made progress, so a callback blocking
+    anywhere between two beats is counted in full.
+
+    Args:
+        interval: Seconds to sleep between beats
+        on_beat: Called on the loop with the time of the previous beat
+            and the gap since then
+    """
+
+    def __init__(self, interval: float, on_beat: Callable[[float, float], None]):
+        self.interval = interval
+        self.on_beat = on_beat
+        self.last_beat = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        """Start beating on the running loop"""
+        self.last_beat = time.perf_counter()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            beat, self.last_beat = self.last_beat, now
+            self.on_beat(beat, now - beat)
+
+
+class LoopMonitor:
+    """
+    Measures event loop lag and reports blocking callbacks.
+
+    Args:
+        interval: Seconds between heartbeats, capped at half the threshold
+        threshold: Time without a heartbeat that counts as a blocked loop
+    """
+
+    def __init__(self, interval: float = 0.05, threshold: float = 0.1):
+        # A longer period could hide a stall of up to period + threshold
+        self.interval = min(interval, threshold / 2)
+        self.threshold = threshold
+        # Task -> ASGI scope of the request it serves
+        self._requests = weakref.WeakKeyDictionary()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread = 0
+        self._heartbeat = Heartbeat(self.interval, self._on_beat)
+        # (last beat, task, request scope, stack) of the stall in progress
+        self._capture: Optional[tuple] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._app = None
+
+    def start(self, app=None):
+        """
+        Start monitoring the running loop; call from the loop thread.
+
+        Args:
+            app: ASGI app whose routes name the blocked requests
+        """
+        if self._heartbeat.running:
+            return
+        self._app = app
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._stop.clear()
+        self._heartbeat.start()
+        self._watchdog = threading.Thread(
+            target=self._watch, name="snapnsend-loop-watchdog", daemon=True
+        )
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stop.set()
+        await self._heartbeat.stop()
+        if self._watchdog is not None:
+            await asyncio.to_thread(self._watchdog.join)
+            self._watchdog = None
+
+    def track_request(self, task: asyncio.Task, scope: dict):
+        self._requests[task] = scope
+
+    def untrack_request(self, task: asyncio.Task):
+        self._requests.pop(task, None)
+
+    def _on_beat(self, beat: float, gap: float):
+        loop_lag_seconds.observe(max(0.0, gap - self.interval))
+        # The stall may have started right after the previous beat,
+        # so all of the gap counts, not only the lag
+        if gap > self.threshold:
+            self._report_stall(gap, beat)
+
+    def _watch(self):
+        # A stall longer than the threshold starts at most one interval
+        # after a beat, so the loop is still blocked when the heartbeat
+        # is a quarter of the threshold overdue; captures of shorter
+        # stalls are never reported
+        period = max(self.threshold / 8, 0.005)
+        while not self._stop.wait(period):
+            beat = self._heartbeat.last_beat
+            overdue = time.perf_counter() - beat - self.interval
+            if overdue <= self.threshold / 4:
+                continue
+            capture = self._capture
+            if capture is not None and capture[0] == beat:
+                continue  # This stall is captured already
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            task = asyncio.current_task(self._loop)
+            # The request may be finished by the time the stall is reported
+            scope = self._requests.get(task) if task is not None else None
+            self._capture = (
+                beat, task, scope, traceback.extract_stack(frame, limit=15)
+            )
+
+    def _route(self, scope: Optional[dict]) -> str:
+        if scope is None:
+            return BACKGROUND
+        routes = getattr(getattr(self._app, "router", None), "routes", None) or []
+        for route in routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return f"{scope.get('method', '')} {route.path}"
+        return f"{scope.get('method', '')} <unmatched>"
+
+    def _report_stall(self, duration: float, beat: float):
+        capture, self._capture = self._capture, None
+        if capture is not None and capture[0] == beat:
+            _, task, scope, stack = capture
+            route = self._route(scope)
+        else:
+            # Over before the watchdog looked
+            task, stack, route = None, None, UNKNOWN
+        loop_blocked_total.inc(route=route)
+        loop_blocked_seconds.observe(duration)
+
+        coroutine = task.get_coro().__qualname__ if task is not None else "unknown"
+        where = "".join(traceback.format_list(stack)) if stack else "  (not captured)\n"
+        logger.warning(
+            f"Event loop blocked for {duration:.3f}s in {route} "
+            f"(task {coroutine}), blocking call:\n{where.rstrip()}"
+        )
+
+
+class LoopMonitorMiddleware:
+    """Pure ASGI middleware mapping request tasks to their scope"""
+
+    def __init__(self, app, monitor: Optional[LoopMonitor] = None):
+        self.app = app
+        self.monitor = monitor or loop_monitor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        task = asyncio.current_task()
+        self.monitor.track_request(task, scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.monitor.untrack_request(task)
+
+
+# Global loop monitor instance
+loop_monitor = LoopMonitor(
+    settings.loop_monitor_interval_seconds,
+    settings.loop_monitor_threshold_seconds
+)
@@ -0,0 +1,170 @@
+"""
+Minimal in-process metrics registry with Prometheus text exposition.
+
+Metrics are process-local; with several workers each one reports its
+own values and the scraper aggregates them.
+"""
+
+import bisect
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Optional, Tuple
+
+LabelValues = Tuple[str, ...]
+
+
+class _Metric(ABC):
+    type_name = ""
+
+    def __init__(self, name: str, help_text: str,
+                 label_names: Iterable[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def _format_labels(self, key: LabelValues, extra: str = "") -> str:
+        parts = [
+            f'{name}="{value}"' for name, value in zip(self.label_names, key)
+        ]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """Sample lines of the metric in the text exposition format"""
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing value"""
+
+    type_name = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{self._format_labels(key)} {value}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """Distribution of observations over fixed buckets"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str,
+                 label_names: Iterable[str] = (),
+                 buckets: Iterable[float] = (
+                     0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0
+                 )):
+        super().__init__(name, help_text, label_names)
+        self.buckets = sorted(buckets)
+        # label values -> (bucket counts, sum, count)
+        self._values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.setdefault(
+                key, [[0] * len(self.buckets), 0.0, 0]
+            )
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = self._format_labels(key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = self._format_labels(key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds all metrics of the process, one instance per name"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif type(metric) is not cls:
+                raise ValueError(f"Metric {name} already registered as {metric.type_name}")
+            return metric
+
+    def counter(self, name: str, help_text: str,
+                label_names: Iterable[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, help_text, label_names)
+
+    def gauge(self, name: str, help_text: str,
+              label_names: Iterable[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, help_text, label_names)
+
+    def histogram(self, name: str, help_text: str,
+                  label_names: Iterable[str] = (),
+                  buckets: Optional[Iterable[float]] = None) -> Histogram:
+        kwargs = {"buckets": buckets} if buckets is not None else {}
+        return self._get_or_create(
+            Histogram, name, help_text, label_names, **kwargs
+        )
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        return "\n".join(
+            metric.render() for metric in self._metrics.values()
+        ) + "\n"
+
+
+# Global metrics registry
+metrics = MetricsRegistry()
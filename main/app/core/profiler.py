@@ -0,0 +1,197 @@
+"""
+Statistical profiler for a running worker.
+
+A sampler thread reads the stacks of the event loop thread (or of all
+threads) every few milliseconds via sys._current_frames() and counts
+them in the collapsed format flamegraph.pl, speedscope and inferno read:
+
+    MainThread;run (asyncio/runners.py:118);...;_send_message (app/utils/email_service.py:103) 42
+
+At the same time the loop monitor's Heartbeat measures scheduling lag
+from the last beat. Whenever no beat has happened for longer than the
+stall threshold, the loop is stuck in one callback; the sampler then
+records that callback's stack, so blocking calls (smtplib, sqlite, PIL
+in coroutines) show up with where they came from.
+
+Nothing runs unless a profile is requested (see GET /admin/profile);
+the cost while profiling is one stack walk per interval.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from .loop_monitor import Heartbeat
+
+_short_paths: Dict[str, str] = {}
+
+
+def short_path(filename: str) -> str:
+    """File name relative to the sys.path entry it was imported from"""
+    path = _short_paths.get(filename)
+    if path is None:
+        path = filename
+        for root in sorted((p for p in sys.path if p), key=len, reverse=True):
+            root = os.path.join(os.path.abspath(root), "")
+            if filename.startswith(root):
+                path = filename[len(root):]
+                break
+        _short_paths[filename] = path
+    return path
+
+
+def collapse_stack(frame, root: str = "") -> str:
+    """One collapsed-format stack line (without count), outermost first"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({short_path(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    if root:
+        names.append(root)
+    return ";".join(reversed(names))
+
+
+def lag_summary(samples: List[float]) -> Dict[str, Optional[float]]:
+    if not samples:
+        return {"count": 0, "p50": None, "p99": None, "max": None}
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p99": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))],
+        "max": ordered[-1],
+    }
+
+
+class SamplingProfiler:
+    """
+    Samples stacks and event loop lag until stopped.
+
+    Args:
+        interval: Seconds between samples
+        stall_threshold: Heartbeat delay after which the loop counts as
+            blocked and the blocking stack is recorded
+        all_threads: Sample every thread instead of only the loop thread
+    """
+
+    def __init__(self, interval: float = 0.005, stall_threshold: float = 0.1,
+                 all_threads: bool = False):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.all_threads = all_threads
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.lags: List[float] = []
+        self.stalls: List[dict] = []
+        self._loop_thread = 0
+        self._heartbeat = Heartbeat(interval * 2, self._on_beat)
+        self._stall_started = 0.0
+        self._stall_stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started = 0.0
+        self.duration = 0.0
+
+    def start(self):
+        """Start profiling the running loop; call from the loop thread"""
+        self._loop_thread = threading.get_ident()
+        self._started = time.perf_counter()
+        self._heartbeat.start()
+        self._thread = threading.Thread(
+            target=self._sample_loop, name="snapnsend-profiler", daemon=True
+        )
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        await self._heartbeat.stop()
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join)
+        self.duration = time.perf_counter() - self._started
+
+    def _on_beat(self, beat: float, gap: float):
+        self.lags.append(max(0.0, gap - self._heartbeat.interval))
+
+    def _sample_loop(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            frames = sys._current_frames()
+            for ident, frame in frames.items():
+                if ident == own or (not self.all_threads and ident != self._loop_thread):
+                    continue
+                self.stacks[collapse_stack(frame, names.get(ident, str(ident)))] += 1
+            self.samples += 1
+            self._check_stall(frames.get(self._loop_thread))
+        self._check_stall(None, ending=True)
+
+    def _check_stall(self, loop_frame, ending: bool = False):
+        now = time.perf_counter()
+        last_beat = self._heartbeat.last_beat
+        behind = now - last_beat
+        if not ending and behind > self.stall_threshold and loop_frame is not None:
+            if not self._stall_started:
+                self._stall_started = last_beat
+            self._stall_stacks[collapse_stack(loop_frame)] += 1
+        elif self._stall_started:
+            # The stack seen most often during the stall is the blocker
+            stack, count = self._stall_stacks.most_common(1)[0]
+            self.stalls.append({
+                "duration_seconds": now - self._stall_started,
+                "stack": stack,
+                "samples": count,
+            })
+            self._stall_started = 0.0
+            self._stall_stacks = Counter()
+
+    def collapsed(self) -> str:
+        """The samples in collapsed-stack format, one stack per line"""
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+    def report(self) -> dict:
+        return {
+            "duration_seconds": self.duration,
+            "interval_seconds": self.interval,
+            "samples": self.samples,
+            "loop_lag_seconds": lag_summary(self.lags),
+            "stalls": sorted(
+                self.stalls, key=lambda stall: stall["duration_seconds"], reverse=True
+            ),
+            "collapsed": self.collapsed(),
+        }
+
+
+_running = False
+
+
+class ProfilerBusy(RuntimeError):
+    """Another profile is already running in this worker"""
+
+
+async def profile(seconds: float, interval: float, stall_threshold: float,
+                  all_threads: bool = False) -> SamplingProfiler:
+    """
+    Profile this worker for some seconds.
+
+    Raises:
+        ProfilerBusy: If a profile is already running
+    """
+    global _running
+    if _running:
+        raise ProfilerBusy("A profile is already running")
+    _running = True
+    profiler = SamplingProfiler(interval, stall_threshold, all_threads)
+    try:
+        profiler.start()
+        await asyncio.sleep(seconds)
+    finally:
+        await profiler.stop()
+        _running = False
+    return profiler
@@ -0,0 +1,295 @@
+"""
+Rate limiting and admission control for request submission.
+
+Per-user limits are token buckets. With the "redis" backend the bucket
+state lives in Redis and is updated by a single Lua script, so the
+check-and-decrement is atomic across all API nodes. If Redis is not
+configured or not reachable, the limiter falls back to in-process
+buckets so an outage degrades to per-node limits instead of failing
+requests.
+
+On top of that a global concurrency cap bounds the number of requests
+being processed at once. Requests that cannot get a slot within a short
+queue timeout are shed with 429 and a Retry-After header, which keeps
+latency bounded for the requests that are admitted.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+
+from .config import settings
+from ..schemas import SearchRequest
+from ..database.dependencies import connections
+
+logger = logging.getLogger(__name__)
+
+
+# KEYS[1] - bucket key
+# ARGV[1] - bucket capacity, ARGV[2] - refill rate (tokens per second),
+# ARGV[3] - tokens requested
+# Returns {allowed (0/1), retry_after_seconds (string)}
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil or ts == nil then
+    tokens = capacity
+    ts = now
+end
+
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+local allowed = 0
+local retry_after = 0
+if tokens >= requested then
+    tokens = tokens - requested
+    allowed = 1
+else
+    retry_after = (requested - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return {allowed, tostring(retry_after)}
+"""
+
+
+class InMemoryTokenBucket:
+    """Process-local token buckets keyed by an arbitrary string"""
+
+    def __init__(self, capacity: int, refill_rate: float):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self._buckets = {}
+
+    def hit(self, key: str, tokens: int = 1) -> Tuple[bool, float]:
+        """
+        Try to take tokens from the bucket for the given key.
+
+        Returns:
+            Tuple of (allowed, retry_after_seconds)
+        """
+        now = time.monotonic()
+        available, last = self._buckets.get(key, (self.capacity, now))
+        available = min(
+            self.capacity, available + (now - last) * self.refill_rate
+        )
+
+        if available >= tokens:
+            self._buckets[key] = (available - tokens, now)
+            return True, 0.0
+
+        self._buckets[key] = (available, now)
+        return False, (tokens - available) / self.refill_rate
+
+    def prune(self):
+        """Drop buckets that have refilled completely"""
+        now = time.monotonic()
+        full_after = self.capacity / self.refill_rate
+        stale = [
+            key for key, (_, last) in self._buckets.items()
+            if now - last >= full_after
+        ]
+        for key in stale:
+            del self._buckets[key]
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter backed by Redis with an in-memory fallback.
+    """
+
+    # How long to stay on the in-memory fallback after a Redis error
+    REDIS_RETRY_INTERVAL = 30.0
+
+    def __init__(
+        self,
+        capacity: int,
+        window_seconds: float,
+        backend: str = "memory",
+        redis_url: Optional[str] = None,
+        key_prefix: str = "ratelimit",
+    ):
+        self.capacity = capacity
+        self.refill_rate = capacity / window_seconds
+        self.backend = backend
+        self.redis_url = redis_url
+        self.key_prefix = key_prefix
+        self._memory = InMemoryTokenBucket(capacity, self.refill_rate)
+        self._redis = None
+        self._redis_disabled_until = 0.0
+        self._calls = 0
+
+    def _get_redis(self):
+        """The shared Redis pool, else a lazily created client, if enabled"""
+        if self.backend != "redis" or not self.redis_url:
+            return None
+        if time.monotonic() < self._redis_disabled_until:
+            return None
+        # The app lifespan opens one pool per process; share it
+        shared = connections.shared_redis(self.redis_url)
+        if shared is not None:
+            return shared
+        if self._redis is None:
+            try:
+                import redis.asyncio as aioredis
+            except ImportError:
+                logger.warning(
+                    "redis package not installed, using in-memory "
+                    "rate limiting"
+                )
+                self.backend = "memory"
+                return None
+            self._redis = aioredis.from_url(self.redis_url)
+        return self._redis
+
+    async def hit(self, key: str, tokens: int = 1) -> Tuple[bool, float]:
+        """
+        Consume tokens for the given key.
+
+        Returns:
+            Tuple of (allowed, retry_after_seconds)
+        """
+        redis_client = self._get_redis()
+        if redis_client is not None:
+            try:
+                allowed, retry_after = await redis_client.eval(
+                    TOKEN_BUCKET_SCRIPT, 1,
+                    f"{self.key_prefix}:{key}",
+                    self.capacity, self.refill_rate, tokens
+                )
+                return bool(int(allowed)), float(retry_after)
+            except Exception as e:
+                logger.warning(
+                    f"Redis rate limiter unavailable, falling back to "
+                    f"in-memory buckets: {str(e)}"
+                )
+                self._redis_disabled_until = (
+                    time.monotonic() + self.REDIS_RETRY_INTERVAL
+                )
+
+        # Keep the in-memory table from growing without bound
+        self._calls += 1
+        if self._calls % 1000 == 0:
+            self._memory.prune()
+        return self._memory.hit(key, tokens)
+
+
+class AdmissionController:
+    """
+    Global concurrency cap with a short FIFO wait queue and load shedding.
+    """
+
+    def __init__(self, max_concurrent: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters = deque()
+
+    async def acquire(self) -> bool:
+        """
+        Take a processing slot, waiting at most queue_timeout seconds.
+
+        Returns:
+            bool: True if a slot was acquired, False if the request
+            should be shed
+        """
+        if self.in_flight < self.max_concurrent and not self._waiters:
+            self.in_flight += 1
+            return True
+
+        if self.queue_timeout <= 0:
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+            # The slot was handed over by release()
+            return True
+        except asyncio.TimeoutError:
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # A slot was handed over just before the cancellation
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self):
+        """Release a slot, handing it directly to the oldest waiter"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight = max(0, self.in_flight - 1)
+
+    def retry_after(self) -> int:
+        """Suggested Retry-After (in seconds) for shed requests"""
+        return max(1, math.ceil(self.queue_timeout))
+
+
+# Global limiter instances
+rate_limiter = RateLimiter(
+    capacity=settings.rate_limit_requests,
+    window_seconds=settings.rate_limit_window_seconds,
+    backend=settings.rate_limit_backend,
+    redis_url=settings.redis_url,
+)
+admission_controller = AdmissionController(
+    max_concurrent=settings.max_concurrent_requests,
+    queue_timeout=settings.admission_queue_timeout,
+)
+
+
+async def enforce_user_rate_limit(
+    http_request: Request, request: SearchRequest
+):
+    """Dependency that applies the per-user token bucket"""
+    if request.user is not None:
+        key = f"user:{request.user}"
+    else:
+        client_host = http_request.client.host if http_request.client else ""
+        key = f"anon:{client_host}"
+
+    allowed, retry_after = await rate_limiter.hit(key)
+    if not allowed:
+        logger.warning(f"Rate limit exceeded for {key}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Rate limit exceeded",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+
+async def admission_control():
+    """Dependency that holds a global concurrency slot for the request"""
+    if not await admission_controller.acquire():
+        logger.warning(
+            f"Shedding request: {admission_controller.in_flight} requests "
+            f"in flight"
+        )
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Server is busy, please retry later",
+            headers={"Retry-After": str(admission_controller.retry_after())}
+        )
+    try:
+        yield
+    finally:
+        admission_controller.release()
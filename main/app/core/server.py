@@ -0,0 +1,251 @@
+"""
+Production launcher: a prefork supervisor running N uvicorn workers.
+
+Each worker is a separate process with its own event loop (uvloop and
+httptools when installed). Where the OS supports SO_REUSEPORT every
+worker binds its own listening socket on the same address and the kernel
+spreads incoming connections across them; elsewhere the supervisor binds
+one socket that all workers inherit.
+
+On SIGTERM / SIGINT the supervisor forwards SIGTERM to the workers.
+uvicorn then stops accepting connections, lets in-flight requests
+finish for up to settings.drain_timeout_seconds, and runs the lifespan
+shutdown, which waits for in-flight image jobs as well. Workers that
+are still alive after that are killed.
+
+Workers that die unexpectedly are restarted with exponential backoff
+(settings.server_restart_backoff_seconds, doubled per crash in a row up
+to settings.server_restart_backoff_max_seconds). A worker that crashes
+more than settings.server_max_restarts times in a row, without staying
+up for the maximum backoff in between, makes the supervisor stop the
+other workers and exit with status 1, so a broken deployment fails
+visibly instead of crash-looping.
+"""
+
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from typing import Dict, Optional
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+APP = "app.main:app"
+
+# Seconds on top of the drain timeout before workers are killed
+KILL_GRACE_SECONDS = 5
+
+
+def reuse_port_supported() -> bool:
+    return hasattr(socket, "SO_REUSEPORT")
+
+
+def bind_socket(host: str, port: int, reuse_port: bool = False,
+                backlog: int = 2048) -> socket.socket:
+    """Create a listening TCP socket"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _best_implementations():
+    """uvloop / httptools when installed, the pure-Python ones otherwise"""
+    try:
+        import uvloop  # noqa: F401
+        loop = "uvloop"
+    except ImportError:
+        loop = "asyncio"
+    try:
+        import httptools  # noqa: F401
+        http = "httptools"
+    except ImportError:
+        http = "h11"
+    return loop, http
+
+
+def _run_worker(host: str, port: int, sock: Optional[socket.socket],
+                log_level: str):
+    """Entry point of a worker process"""
+    import uvicorn
+
+    if sock is None:
+        sock = bind_socket(host, port, reuse_port=True)
+
+    loop, http = _best_implementations()
+    config = uvicorn.Config(
+        APP,
+        loop=loop,
+        http=http,
+        log_level=log_level,
+        timeout_graceful_shutdown=int(settings.drain_timeout_seconds),
+    )
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+
+class Supervisor:
+    """
+    Starts, watches and stops the worker processes.
+
+    Args:
+        host: Address to listen on
+        port: Port to listen on
+        workers: Number of worker processes
+        log_level: uvicorn log level
+    """
+
+    def __init__(self, host: str, port: int, workers: int,
+                 log_level: str = "info"):
+        self.host = host
+        self.port = port
+        self.workers = max(1, workers)
+        self.log_level = log_level
+        self.reuse_port = reuse_port_supported()
+        self._shared_socket: Optional[socket.socket] = None
+        self._processes: Dict[int, multiprocessing.Process] = {}
+        self._started: Dict[int, float] = {}
+        # Slot -> crashes in a row / time its restart is due
+        self._crashes: Dict[int, int] = {}
+        self._restart_at: Dict[int, float] = {}
+        self._stopping = False
+        # spawn gives every worker a fresh interpreter without the
+        # supervisor's state (event loops, threads, connections)
+        self._context = multiprocessing.get_context("spawn")
+
+    def _spawn(self, slot: int):
+        process = self._context.Process(
+            target=_run_worker,
+            args=(self.host, self.port, self._shared_socket, self.log_level),
+            name=f"snapnsend-worker-{slot}",
+        )
+        process.start()
+        self._processes[slot] = process
+        self._started[slot] = time.monotonic()
+        logger.info(f"Started worker {slot} (pid {process.pid})")
+
+    def _handle_stop(self, signum, frame):
+        if not self._stopping:
+            logger.info("Shutting down workers, draining in-flight requests...")
+        self._stopping = True
+
+    def _stop_workers(self):
+        for process in self._processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+
+        deadline = time.monotonic() + settings.drain_timeout_seconds + KILL_GRACE_SECONDS
+        for process in self._processes.values():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Killing worker pid {process.pid} after drain timeout")
+                process.kill()
+                process.join()
+
+    def _schedule_restart(self, slot: int, process: multiprocessing.Process) -> bool:
+        """
+        Schedule the restart of a crashed worker.
+
+        Returns:
+            bool: False if the worker crashed too often to restart it
+        """
+        now = time.monotonic()
+        if now - self._started[slot] >= settings.server_restart_backoff_max_seconds:
+            # It ran fine for a while; this is not a crash loop
+            self._crashes[slot] = 0
+        crashes = self._crashes.get(slot, 0) + 1
+        self._crashes[slot] = crashes
+        if crashes > settings.server_max_restarts:
+            logger.error(
+                f"Worker {slot} (pid {process.pid}) exited with "
+                f"{process.exitcode}, {crashes} crashes in a row, giving up"
+            )
+            return False
+
+        delay = min(
+            settings.server_restart_backoff_seconds * 2 ** (crashes - 1),
+            settings.server_restart_backoff_max_seconds
+        )
+        logger.warning(
+            f"Worker {slot} (pid {process.pid}) exited with "
+            f"{process.exitcode}, restarting in {delay:.1f}s"
+        )
+        self._restart_at[slot] = now + delay
+        return True
+
+    def run(self) -> int:
+        """
+        Run until SIGTERM / SIGINT.
+
+        Returns:
+            The exit code: 0, or 1 if a worker kept crashing
+        """
+        if not self.reuse_port:
+            self._shared_socket = bind_socket(self.host, self.port)
+        elif self.port == 0:
+            raise ValueError("A fixed port is required with SO_REUSEPORT")
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+
+        loop, http = _best_implementations()
+        logger.info(
+            f"Starting {self.workers} workers on http://{self.host}:{self.port} "
+            f"(loop={loop}, http={http}, "
+            f"{'SO_REUSEPORT' if self.reuse_port else 'shared socket'})"
+        )
+        for slot in range(self.workers):
+            self._spawn(slot)
+
+        exit_code = 0
+        while not self._stopping:
+            time.sleep(0.1)
+            for slot, process in list(self._processes.items()):
+                if self._stopping:
+                    break
+                if process.is_alive() or slot in self._restart_at:
+                    continue
+                if not self._schedule_restart(slot, process):
+                    self._stopping = True
+                    exit_code = 1
+
+            now = time.monotonic()
+            for slot, due in list(self._restart_at.items()):
+                if due <= now and not self._stopping:
+                    del self._restart_at[slot]
+                    self._spawn(slot)
+
+        self._stop_workers()
+        if self._shared_socket is not None:
+            self._shared_socket.close()
+        return exit_code
+
+
+def run_production(host: Optional[str] = None, port: Optional[int] = None,
+                   workers: Optional[int] = None) -> int:
+    """
+    Run the API with the production supervisor.
+
+    Args:
+        host: Address to listen on, defaults to settings.server_host
+        port: Port to listen on, defaults to settings.server_port
+        workers: Worker processes, defaults to settings.server_workers
+            (0 = one per CPU core)
+    """
+    workers = settings.server_workers if workers is None else workers
+    supervisor = Supervisor(
+        host or settings.server_host,
+        settings.server_port if port is None else port,
+        workers or os.cpu_count() or 1,
+        log_level=settings.log_level.lower(),
+    )
+    return supervisor.run()
@@ -1,62 +1,203 @@
+"""
+Shared connections to Redis and RabbitMQ, owned by the app lifespan.
+
+The lifespan opens them once per worker process with init_connections()
+and closes them with close_connections(); everything else (rate limits,
+API quotas, endpoints) borrows from the same warm pools:
+
+- Redis: one connection pool capped at settings.redis_max_connections,
+  with connections checked every settings.redis_health_check_interval
+  seconds before reuse. The pool connects lazily, so Redis may come up
+  after the API does.
+- RabbitMQ: one robust connection (reconnects and restores its channels
+  on its own) and a pool of up to settings.rabbitmq_channel_pool_size
+  channels with publisher confirms, so publish() returns once the
+  broker has the message.
+
+Endpoints use the get_redis / get_rabbitmq_channel dependencies, which
+answer 503 while the service is unavailable. redis and aio_pika are
+imported when the connections are opened.
+"""
+
+import logging
+import time
 from contextlib import asynccontextmanager
-from fastapi import HTTPException
-import aioredis
-import aio_pika
-from .core.config import settings
+from typing import AsyncIterator, Optional
+
+from fastapi import HTTPException, status
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionManager:
+    """Holds the process-wide Redis pool and RabbitMQ channel pool"""
+
+    # How long to wait before retrying a failed RabbitMQ connect
+    RABBITMQ_RETRY_INTERVAL = 30.0
+
+    def __init__(self):
+        self.redis = None
+        self.redis_url: Optional[str] = None
+        self._rabbitmq = None
+        self._channels = None
+        self._rabbitmq_retry_at = 0.0
+
+    async def init_redis(self, url: Optional[str] = None):
+        """Create the Redis connection pool and check that Redis answers"""
+        if self.redis is not None:
+            return
+        try:
+            import redis.asyncio as aioredis
+        except ImportError:
+            logger.warning("redis package not installed, Redis disabled")
+            return
+
+        self.redis_url = url or settings.redis_url
+        pool = aioredis.ConnectionPool.from_url(
+            self.redis_url,
+            max_connections=settings.redis_max_connections,
+            health_check_interval=settings.redis_health_check_interval,
+            socket_connect_timeout=settings.redis_connect_timeout,
+        )
+        self.redis = aioredis.Redis(connection_pool=pool)
+        try:
+            await self.redis.ping()
+            logger.info(f"Connected to Redis at {self.redis_url}")
+        except Exception as e:
+            # Keep the pool; it reconnects once Redis is reachable
+            logger.warning(
+                f"Redis at {self.redis_url} unavailable: {str(e)}"
+            )
+
+    async def _open_channel(self):
+        return await self._rabbitmq.channel(publisher_confirms=True)
 
+    async def init_rabbitmq(self, url: Optional[str] = None) -> bool:
+        """
+        Open the RabbitMQ connection and its channel pool.
 
-# Global instances for external services
-_redis_client = None
-_rabbitmq_connection = None
+        Returns:
+            True if the connection is open
+        """
+        if self._rabbitmq is not None:
+            return True
+        if time.monotonic() < self._rabbitmq_retry_at:
+            return False
+        try:
+            import aio_pika
+            from aio_pika.pool import Pool
+        except ImportError:
+            logger.warning("aio_pika package not installed, RabbitMQ disabled")
+            self._rabbitmq_retry_at = float("inf")
+            return False
 
+        url = url or settings.rabbitmq_url
+        try:
+            self._rabbitmq = await aio_pika.connect_robust(
+                url, timeout=settings.rabbitmq_connect_timeout
+            )
+        except Exception as e:
+            logger.warning(f"RabbitMQ at {url} unavailable: {str(e)}")
+            self._rabbitmq_retry_at = (
+                time.monotonic() + self.RABBITMQ_RETRY_INTERVAL
+            )
+            return False
 
-async def get_redis_client():
-    """Dependency to get Redis client"""
-    global _redis_client
-    if _redis_client is None:
-        _redis_client = aioredis.from_url(settings.redis_url)
-    return _redis_client
+        self._channels = Pool(
+            self._open_channel, max_size=settings.rabbitmq_channel_pool_size
+        )
+        logger.info(f"Connected to RabbitMQ at {url}")
+        return True
+
+    def shared_redis(self, url: Optional[str]):
+        """The pooled Redis client if it serves url, otherwise None"""
+        if self.redis is not None and url == self.redis_url:
+            return self.redis
+        return None
+
+    @asynccontextmanager
+    async def channel(self) -> AsyncIterator:
+        """
+        Borrow a RabbitMQ channel from the pool.
+
+        Raises:
+            ConnectionError: If RabbitMQ is unavailable
+        """
+        if not await self.init_rabbitmq():
+            raise ConnectionError("RabbitMQ is unavailable")
+        async with self._channels.acquire() as channel:
+            if channel.is_closed:
+                await channel.reopen()
+            yield channel
 
+    async def publish(self, routing_key: str, body: bytes, **properties):
+        """
+        Publish a persistent message to the default exchange.
 
-async def get_rabbitmq_connection():
-    """Dependency to get RabbitMQ connection"""
-    global _rabbitmq_connection
-    if _rabbitmq_connection is None:
-        _rabbitmq_connection = await aio_pika.connect_robust(
-            settings.rabbitmq_url
+        Returns once the broker confirmed the message.
+
+        Args:
+            routing_key: Queue name
+            body: Message body
+            **properties: Extra aio_pika.Message properties
+        """
+        import aio_pika
+
+        message = aio_pika.Message(
+            body, delivery_mode=aio_pika.DeliveryMode.PERSISTENT, **properties
         )
-    return _rabbitmq_connection
+        async with self.channel() as channel:
+            await channel.default_exchange.publish(
+                message, routing_key=routing_key,
+                timeout=settings.rabbitmq_publish_timeout
+            )
+
+    async def close(self):
+        if self._channels is not None:
+            await self._channels.close()
+            self._channels = None
+        if self._rabbitmq is not None:
+            await self._rabbitmq.close()
+            self._rabbitmq = None
+        if self.redis is not None:
+            await self.redis.aclose()
+            self.redis = None
+        self._rabbitmq_retry_at = 0.0
+
 
+# Global connection manager instance
+connections = ConnectionManager()
 
-# Example of how to use these dependencies in endpoints
-async def get_db_session():  # Placeholder for database session
-    """Placeholder for database session dependency"""
-    try:
-        # In a real implementation, you would yield a database session
-        yield None
-    except Exception as e:
-        # Handle database session errors
+
+async def init_connections():
+    """Open the shared connections; called from the app lifespan"""
+    await connections.init_redis()
+    await connections.init_rabbitmq()
+
+
+async def close_connections():
+    """Close the shared connections; called from the app lifespan"""
+    await connections.close()
+
+
+async def get_redis():
+    """Dependency that provides the pooled Redis client"""
+    if connections.redis is None:
         raise HTTPException(
-            status_code=500, detail=f"Database error: {str(e)}"
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Redis is unavailable"
         )
+    return connections.redis
 
 
-# Context manager for managing external service lifecycle
-@asynccontextmanager
-async def lifespan_services(app):
-    """Manage the lifecycle of external services"""
-    redis_client = None
-    rabbitmq_conn = None
-
-    try:
-        # Initialize services
-        redis_client = await get_redis_client()
-        rabbitmq_conn = await get_rabbitmq_connection()
-
-        yield {"redis": redis_client, "rabbitmq": rabbitmq_conn}
-    finally:
-        # Cleanup services
-        if redis_client:
-            await redis_client.close()
-        if rabbitmq_conn:
-            await rabbitmq_conn.close()
+async def get_rabbitmq_channel():
+    """Dependency that lends a pooled RabbitMQ channel for the request"""
+    if not await connections.init_rabbitmq():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="RabbitMQ is unavailable"
+        )
+    async with connections.channel() as channel:
+        yield channel
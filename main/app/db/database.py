@@ -1,7 +1,9 @@
 import sqlite3
-from typing import Optional
+import time
+from typing import List, Optional
 from contextlib import contextmanager
 from ..models.user import User
+from ..ai.checkpoints import RequestCheckpoint
 
 
 class DatabaseManager:
@@ -24,6 +26,37 @@ class DatabaseManager:
                 )
             ''')
 
+            # Request ID -> folder of its files in the downloads tree
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS request_folders (
+                    request_id TEXT PRIMARY KEY,
+                    user_name TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    created_at TEXT NOT NULL
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_request_folders_path
+                ON request_folders (path)
+            ''')
+
+            # Per-stage progress of requests, see app.ai.checkpoints.
+            # lease_until keeps other workers from resuming a request
+            # that is still being processed
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS request_checkpoints (
+                    request_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    lease_until REAL NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_request_checkpoints_status
+                ON request_checkpoints (status)
+            ''')
+
             conn.commit()
 
     @contextmanager
@@ -155,3 +188,165 @@ class DatabaseManager:
                     created_at=datetime.fromisoformat(row[3])
                 ))
             return users
+
+    def save_request_folder(
+        self, request_id: str, user_name: str, path: str
+    ):
+        """Record (or move) the folder of a request's files."""
+        from datetime import datetime
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                '''INSERT OR REPLACE INTO request_folders
+                   (request_id, user_name, path, created_at)
+                   VALUES (?, ?, ?, ?)''',
+                (request_id, user_name, path, datetime.utcnow().isoformat())
+            )
+            conn.commit()
+
+    def get_request_folder(self, request_id: str) -> Optional[str]:
+        """Retrieve the folder of a request's files."""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT path FROM request_folders WHERE request_id = ?',
+                (request_id,)
+            )
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    def delete_request_folder(self, path: str):
+        """Forget a request folder that was deleted from disk."""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'DELETE FROM request_folders WHERE path = ?', (path,)
+            )
+            conn.commit()
+
+    def save_checkpoint(
+        self, checkpoint: RequestCheckpoint, lease_seconds: float = 0
+    ):
+        """Store the progress of a request, holding its lease for lease_seconds."""
+        from datetime import datetime
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                '''INSERT OR REPLACE INTO request_checkpoints
+                   (request_id, status, data, lease_until, updated_at)
+                   VALUES (?, ?, ?, ?, ?)''',
+                (
+                    checkpoint.request_id, checkpoint.status,
+                    checkpoint.to_json(), time.time() + lease_seconds,
+                    datetime.utcnow().isoformat()
+                )
+            )
+            conn.commit()
+
+    def get_checkpoint(self, request_id: str) -> Optional[RequestCheckpoint]:
+        """Retrieve the progress of a request."""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT data FROM request_checkpoints WHERE request_id = ?',
+                (request_id,)
+            )
+            row = cursor.fetchone()
+            return RequestCheckpoint.from_json(row[0]) if row else None
+
+    def claim_interrupted_checkpoints(
+        self, lease_seconds: float
+    ) -> List[RequestCheckpoint]:
+        """
+        Take over unfinished requests whose lease has run out.
+
+        Each request is claimed by exactly one caller, also across
+        processes sharing the database.
+        """
+        now = time.time()
+        claimed = []
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                '''SELECT request_id, data FROM request_checkpoints
+                   WHERE status IN ('pending', 'processing')
+                   AND lease_until < ?''',
+                (now,)
+            )
+            for request_id, data in cursor.fetchall():
+                cursor.execute(
+                    '''UPDATE request_checkpoints SET lease_until = ?
+                       WHERE request_id = ? AND lease_until < ?''',
+                    (now + lease_seconds, request_id, now)
+                )
+                if cursor.rowcount:
+                    claimed.append(RequestCheckpoint.from_json(data))
+            conn.commit()
+        return claimed
+
+    def claim_checkpoint(
+        self, request_id: str, lease_seconds: float
+    ) -> Optional[RequestCheckpoint]:
+        """
+        Take over one request for a retry.
+
+        Succeeds for failed requests and for unfinished ones whose lease
+        has run out, atomically like claim_interrupted_checkpoints.
+
+        Returns:
+            The checkpoint, or None if there is none or another worker
+            holds the request
+        """
+        now = time.time()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            # Finished requests are saved without a lease, so this takes
+            # failed ones as well as abandoned unfinished ones
+            cursor.execute(
+                '''UPDATE request_checkpoints SET lease_until = ?
+                   WHERE request_id = ? AND status != 'done'
+                   AND lease_until < ?''',
+                (now + lease_seconds, request_id, now)
+            )
+            claimed = cursor.rowcount
+            conn.commit()
+        return self.get_checkpoint(request_id) if claimed else None
+
+    def renew_checkpoint_leases(
+        self, request_ids: List[str], lease_seconds: float
+    ):
+        """Extend the leases of requests this worker is still running."""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                'UPDATE request_checkpoints SET lease_until = ? WHERE request_id = ?',
+                [(time.time() + lease_seconds, request_id) for request_id in request_ids]
+            )
+            conn.commit()
+
+    def move_checkpoint_images(
+        self, request_id: str, old_folder: str, new_folder: str
+    ):
+        """Update a checkpoint's image paths after its folder was moved."""
+        checkpoint = self.get_checkpoint(request_id)
+        if checkpoint is None:
+            return
+        checkpoint.move_images(old_folder, new_folder)
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            # Only the data: the lease stays with whoever holds it
+            cursor.execute(
+                'UPDATE request_checkpoints SET data = ? WHERE request_id = ?',
+                (checkpoint.to_json(), request_id)
+            )
+            conn.commit()
+
+    def release_checkpoints(self, request_ids: List[str]):
+        """Give up the leases of requests, so another worker may resume them."""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                'UPDATE request_checkpoints SET lease_until = 0 WHERE request_id = ?',
+                [(request_id,) for request_id in request_ids]
+            )
+            conn.commit()
@@ -1,11 +1,20 @@
 import os
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import logging
 
+from .api.admin import router as admin_router
 from .api.routes import router as api_router
 from .core.config import settings
+from .core.loop_monitor import LoopMonitorMiddleware, loop_monitor
+from .ai.image_validation import shutdown_process_pool
+from .core.metrics import metrics
+from .database.dependencies import close_connections, init_connections
+from .services.job_scheduler import job_scheduler
+from .services.retention import downloads_collector
+from .services.request_service import request_service
 
 
 # Configure logging based on environment
@@ -26,18 +35,32 @@ async def lifespan(app: FastAPI):
     )
 
     # Startup logic here
-    # - Initialize Redis connection
-    # - Initialize RabbitMQ connection
+    # - Watch the event loop for blocking calls
+    # - Open the shared Redis pool and RabbitMQ channel pool
     # - Initialize database connections
+    if settings.loop_monitor_enabled:
+        loop_monitor.start(app)
     logger.info(f"Connecting to Redis at {settings.redis_url}")
     logger.info(f"Connecting to RabbitMQ at {settings.rabbitmq_url}")
+    await init_connections()
+    await request_service.startup()
+    job_scheduler.start()
+    downloads_collector.start()
 
     yield  # Application runs here
 
     # Shutdown logic here
-    # - Close Redis connection
-    # - Close RabbitMQ connection
+    # - Let in-flight image jobs finish
+    # - Close the Redis and RabbitMQ pools
     # - Close database connections
+    if not await request_service.drain(settings.drain_timeout_seconds):
+        logger.warning("Shutting down with image jobs still in flight")
+    await job_scheduler.stop()
+    request_service.release_unfinished()
+    await downloads_collector.stop()
+    await close_connections()
+    shutdown_process_pool()
+    await loop_monitor.stop()
     logger.info("Shutting down SnapNSend API...")
 
 
@@ -60,12 +83,20 @@ def create_app() -> FastAPI:
         allow_headers=["*"],
     )
 
+    # Attribute event loop stalls to the request being served
+    app.add_middleware(LoopMonitorMiddleware)
+
     # Include API routes
     app.include_router(
         api_router,
         prefix=settings.api_v1_prefix,
         tags=["requests"]
     )
+    app.include_router(
+        admin_router,
+        prefix=f"{settings.api_v1_prefix}/admin",
+        tags=["admin"]
+    )
 
     return app
 
@@ -84,3 +115,9 @@ async def root():
         "status": "running",
         "debug": settings.debug
     }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Process metrics in the Prometheus text format"""
+    return metrics.render()
@@ -25,8 +25,8 @@ class SearchRequest(BaseModel):
 
 class SearchResponse(BaseModel):
     request_id: UUID
-    status: Literal["pending", "processing", "done", "error"]
-    images: Optional[List[str]] = None
+    status: Literal["pending", "processing", "done", "done_with_errors", "error"]
+    images: Optional[List[str]] = None  # URLs of the downloaded images
     error: Optional[str] = None
 
 
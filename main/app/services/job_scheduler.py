@@ -0,0 +1,246 @@
+"""
+Scheduler for image jobs: priority lanes with per-user fair queuing.
+
+Every job goes into one of three lanes, highest priority first:
+
+- interactive: mode="sync" requests, a client is waiting on the response
+- small: requests for at most settings.scheduler_small_job_max_images
+- bulk: everything else
+
+Each lane has its own workers (settings.scheduler_*_workers). A worker
+takes the next job from the highest priority non-empty lane at or above
+its own, so idle bulk workers help with small and interactive jobs but
+interactive workers never pick up bulk jobs. Heavy jobs therefore can't
+occupy the capacity reserved for the typical ones.
+
+Within a lane, users are served by deficit round robin: each user with
+queued jobs gets a quantum of settings.scheduler_quantum images per
+round and a job runs once the user's accumulated deficit covers its
+image count. A user queueing a hundred 50-image jobs gets the same
+share of a lane as a user with a single 3-image job, instead of
+everybody waiting behind the whole backlog.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from ..core.config import settings
+from ..core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+LANES = ("interactive", "small", "bulk")
+
+queued_jobs = metrics.gauge(
+    "snapnsend_scheduler_queued_jobs", "Jobs waiting for a worker", ["lane"]
+)
+running_jobs = metrics.gauge(
+    "snapnsend_scheduler_running_jobs", "Jobs being processed", ["lane"]
+)
+queue_wait_seconds = metrics.histogram(
+    "snapnsend_scheduler_wait_seconds", "Time jobs spent queued", ["lane"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+
+
+@dataclass
+class Job:
+    """A unit of work queued for a user"""
+    user: str
+    cost: int
+    lane: str
+    func: Callable[[], Awaitable[Any]]
+    future: asyncio.Future
+    queued_at: float = field(default_factory=time.monotonic)
+
+
+class FairQueue:
+    """
+    Deficit round robin over per-user FIFO queues.
+
+    Args:
+        quantum: Cost credited to a user at the start of each of its turns
+    """
+
+    def __init__(self, quantum: int):
+        self.quantum = max(1, quantum)
+        # Users with queued jobs, in round robin order; the first one
+        # has the current turn
+        self._queues: "OrderedDict[str, Deque[Job]]" = OrderedDict()
+        self._deficits: Dict[str, int] = {}
+        self._in_turn = False
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def push(self, job: Job):
+        queue = self._queues.get(job.user)
+        if queue is None:
+            queue = self._queues[job.user] = deque()
+            self._deficits[job.user] = 0
+        queue.append(job)
+        self._size += 1
+
+    def pop(self) -> Optional[Job]:
+        """Next job in DRR order, or None if the queue is empty"""
+        while self._queues:
+            user, queue = next(iter(self._queues.items()))
+            if not self._in_turn:
+                self._deficits[user] += self.quantum
+                self._in_turn = True
+
+            if queue[0].cost <= self._deficits[user]:
+                job = queue.popleft()
+                self._deficits[user] -= job.cost
+                self._size -= 1
+                if not queue:
+                    # Idle users don't keep credit
+                    del self._queues[user]
+                    del self._deficits[user]
+                    self._in_turn = False
+                return job
+
+            # Turn over, the deficit carries to the user's next turn
+            self._queues.move_to_end(user)
+            self._in_turn = False
+        return None
+
+
+class JobScheduler:
+    """
+    Runs jobs on per-lane worker tasks.
+
+    Args:
+        workers: Worker count per lane
+        quantum: DRR quantum in images
+        small_job_max_images: Largest job that goes to the small lane
+        max_queued: Queued jobs above which submit() rejects new ones
+    """
+
+    def __init__(self, workers: Dict[str, int], quantum: int,
+                 small_job_max_images: int, max_queued: int):
+        self.workers = workers
+        self.small_job_max_images = small_job_max_images
+        self.max_queued = max_queued
+        self._queues = {lane: FairQueue(quantum) for lane in LANES}
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Condition] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def lane_for(self, num_images: int, mode: str) -> str:
+        if mode == "sync":
+            return "interactive"
+        if num_images <= self.small_job_max_images:
+            return "small"
+        return "bulk"
+
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def start(self):
+        """Start the workers on the running loop (idempotent)"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._tasks = []
+        self._loop = loop
+        self._wakeup = asyncio.Condition()
+        for lane in LANES:
+            for _ in range(max(1, self.workers.get(lane, 1))):
+                self._tasks.append(asyncio.create_task(self._worker(lane)))
+
+    async def stop(self):
+        """Cancel the workers; queued jobs are failed"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+        for lane, queue in self._queues.items():
+            job = queue.pop()
+            while job is not None:
+                if not job.future.done():
+                    job.future.cancel()
+                job = queue.pop()
+            queued_jobs.set(0, lane=lane)
+
+    async def submit(self, user: str, num_images: int, mode: str,
+                     func: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        """
+        Queue a job.
+
+        Args:
+            user: Key jobs are fair-queued by
+            num_images: Images the job produces, its DRR cost
+            mode: "sync" for interactive requests, "async" otherwise
+            func: Coroutine function running the job
+
+        Returns:
+            Future with the result of func
+
+        Raises:
+            asyncio.QueueFull: If settings.scheduler_max_queued_jobs
+                jobs are already waiting
+        """
+        self.start()
+        if self.queued() >= self.max_queued:
+            raise asyncio.QueueFull()
+
+        lane = self.lane_for(num_images, mode)
+        job = Job(user, num_images, lane, func, self._loop.create_future())
+        self._queues[lane].push(job)
+        queued_jobs.inc(lane=lane)
+        async with self._wakeup:
+            self._wakeup.notify_all()
+        return job.future
+
+    def _next_job(self, lane: str) -> Optional[Job]:
+        # Highest priority first, down to the worker's own lane
+        for candidate in LANES[:LANES.index(lane) + 1]:
+            job = self._queues[candidate].pop()
+            if job is not None:
+                queued_jobs.inc(-1, lane=candidate)
+                return job
+        return None
+
+    async def _worker(self, lane: str):
+        while True:
+            async with self._wakeup:
+                job = self._next_job(lane)
+                while job is None:
+                    await self._wakeup.wait()
+                    job = self._next_job(lane)
+
+            queue_wait_seconds.observe(time.monotonic() - job.queued_at, lane=job.lane)
+            running_jobs.inc(lane=job.lane)
+            try:
+                result = await job.func()
+                if not job.future.done():
+                    job.future.set_result(result)
+            except asyncio.CancelledError:
+                job.future.cancel()
+                raise
+            except Exception as e:
+                logger.error(f"Job of {job.user} failed: {str(e)}")
+                if not job.future.done():
+                    job.future.set_exception(e)
+            finally:
+                running_jobs.inc(-1, lane=job.lane)
+
+
+# Global job scheduler instance
+job_scheduler = JobScheduler(
+    workers={
+        "interactive": settings.scheduler_interactive_workers,
+        "small": settings.scheduler_small_workers,
+        "bulk": settings.scheduler_bulk_workers,
+    },
+    quantum=settings.scheduler_quantum,
+    small_job_max_images=settings.scheduler_small_job_max_images,
+    max_queued=settings.scheduler_max_queued_jobs,
+)
@@ -1,4 +1,7 @@
 import asyncio
+import mimetypes
+import os
+import time
 from typing import List, Optional
 from uuid import UUID, uuid4
 from datetime import datetime
@@ -8,7 +11,35 @@ from ..schemas import (
 from ..models.user import User
 from ..utils.email_service import email_service
 from ..db.database import DatabaseManager
-from ..ai.image_downloader import PerplexityImageDownloader
+from ..ai.checkpoints import RequestCheckpoint
+from ..ai.renditions import rendition_engine
+from ..utils.bundles import build_bundle, bundle_extension, bundle_media_type
+from ..utils.storage import key_for, storage
+from .job_scheduler import job_scheduler
+from .retention import downloads_collector
+from ..core.config import settings
+from ..core.metrics import metrics
+from ..core.idempotency import fingerprint, idempotency_store
+
+
+stage_seconds = metrics.histogram(
+    "snapnsend_request_stage_seconds", "Duration of request processing stages",
+    ["stage"], buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+
+
+def _write_file(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+class RequestBusy(RuntimeError):
+    """The request is being processed by another worker"""
+
+
+class SchedulerFull(RuntimeError):
+    """The job scheduler has no room for another request"""
 
 
 class RequestService:
@@ -22,8 +53,39 @@ class RequestService:
         # In-memory storage for demonstration purposes
         # In production, this would be replaced with a database
         self._requests = {}
-        # Initialize database manager for persistent user storage
-        self.db_manager = DatabaseManager()
+        # Scheduler futures of queued and running requests
+        self._jobs = {}
+        # Local files of finished requests, by request ID
+        self._request_files = {}
+        # Requests currently being processed
+        self._active_jobs = 0
+        # Renews the checkpoint leases of the requests in _jobs
+        self._lease_task: Optional[asyncio.Task] = None
+        # Database manager for persistent user storage; opened in
+        # startup() (or on first use) rather than at import time
+        self._db_manager = None
+
+    @property
+    def db_manager(self) -> DatabaseManager:
+        if self._db_manager is None:
+            self._db_manager = DatabaseManager()
+            # Keep the request folder index in step with the retention GC
+            downloads_collector.on_delete = self._db_manager.delete_request_folder
+        return self._db_manager
+
+    async def startup(self):
+        """
+        Initialize heavy dependencies, called from the app lifespan.
+
+        Opens the database and imports the image pipeline (aiohttp etc.)
+        so the first request doesn't pay for it, while importing the
+        app stays cheap.
+        """
+        self.db_manager
+        from ..ai import image_downloader  # noqa: F401
+        if self._lease_task is None:
+            self._lease_task = asyncio.create_task(self._renew_leases())
+        await self.resume_interrupted()
 
     async def register_user(
         self, register_request: RegisterRequest
@@ -99,9 +161,22 @@ class RequestService:
         )
 
     async def create_request(
-        self, request_data: SearchRequest
+        self, request_data: SearchRequest,
+        idempotency_key: Optional[str] = None
     ) -> SearchResponse:
-        """Create a new request and process image download and email sending"""
+        """
+        Create a new request and process image download and email sending
+
+        Args:
+            request_data: The search request
+            idempotency_key: Client-chosen key; retries with the same key
+                return the original request instead of starting a new one
+
+        Raises:
+            IdempotencyKeyReused: If the key belongs to another request body
+            SchedulerFull: If settings.scheduler_max_queued_jobs requests
+                are queued already; nothing is recorded then
+        """
         request_id = uuid4()
 
         # Validate that the user exists in the database
@@ -125,33 +200,285 @@ class RequestService:
                 error=f"Unauthorized: User with ID {request_data.user} does not exist in the database"
             )
 
+        if idempotency_key:
+            scoped_key = f"{request_data.user}:{idempotency_key}"
+            previous_id = await idempotency_store.reserve(
+                scoped_key, str(request_id),
+                fingerprint(request_data.model_dump_json(exclude={"mode"}))
+            )
+            if previous_id is not None:
+                return await self._replay_request(UUID(previous_id), request_data)
+
         # Create initial request with pending status
         request = SearchResponse(
             request_id=request_id,
-            status="processing",  # Changed to processing while images are being downloaded
+            status="pending",  # Until a scheduler worker picks it up
             images=[],
             error=None
         )
+        checkpoint = RequestCheckpoint(
+            str(request_id), user_id=str(user.id), prompt=request_data.prompt,
+            num_images=request_data.n, mode=request_data.mode
+        )
+
+        try:
+            await self._submit(request, checkpoint, user)
+        except SchedulerFull:
+            if idempotency_key:
+                # Nothing was started, so a retry may start it
+                await idempotency_store.release(scoped_key)
+            raise
+
+        if request_data.mode == "sync":
+            # The client waits for the images
+            await asyncio.shield(self._jobs[request_id])
+        return request
+
+    async def _submit(
+        self, request: SearchResponse, checkpoint: RequestCheckpoint, user: User
+    ):
+        """
+        Queue a request on the job scheduler.
+
+        Raises:
+            SchedulerFull: If the scheduler queue is full; the request is
+                not recorded then
+        """
+        if job_scheduler.queued() >= job_scheduler.max_queued:
+            raise SchedulerFull("Server busy: too many queued requests, try again later")
+
+        request_id = request.request_id
         self._requests[request_id] = request
+        checkpoint.on_change = lambda: self._save_checkpoint(checkpoint)
+        checkpoint.status = request.status
+        checkpoint.save()
+
+        # Counted until finished, so shutdown can drain queued and
+        # in-flight jobs
+        self._active_jobs += 1
+        # Nothing was awaited since the check above, so there is room
+        job = await job_scheduler.submit(
+            user=checkpoint.user_id,
+            num_images=checkpoint.num_images,
+            mode=checkpoint.mode,
+            func=lambda: self._run_job(request, checkpoint, user)
+        )
+        self._jobs[request_id] = job
+        job.add_done_callback(lambda _: self._jobs.pop(request_id, None))
+
+    def _save_checkpoint(self, checkpoint: RequestCheckpoint):
+        # Unfinished requests stay leased to this process while it works
+        # on them, so no other worker resumes them
+        unfinished = checkpoint.status in ("pending", "processing")
+        self.db_manager.save_checkpoint(
+            checkpoint,
+            lease_seconds=settings.checkpoint_lease_seconds if unfinished else 0
+        )
 
+    async def _renew_leases(self):
+        """
+        Keep the leases of queued and running requests from running out.
+
+        A request can wait in the scheduler or sit in one stage longer
+        than checkpoint_lease_seconds; without renewal another worker
+        would resume it while this one still runs it.
+        """
+        while True:
+            await asyncio.sleep(settings.checkpoint_lease_seconds / 3)
+            if not self._jobs:
+                continue
+            try:
+                self.db_manager.renew_checkpoint_leases(
+                    [str(request_id) for request_id in self._jobs],
+                    settings.checkpoint_lease_seconds
+                )
+            except Exception as e:
+                print(f"Error renewing request leases: {str(e)}")
+
+    def _finish(self, request: SearchResponse, checkpoint: RequestCheckpoint):
+        """Record the final state of a request"""
+        checkpoint.status = request.status
+        checkpoint.error = request.error
+        checkpoint.save()
+
+    async def _replay_request(
+        self, request_id: UUID, request_data: SearchRequest
+    ) -> SearchResponse:
+        """Answer a retried submission with the request it started"""
+        job = self._jobs.get(request_id)
+        if job is not None and request_data.mode == "sync":
+            await asyncio.shield(job)
+
+        request = await self.get_request(request_id)
+        if request is None:
+            # Not recorded yet by the API node that took it
+            return SearchResponse(request_id=request_id, status="pending", images=[])
+        return request
+
+    async def resume_request(self, request_id: UUID) -> Optional[SearchResponse]:
+        """
+        Run a failed or interrupted request again from its last checkpoint.
+
+        Completed stages are not repeated: search terms and URLs are
+        reused, downloaded images are kept and a sent email is not sent
+        again.
+
+        Only failed requests and unfinished ones whose worker's lease
+        ran out are taken; the request is claimed like in
+        resume_interrupted, so it runs in one worker only.
+
+        Returns:
+            The request, or None if there is no checkpoint for it
+
+        Raises:
+            RequestBusy: If another worker is processing the request
+            SchedulerFull: If the scheduler queue is full
+        """
+        if request_id in self._jobs:
+            return self._requests[request_id]
+
+        checkpoint = self.db_manager.get_checkpoint(str(request_id))
+        if checkpoint is None:
+            return None
+        if checkpoint.done("delivered"):
+            return self._response_for(checkpoint)
+
+        checkpoint = self.db_manager.claim_checkpoint(
+            str(request_id), settings.checkpoint_lease_seconds
+        )
+        if checkpoint is None:
+            raise RequestBusy(f"Request {request_id} is being processed by another worker")
         try:
-            # Use the image downloader to get images based on the prompt
-            async with PerplexityImageDownloader() as image_downloader:
-                image_paths = await image_downloader.search_and_download_images(
-                    query=request_data.prompt,
-                    num_images=10,  # Request 10 images as specified
-                    user_name=user.user_name,
-                    request_id=str(request_id)
+            return await self._resume(checkpoint)
+        except SchedulerFull:
+            self.db_manager.release_checkpoints([str(request_id)])
+            raise
+
+    async def _resume(self, checkpoint: RequestCheckpoint) -> SearchResponse:
+        """Queue a request claimed by this worker again"""
+        request = self._response_for(checkpoint)
+        if checkpoint.done("delivered"):
+            return request
+
+        user = self.db_manager.get_user_by_id(checkpoint.user_id)
+        if not user:
+            request.status = "error"
+            request.error = f"Unauthorized: User with ID {checkpoint.user_id} does not exist in the database"
+            return request
+
+        request.status = "pending"
+        request.error = None
+        checkpoint.error = None
+        await self._submit(request, checkpoint, user)
+        return request
+
+    async def resume_interrupted(self) -> int:
+        """
+        Resume requests left unfinished by a stopped or crashed worker.
+
+        Only requests whose lease ran out are taken, each by one worker.
+
+        Returns:
+            Number of requests resumed
+        """
+        checkpoints = self.db_manager.claim_interrupted_checkpoints(
+            settings.checkpoint_lease_seconds
+        )
+        for resumed, checkpoint in enumerate(checkpoints):
+            print(f"Resuming interrupted request {checkpoint.request_id}")
+            try:
+                await self._resume(checkpoint)
+            except SchedulerFull:
+                # Leave the rest to other workers or a later start
+                self.db_manager.release_checkpoints(
+                    [c.request_id for c in checkpoints[resumed:]]
                 )
+                return resumed
+        return len(checkpoints)
 
-            # Update the request with the downloaded images
-            request.images = image_paths
+    def _response_for(self, checkpoint: RequestCheckpoint) -> SearchResponse:
+        """The client-facing state of a request, from its checkpoint"""
+        request_id = UUID(checkpoint.request_id)
+        image_paths = checkpoint.image_paths() if checkpoint.done("downloads") else []
+        if image_paths:
+            self._request_files[request_id] = image_paths
+        return SearchResponse(
+            request_id=request_id,
+            status=checkpoint.status,
+            images=[self.image_url(request_id, index) for index in range(len(image_paths))],
+            error=checkpoint.error
+        )
+
+    async def _run_job(
+        self, request: SearchResponse, checkpoint: RequestCheckpoint, user: User
+    ):
+        """Scheduler job processing one request"""
+        try:
+            request.status = "processing"
+            checkpoint.status = request.status
+            checkpoint.save()
+            await self._process_request(request, checkpoint, user)
+        finally:
+            self._active_jobs -= 1
+            self._finish(request, checkpoint)
+
+    async def _process_request(
+        self, request: SearchResponse, checkpoint: RequestCheckpoint, user: User
+    ):
+        """
+        Search and download the images of a request and email them,
+        skipping the stages the checkpoint has completed already
+        """
+        from ..ai.image_downloader import PerplexityImageDownloader
+
+        request_id = request.request_id
+        try:
+            if checkpoint.done("downloads"):
+                image_paths = checkpoint.image_paths()
+            else:
+                started = time.monotonic()
+                # Use the image downloader to get images based on the prompt
+                async with PerplexityImageDownloader() as image_downloader:
+                    image_paths = await image_downloader.search_and_download_images(
+                        query=checkpoint.prompt,
+                        num_images=checkpoint.num_images,
+                        user_name=user.user_name,
+                        request_id=str(request_id),
+                        checkpoint=checkpoint
+                    )
+                checkpoint.complete("downloads")
+                stage_seconds.observe(time.monotonic() - started, stage="download")
+
+            # Update the request with the downloaded images; clients fetch
+            # them by URL, the local paths stay internal
+            self._request_files[request_id] = image_paths
+            if image_paths:
+                folder = os.path.dirname(image_paths[0])
+                self.db_manager.save_request_folder(str(request_id), user.user_name, folder)
+                downloads_collector.track(folder)
+            request.images = [self.image_url(request_id, index) for index in range(len(image_paths))]
             request.status = "done"
 
-            # Send the images to the user's email
-            email_sent = await self._send_images_to_user_email(user, image_paths, request_data.prompt)
+            if checkpoint.done("delivered"):
+                return
 
-            if not email_sent:
+            started = time.monotonic()
+            if settings.delivery_mode == "bundle":
+                # Send a link to a single archive instead of attachments
+                email_sent = await self._send_bundle_to_user_email(user, request_id, checkpoint.prompt)
+            else:
+                # Email smaller renditions instead of the full-size originals
+                attachments = await self._create_renditions(image_paths)
+                stage_seconds.observe(time.monotonic() - started, stage="renditions")
+                started = time.monotonic()
+
+                # Send the images to the user's email
+                email_sent = await self._send_images_to_user_email(user, attachments, checkpoint.prompt)
+            stage_seconds.observe(time.monotonic() - started, stage="delivery")
+
+            if email_sent:
+                checkpoint.complete("delivered")
+            else:
                 request.status = "done_with_errors"
                 if request.error:
                     request.error += "; Failed to send email"
@@ -164,9 +491,24 @@ class RequestService:
             request.error = f"Error processing images: {str(e)}"
             print(f"Error in create_request: {str(e)}")
 
-        # Update the stored request with final status
-        self._requests[request_id] = request
-        return request
+    async def _create_renditions(self, image_paths: List[str]) -> List[str]:
+        """
+        Create the delivery renditions of the downloaded images.
+
+        Falls back to the originals if renditions are disabled or fail.
+        """
+        if not settings.rendition_enabled:
+            return image_paths
+
+        try:
+            renditions = await rendition_engine.create_renditions(image_paths)
+            for path in renditions:
+                if path not in image_paths:
+                    await storage.save_file(path, key_for(path))
+            return renditions
+        except Exception as e:
+            print(f"Error creating renditions: {str(e)}")
+            return image_paths
 
     async def _send_images_to_user_email(self, user: User, image_paths: List[str], prompt: str):
         """
@@ -193,9 +535,176 @@ class RequestService:
             print(f"Error sending email to {user.user_mail}: {str(e)}")
             return False
 
+    async def _send_bundle_to_user_email(self, user: User, request_id: UUID, prompt: str) -> bool:
+        """
+        Build the request's bundle and email the user a link to it.
+
+        Returns:
+            bool: True if email was sent successfully, False otherwise
+        """
+        try:
+            await self.get_bundle(request_id)
+            bundle_url = self._public_url(f"/requests/{request_id}/bundle")
+            return await email_service.send_bundle_email(
+                user_name=user.user_name,
+                user_mail=user.user_mail,
+                bundle_url=bundle_url,
+                image_count=len(self._request_files[request_id]),
+                prompt=prompt
+            )
+        except Exception as e:
+            print(f"Error sending bundle to {user.user_mail}: {str(e)}")
+            return False
+
+    @staticmethod
+    def _public_url(path: str) -> str:
+        """Absolute URL of an API path, for responses and emails"""
+        return f"{settings.public_base_url.rstrip('/')}{settings.api_v1_prefix}{path}"
+
+    def image_url(self, request_id: UUID, index: int) -> str:
+        """URL under which an image of a request is served"""
+        return self._public_url(f"/requests/{request_id}/images/{index}")
+
+    def _files_of(self, request_id: UUID) -> List[str]:
+        """
+        Image files of a request, also of requests this worker did not
+        run: those are looked up in their checkpoint, or for requests
+        without one, in the folder recorded for them.
+
+        With local storage only files on this node's disk are returned;
+        with remote storage the files may only be stored copies, which
+        are addressed by key_for(path).
+        """
+        paths = self._request_files.get(request_id)
+        if paths is not None:
+            return paths
+
+        checkpoint = self.db_manager.get_checkpoint(str(request_id))
+        if checkpoint is not None:
+            paths = []
+            if checkpoint.done("downloads"):
+                paths = (
+                    checkpoint.image_paths() if storage.name == "local"
+                    else checkpoint.recorded_image_paths()
+                )
+        else:
+            folder = self.db_manager.get_request_folder(str(request_id))
+            paths = []
+            if folder and os.path.isdir(folder):
+                paths = [
+                    os.path.join(folder, name) for name in sorted(os.listdir(folder))
+                    if not name.startswith(("bundle.", "."))
+                    and (mimetypes.guess_type(name)[0] or "").startswith("image/")
+                ]
+        if paths:
+            self._request_files[request_id] = paths
+        return paths
+
+    async def get_image_path(self, request_id: UUID, index: int) -> Optional[str]:
+        """
+        Get the path of one image of a request.
+
+        Only files inside settings.downloads_dir are ever returned. With
+        remote storage the file need not be on this node; it is served
+        from its stored copy under key_for(path).
+
+        Returns:
+            Path of the image, or None if there is no such image
+        """
+        paths = self._files_of(request_id)
+        if not 0 <= index < len(paths):
+            return None
+
+        root = os.path.realpath(settings.downloads_dir)
+        path = os.path.realpath(paths[index])
+        if os.path.commonpath([root, path]) != root:
+            return None
+        if storage.name == "local" and not os.path.exists(path):
+            return None
+        return path
+
+    async def get_bundle(self, request_id: UUID) -> Optional[str]:
+        """
+        Get the path of a request's archive, building it on first use.
+
+        The archive is built again if any image is newer, e.g. after a
+        retry downloaded more images. With remote storage, a bundle
+        stored by another node is used as is; if there is none, images
+        not on this node are fetched from storage to build it.
+
+        Returns:
+            Path of the bundle, or None if the request has no files
+        """
+        paths = self._files_of(request_id)
+        if storage.name == "local":
+            paths = [path for path in paths if os.path.exists(path)]
+        if not paths:
+            return None
+
+        bundle_path = os.path.join(os.path.dirname(paths[0]), "bundle" + bundle_extension(settings.bundle_format))
+        missing = [path for path in paths if not os.path.exists(path)]
+        if missing:
+            # Downloaded by another node, which may have stored the bundle
+            if await storage.exists(key_for(bundle_path)):
+                return bundle_path
+            for path in missing:
+                await self._fetch_stored_file(path)
+
+        if (
+            not os.path.exists(bundle_path)
+            or os.path.getmtime(bundle_path) < max(os.path.getmtime(path) for path in paths)
+        ):
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, build_bundle, paths, bundle_path, settings.bundle_format)
+            await storage.save_file(bundle_path, key_for(bundle_path), bundle_media_type(settings.bundle_format))
+        return bundle_path
+
+    async def _fetch_stored_file(self, path: str):
+        """Copy a file stored by another node to its path on this node"""
+        data = await storage.read(key_for(path))
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, _write_file, path, data)
+
+    async def drain(self, timeout: float) -> bool:
+        """
+        Wait for in-flight requests to finish, e.g. on shutdown.
+
+        Args:
+            timeout: Maximum time to wait in seconds
+
+        Returns:
+            bool: True if no request is in flight anymore
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._active_jobs and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+        return self._active_jobs == 0
+
+    def release_unfinished(self):
+        """
+        Let other workers resume the requests this one did not finish,
+        called on shutdown after the job scheduler has stopped
+        """
+        if self._lease_task is not None:
+            self._lease_task.cancel()
+            self._lease_task = None
+        unfinished = [
+            str(request_id) for request_id, request in self._requests.items()
+            if request.status in ("pending", "processing")
+        ]
+        if unfinished:
+            self.db_manager.release_checkpoints(unfinished)
+
     async def get_request(self, request_id: UUID) -> Optional[SearchResponse]:
         """Get a request by ID"""
-        return self._requests.get(request_id)
+        request = self._requests.get(request_id)
+        if request is None:
+            # Requests of earlier runs and other workers
+            checkpoint = self.db_manager.get_checkpoint(str(request_id))
+            if checkpoint is not None:
+                request = self._response_for(checkpoint)
+        return request
 
     async def list_requests(self) -> List[SearchResponse]:
         """List all requests"""
@@ -0,0 +1,287 @@
+"""
+Retention / garbage collection for the downloads tree.
+
+Every request leaves a folder in the downloads tree behind. The
+collector keeps an index of request folders (path -> last modified,
+bytes, files) and, every settings.retention_interval_seconds, deletes
+folders older than the maximum age and then the oldest folders until
+the total size is under the cap.
+
+The index is fed in two ways so no cycle ever walks the whole tree:
+finished requests register their folder directly with track(), and a
+resumable scan cursor visits at most settings.retention_scan_batch
+folders per cycle, which picks up folders left over from before a
+restart and refreshes the sizes of known ones.
+
+Rendition cache files (see app.ai.renditions) are hard-linked into the
+request folders; cache files whose only remaining link is the cache
+entry itself are removed during the scan as well.
+
+With a remote storage backend (settings.storage_backend = "s3") the
+stored copies of the files in deleted folders are deleted from the
+bucket after each cycle; keys that fail to delete are tried again after
+the next one.
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from ..ai.renditions import rendition_cache_dir
+from ..core.config import settings
+from ..core.metrics import metrics
+from ..utils.download_layout import iter_request_folders, remove_empty_parents
+from ..utils.storage import StorageBackend, key_for, storage
+
+logger = logging.getLogger(__name__)
+
+# Folders modified this recently may belong to a running request and
+# are never evicted for size
+MIN_EVICTION_AGE_SECONDS = 600
+
+gc_deleted = metrics.counter(
+    "snapnsend_gc_deleted_requests_total", "Request folders deleted by the GC"
+)
+gc_freed_bytes = metrics.counter(
+    "snapnsend_gc_freed_bytes_total", "Bytes freed by the GC"
+)
+gc_scanned = metrics.counter(
+    "snapnsend_gc_scanned_folders_total", "Folders visited by the GC scan"
+)
+downloads_bytes = metrics.gauge(
+    "snapnsend_downloads_bytes", "Bytes in tracked request folders"
+)
+downloads_requests = metrics.gauge(
+    "snapnsend_downloads_requests", "Tracked request folders"
+)
+gc_storage_deleted = metrics.counter(
+    "snapnsend_gc_storage_deleted_objects_total",
+    "Stored objects deleted by the GC"
+)
+gc_cycle_seconds = metrics.histogram(
+    "snapnsend_gc_cycle_seconds", "Duration of GC cycles"
+)
+
+
+@dataclass
+class FolderUsage:
+    """Disk usage of one request folder"""
+    modified: float
+    bytes: int
+    files: int
+
+
+def folder_usage(path: str) -> Optional[FolderUsage]:
+    """Measure a request folder (including its renditions/ subfolder)"""
+    modified, size, files = 0.0, 0, 0
+    pending = [path]
+    try:
+        while pending:
+            with os.scandir(pending.pop()) as entries:
+                for entry in entries:
+                    st = entry.stat(follow_symlinks=False)
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    else:
+                        size += st.st_size
+                        files += 1
+                    modified = max(modified, st.st_mtime)
+    except FileNotFoundError:
+        return None
+    if not modified:
+        modified = os.stat(path).st_mtime
+    return FolderUsage(modified, size, files)
+
+
+class DownloadsCollector:
+    """Background task enforcing age and size retention on downloads/"""
+
+    def __init__(self, root: Optional[str] = None,
+                 on_delete: Optional[Callable[[str], None]] = None,
+                 storage_backend: Optional[StorageBackend] = None):
+        self.root = root or settings.downloads_dir
+        # Called with the path of every deleted folder (index cleanup)
+        self.on_delete = on_delete
+        self.storage = storage_backend or storage
+        # Storage keys of deleted files, deleted by delete_stored()
+        self._stored_keys: List[str] = []
+        self.index: Dict[str, FolderUsage] = {}
+        # collect() runs on a worker thread while track() runs on the loop
+        self._lock = threading.Lock()
+        self._cursor: Optional[Iterator[Tuple[str, bool]]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def track(self, folder: str):
+        """Register a request folder as soon as it is complete"""
+        usage = folder_usage(folder)
+        if usage is not None:
+            with self._lock:
+                self.index[os.path.normpath(folder)] = usage
+
+    def _walk(self) -> Iterator[Tuple[str, bool]]:
+        """
+        Yield (folder, is_rendition_shard) lazily: request folders in
+        either layout, then the rendition cache shards
+        """
+        for path, _ in iter_request_folders(self.root):
+            yield path, False
+
+        cache = rendition_cache_dir()
+        try:
+            with os.scandir(cache) as shards:
+                for shard in shards:
+                    if shard.is_dir(follow_symlinks=False):
+                        yield shard.path, True
+        except FileNotFoundError:
+            return
+
+    def _scan_batch(self, limit: int):
+        """Advance the scan cursor by up to limit folders"""
+        for _ in range(limit):
+            if self._cursor is None:
+                self._cursor = self._walk()
+            try:
+                folder, rendition_shard = next(self._cursor)
+            except StopIteration:
+                # Start over next cycle
+                self._cursor = None
+                return
+            gc_scanned.inc()
+
+            if rendition_shard:
+                self._prune_rendition_shard(folder)
+                continue
+
+            usage = folder_usage(folder)
+            key = os.path.normpath(folder)
+            with self._lock:
+                if usage is None:
+                    self.index.pop(key, None)
+                else:
+                    self.index[key] = usage
+
+    def _prune_rendition_shard(self, shard: str):
+        """Drop cached renditions no request folder links to anymore"""
+        cutoff = time.time() - MIN_EVICTION_AGE_SECONDS
+        with os.scandir(shard) as entries:
+            for entry in entries:
+                st = entry.stat(follow_symlinks=False)
+                if st.st_nlink == 1 and st.st_mtime < cutoff:
+                    try:
+                        os.remove(entry.path)
+                        gc_freed_bytes.inc(st.st_size)
+                    except FileNotFoundError:
+                        pass
+
+    def _delete(self, folder: str):
+        with self._lock:
+            usage = self.index.pop(folder, None)
+        if self.storage.name != "local":
+            # Local storage keeps its copies in the folder itself
+            keys = [
+                key_for(os.path.join(path, name), self.root)
+                for path, _, names in os.walk(folder) for name in names
+            ]
+            with self._lock:
+                self._stored_keys.extend(keys)
+        shutil.rmtree(folder, ignore_errors=True)
+        gc_deleted.inc()
+        if usage:
+            gc_freed_bytes.inc(usage.bytes)
+
+        # Remove user / shard folders once their last request is gone
+        remove_empty_parents(folder, self.root)
+        if self.on_delete is not None:
+            self.on_delete(folder)
+
+    def collect(self, now: Optional[float] = None) -> int:
+        """
+        Run one GC cycle (blocking; called on a worker thread).
+
+        Returns:
+            Number of request folders deleted
+        """
+        started = time.monotonic()
+        now = time.time() if now is None else now
+        self._scan_batch(settings.retention_scan_batch)
+
+        with self._lock:
+            # Oldest first
+            folders = sorted(
+                self.index.items(), key=lambda item: item[1].modified
+            )
+
+        deleted = 0
+        max_age = settings.retention_max_age_hours * 3600
+        max_bytes = settings.retention_max_total_mb * 1024 * 1024
+        total = sum(usage.bytes for _, usage in folders)
+        for folder, usage in folders:
+            age = now - usage.modified
+            expired = age > max_age
+            over_size = total > max_bytes and age >= MIN_EVICTION_AGE_SECONDS
+            if not (expired or over_size):
+                continue
+            total -= usage.bytes
+            self._delete(folder)
+            deleted += 1
+
+        with self._lock:
+            downloads_bytes.set(sum(u.bytes for u in self.index.values()))
+            downloads_requests.set(len(self.index))
+        gc_cycle_seconds.observe(time.monotonic() - started)
+        if deleted:
+            logger.info(f"Retention GC deleted {deleted} request folders")
+        return deleted
+
+    async def delete_stored(self) -> int:
+        """
+        Delete the stored copies of the files of deleted folders.
+
+        Returns:
+            Number of objects deleted
+        """
+        with self._lock:
+            keys, self._stored_keys = self._stored_keys, []
+        for deleted, key in enumerate(keys):
+            try:
+                await self.storage.delete(key)
+            except Exception as e:
+                logger.error(f"Failed to delete {key} from storage: {str(e)}")
+                with self._lock:
+                    self._stored_keys.extend(keys[deleted:])
+                return deleted
+            gc_storage_deleted.inc()
+        return len(keys)
+
+    async def run(self):
+        """Collect forever at the configured interval"""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.collect)
+                await self.delete_stored()
+            except Exception as e:
+                logger.error(f"Retention GC cycle failed: {str(e)}")
+            await asyncio.sleep(settings.retention_interval_seconds)
+
+    def start(self):
+        if settings.retention_enabled and self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Global downloads collector instance
+downloads_collector = DownloadsCollector()
@@ -0,0 +1,87 @@
+"""
+Single-archive delivery of a request's images.
+
+Archives are written straight to disk one member at a time, so memory
+use does not depend on the number or size of the images. Already
+compressed image formats are stored as-is in zip bundles; deflating
+them again costs CPU for no gain.
+"""
+
+import os
+import tarfile
+import tempfile
+import zipfile
+from typing import List
+
+# format -> (file extension, media type)
+BUNDLE_FORMATS = {
+    "zip": (".zip", "application/zip"),
+    "tar.gz": (".tar.gz", "application/gzip"),
+}
+
+# Formats that do not shrink any further with deflate
+COMPRESSED_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".avif"
+}
+
+
+def bundle_extension(fmt: str) -> str:
+    return BUNDLE_FORMATS[fmt][0]
+
+
+def bundle_media_type(fmt: str) -> str:
+    return BUNDLE_FORMATS[fmt][1]
+
+
+def build_bundle(paths: List[str], destination: str, fmt: str = "zip") -> str:
+    """
+    Pack files into an archive.
+
+    The archive is written to a temporary file of its own and renamed
+    into place, so a concurrent reader never sees a partial bundle and
+    concurrent builds of the same bundle do not interfere.
+
+    Args:
+        paths: Files to pack, stored under their base names
+        destination: Path of the archive
+        fmt: "zip" or "tar.gz"
+
+    Returns:
+        The destination path
+    """
+    if fmt not in BUNDLE_FORMATS:
+        raise ValueError(f"Unknown bundle format: {fmt}")
+
+    fd, temp = tempfile.mkstemp(
+        prefix=os.path.basename(destination) + ".",
+        suffix=".tmp",
+        dir=os.path.dirname(destination) or None
+    )
+    os.close(fd)
+    try:
+        # mkstemp creates the file private to this user
+        os.chmod(temp, 0o644)
+        if fmt == "zip":
+            with zipfile.ZipFile(temp, "w") as archive:
+                for path in paths:
+                    extension = os.path.splitext(path)[1].lower()
+                    compression = (
+                        zipfile.ZIP_STORED
+                        if extension in COMPRESSED_EXTENSIONS
+                        else zipfile.ZIP_DEFLATED
+                    )
+                    archive.write(
+                        path, os.path.basename(path),
+                        compress_type=compression
+                    )
+        else:
+            with tarfile.open(temp, "w:gz") as archive:
+                for path in paths:
+                    archive.add(path, arcname=os.path.basename(path))
+        os.replace(temp, destination)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+    return destination
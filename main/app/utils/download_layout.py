@@ -0,0 +1,195 @@
+"""
+On-disk layout of request folders under settings.downloads_dir.
+
+Two layouts exist:
+
+- flat (legacy): downloads/<user_name>/<request_id>/
+- sharded: downloads/<h0>/<h1>/.../<request_id>/, where h0, h1, ... are
+  consecutive slices of sha1(request_id) in hex.
+  settings.downloads_shard_depth sets the number of levels and
+  settings.downloads_shard_width the hex characters per level, so the
+  fan-out per level is 16 ** width (256 for the default width of 2).
+
+With the defaults a million requests end up ~15 per leaf directory,
+instead of one directory per heavy user with tens of thousands of
+entries. Since the user name is no longer part of the path, every
+request folder is recorded in the request_folders table (see
+DatabaseManager) as request_id -> path.
+
+Existing flat trees can be moved over with:
+
+    python -m app.utils.download_layout migrate [--dry-run]
+
+Top-level folders whose name looks like a shard (exactly width hex
+characters) are taken to be shards, so users with such names are not
+migrated.
+"""
+
+import argparse
+import hashlib
+import os
+import string
+import sys
+from typing import Iterator, List, Optional, Tuple
+
+from ..core.config import settings
+
+
+def shard_parts(request_id: str) -> List[str]:
+    """Shard folder names for a request ID"""
+    width = settings.downloads_shard_width
+    digest = hashlib.sha1(request_id.encode('utf-8')).hexdigest()
+    return [
+        digest[level * width:(level + 1) * width]
+        for level in range(settings.downloads_shard_depth)
+    ]
+
+
+def request_folder(user_name: str, request_id: str,
+                   root: Optional[str] = None) -> str:
+    """
+    Folder for a request's files in the configured layout.
+
+    Args:
+        user_name: Name of the user making the request
+        request_id: ID of the request
+        root: Downloads root, defaults to settings.downloads_dir
+
+    Returns:
+        Path of the request folder (not created)
+    """
+    root = root or settings.downloads_dir
+    if settings.downloads_layout == "sharded":
+        return os.path.join(root, *shard_parts(request_id), request_id)
+    return os.path.join(root, user_name, request_id)
+
+
+def is_shard_name(name: str) -> bool:
+    return (
+        len(name) == settings.downloads_shard_width
+        and all(ch in string.hexdigits.lower() for ch in name)
+    )
+
+
+def _subdirs(path: str) -> Iterator[os.DirEntry]:
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield entry
+    except FileNotFoundError:
+        return
+
+
+def iter_request_folders(root: Optional[str] = None) -> Iterator[Tuple[str, bool]]:
+    """
+    Lazily yield every request folder, in either layout.
+
+    Hidden top-level folders (e.g. the rendition cache) are skipped.
+
+    Yields:
+        (path, sharded) tuples
+    """
+    root = root or settings.downloads_dir
+    depth = settings.downloads_shard_depth
+
+    for top in _subdirs(root):
+        if top.name.startswith('.'):
+            continue
+
+        if not is_shard_name(top.name):
+            # Legacy downloads/<user>/<request_id>
+            for request in _subdirs(top.path):
+                yield request.path, False
+            continue
+
+        # Descend the remaining shard levels
+        level = [top.path]
+        for _ in range(depth - 1):
+            level = [
+                entry.path for path in level for entry in _subdirs(path)
+            ]
+        for path in level:
+            for request in _subdirs(path):
+                yield request.path, True
+
+
+def remove_empty_parents(path: str, root: Optional[str] = None):
+    """Remove empty folders above path, up to (not including) root"""
+    root = os.path.abspath(root or settings.downloads_dir)
+    parent = os.path.dirname(os.path.abspath(path))
+    while parent != root and parent.startswith(root + os.sep):
+        try:
+            os.rmdir(parent)
+        except OSError:
+            return
+        parent = os.path.dirname(parent)
+
+
+def migrate(root: Optional[str] = None, db_manager=None,
+            dry_run: bool = False) -> int:
+    """
+    Move flat-layout request folders to the sharded layout.
+
+    Args:
+        root: Downloads root, defaults to settings.downloads_dir
+        db_manager: DatabaseManager to record new paths in (request
+            folders and checkpoint image paths), if any
+        dry_run: Only report what would be moved
+
+    Returns:
+        Number of request folders moved
+    """
+    root = root or settings.downloads_dir
+    moved = 0
+    # Materialize first: the moves add shard folders to the tree
+    legacy = [
+        path for path, sharded in iter_request_folders(root) if not sharded
+    ]
+
+    for path in legacy:
+        user_name = os.path.basename(os.path.dirname(path))
+        request_id = os.path.basename(path)
+        target = os.path.join(root, *shard_parts(request_id), request_id)
+        if os.path.exists(target):
+            print(f"Skipping {path}: {target} already exists")
+            continue
+
+        print(f"{path} -> {target}")
+        if not dry_run:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.rename(path, target)
+            remove_empty_parents(path, root)
+            if db_manager is not None:
+                db_manager.save_request_folder(request_id, user_name, target)
+                db_manager.move_checkpoint_images(request_id, path, target)
+        moved += 1
+
+    return moved
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Manage the layout of the downloads tree"
+    )
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subcommands.add_parser(
+        "migrate", help="Move flat-layout folders to the sharded layout"
+    )
+    migrate_parser.add_argument("--root", default=settings.downloads_dir)
+    migrate_parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    from ..db.database import DatabaseManager
+
+    moved = migrate(
+        args.root,
+        db_manager=None if args.dry_run else DatabaseManager(),
+        dry_run=args.dry_run
+    )
+    print(f"{'Would move' if args.dry_run else 'Moved'} {moved} request folders")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,6 @@
-import smtplib
-import ssl
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
 from typing import List
 from ..core.config import settings
+from .storage import key_for, storage
 import logging
 
 logger = logging.getLogger(__name__)
@@ -56,6 +51,10 @@ class EmailService:
             The SnapNSend Team
             """
 
+            # Imported here to keep app startup fast
+            from email.mime.text import MIMEText
+            from email.mime.multipart import MIMEMultipart
+
             # Create and send the email
             msg = MIMEMultipart()
             msg['From'] = settings.smtp_username  # Use the email from
@@ -63,13 +62,7 @@ class EmailService:
             msg['To'] = user_mail
             msg['Subject'] = subject
             msg.attach(MIMEText(body, 'plain'))
-            context = ssl.create_default_context()
-
-            with smtplib.SMTP_SSL(
-                settings.smtp_server, settings.smtp_port, context=context
-            ) as server:
-                server.login(settings.smtp_username, settings.smtp_password)
-                server.send_message(msg)
+            self._send_message(msg)
 
             # Log the email for debugging purposes (in a real app, this would
             # be actual email sending)
@@ -84,6 +77,47 @@ class EmailService:
             )
             return False
 
+    def _send_message(self, msg):
+        """
+        Send a message through the configured SMTP server.
+
+        settings.smtp_security selects implicit TLS ("ssl"), STARTTLS
+        ("starttls") or a plain connection ("none", e.g. a local relay
+        or a test sink); without a username no login is attempted.
+        """
+        import smtplib
+        import ssl
+
+        # Loading the CA store is slow, skip it for plain connections
+        context = None
+        if settings.smtp_security in ("ssl", "starttls"):
+            context = ssl.create_default_context()
+        if settings.smtp_security == "ssl":
+            server = smtplib.SMTP_SSL(
+                settings.smtp_server, settings.smtp_port, context=context
+            )
+        else:
+            server = smtplib.SMTP(settings.smtp_server, settings.smtp_port)
+        with server:
+            if settings.smtp_security == "starttls":
+                server.starttls(context=context)
+            if settings.smtp_username:
+                server.login(settings.smtp_username, settings.smtp_password)
+            server.send_message(msg)
+
+    async def _read_attachment(self, path: str) -> bytes:
+        """
+        Read an attachment through the storage backend, so images stored
+        by another node can be sent too
+        """
+        try:
+            key = key_for(path)
+        except ValueError:
+            # Not part of the downloads tree
+            with open(path, "rb") as f:
+                return f.read()
+        return await storage.read(key)
+
     async def send_images_email(
         self, user_name: str, user_mail: str, image_paths: List[str], prompt: str
     ) -> bool:
@@ -112,6 +146,11 @@ class EmailService:
             The SnapNSend Team
             """
 
+            from email import encoders
+            from email.mime.base import MIMEBase
+            from email.mime.text import MIMEText
+            from email.mime.multipart import MIMEMultipart
+
             # Create the email message
             msg = MIMEMultipart()
             msg['From'] = settings.smtp_username
@@ -124,10 +163,9 @@ class EmailService:
             # Attach each image file
             for image_path in image_paths:
                 try:
-                    with open(image_path, "rb") as attachment:
-                        # Instance of MIMEBase and named as part
-                        part = MIMEBase('application', 'octet-stream')
-                        part.set_payload(attachment.read())
+                    # Instance of MIMEBase and named as part
+                    part = MIMEBase('application', 'octet-stream')
+                    part.set_payload(await self._read_attachment(image_path))
 
                     # Encode file in ASCII characters to send by email
                     encoders.encode_base64(part)
@@ -144,14 +182,13 @@ class EmailService:
                 except FileNotFoundError:
                     logger.warning(f"Image file not found: {image_path}")
                     continue  # Skip missing files but continue with others
+                except Exception as e:
+                    logger.warning(
+                        f"Image file could not be read: {image_path}: {str(e)}"
+                    )
+                    continue
 
-            # Create secure connection with server and send email
-            context = ssl.create_default_context()
-            with smtplib.SMTP_SSL(
-                settings.smtp_server, settings.smtp_port, context=context
-            ) as server:
-                server.login(settings.smtp_username, settings.smtp_password)
-                server.send_message(msg)
+            self._send_message(msg)
 
             logger.info(
                 f"Images email sent to {user_mail} for user {user_name} "
@@ -164,6 +201,61 @@ class EmailService:
             )
             return False
 
+    async def send_bundle_email(
+        self, user_name: str, user_mail: str, bundle_url: str,
+        image_count: int, prompt: str
+    ) -> bool:
+        """
+        Send the user a link to the archive with their images
+
+        Args:
+            user_name: Name of the user
+            user_mail: Email address of the user
+            bundle_url: Download URL of the archive
+            image_count: Number of images in the archive
+            prompt: The original prompt used to generate the images
+
+        Returns:
+            bool: True if email was sent successfully, False otherwise
+        """
+        try:
+            subject = f"Your Images - Generated from Prompt: '{prompt}'"
+            body = f"""
+            Hello {user_name},
+
+            Your {image_count} images for the prompt '{prompt}' are ready.
+            Download them all as a single archive:
+
+            {bundle_url}
+
+            We hope you enjoy these images!
+
+            Best regards,
+            The SnapNSend Team
+            """
+
+            from email.mime.text import MIMEText
+            from email.mime.multipart import MIMEMultipart
+
+            msg = MIMEMultipart()
+            msg['From'] = settings.smtp_username
+            msg['To'] = user_mail
+            msg['Subject'] = subject
+            msg.attach(MIMEText(body, 'plain'))
+
+            self._send_message(msg)
+
+            logger.info(
+                f"Bundle email sent to {user_mail} for user {user_name} "
+                f"with {image_count} images from prompt '{prompt}'"
+            )
+            return True
+        except Exception as e:
+            logger.error(
+                f"Failed to send bundle email to {user_mail}: {str(e)}"
+            )
+            return False
+
 
 # Global email service instance
 email_service = EmailService()
@@ -0,0 +1,223 @@
+"""
+File responses with conditional requests, byte ranges and zero-copy.
+
+Starlette's FileResponse (0.27) has no Range support, which download
+managers and media players rely on to resume or seek. RangeFileResponse
+adds single-range requests, ETag / Last-Modified validation and HEAD,
+and hands the file to the server instead of copying it through Python
+whenever the ASGI server offers one of the zero-copy extensions:
+
+- http.response.zerocopysend: the server sendfile()s from our file
+  descriptor, for full and partial responses alike
+- http.response.pathsend: the server opens and sends the whole file
+  itself, used for full (200) responses only
+
+Otherwise the file is read in chunks on a worker thread.
+"""
+
+import os
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a Range header for a file of the given size.
+
+    Only a single byte range is supported; anything else is treated as
+    if there was no Range header, which RFC 9110 allows.
+
+    Returns:
+        (start, end) with end inclusive, None to send the full file
+
+    Raises:
+        ValueError: If the range is syntactically valid but unsatisfiable
+    """
+    unit, _, ranges = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in ranges:
+        return None
+
+    first, sep, last = ranges.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        start = int(first) if first else None
+        end = int(last) if last else None
+    except ValueError:
+        # Malformed ranges are ignored
+        return None
+
+    if start is None:
+        if end is None:
+            return None
+        # Suffix range: the last N bytes
+        if end == 0 or size == 0:
+            raise ValueError("Range not satisfiable")
+        return max(0, size - end), size - 1
+
+    if end is not None and end < start:
+        return None
+    if start >= size:
+        raise ValueError("Range not satisfiable")
+    return start, size - 1 if end is None else min(end, size - 1)
+
+
+class RangeFileResponse(Response):
+    """
+    Serve a file from disk with Range, ETag and zero-copy support.
+
+    Args:
+        path: File to send
+        media_type: Content-Type of the file
+        filename: If set, sent as an attachment under this name
+        cache_control: Value of the Cache-Control header
+    """
+
+    def __init__(
+        self,
+        path: str,
+        media_type: str = "application/octet-stream",
+        filename: Optional[str] = None,
+        cache_control: str = "private, max-age=3600",
+    ):
+        self.path = path
+        self.media_type = media_type
+        self.filename = filename
+        self.cache_control = cache_control
+        self.status_code = 200
+        self.background = None
+        self.body = b""
+        self.init_headers()
+
+    def _base_headers(self, st: os.stat_result) -> dict:
+        etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        headers = {
+            "accept-ranges": "bytes",
+            "etag": etag,
+            "last-modified": formatdate(st.st_mtime, usegmt=True),
+            "cache-control": self.cache_control,
+        }
+        if self.filename:
+            headers["content-disposition"] = (
+                f"attachment; filename*=utf-8''{quote(self.filename)}"
+            )
+        return headers
+
+    @staticmethod
+    def _not_modified(request: Headers, etag: str, st: os.stat_result) -> bool:
+        if_none_match = request.get("if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+        if_modified_since = request.get("if-modified-since")
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(st.st_mtime) <= since
+        return False
+
+    async def _start(self, send: Send, status_code: int, headers: dict):
+        raw = [(b"content-type", self.media_type.encode("latin-1"))]
+        raw += [
+            (key.encode("latin-1"), value.encode("latin-1"))
+            for key, value in headers.items()
+        ]
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": raw,
+        })
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        request = Headers(scope=scope)
+        try:
+            st = await anyio.to_thread.run_sync(os.stat, self.path)
+        except FileNotFoundError:
+            await Response("Not Found", status_code=404)(scope, receive, send)
+            return
+        if not stat.S_ISREG(st.st_mode):
+            await Response("Not Found", status_code=404)(scope, receive, send)
+            return
+
+        headers = self._base_headers(st)
+        size = st.st_size
+
+        if self._not_modified(request, headers["etag"], st):
+            headers.pop("content-disposition", None)
+            await self._start(send, 304, headers)
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        byte_range = None
+        range_header = request.get("range")
+        if_range = request.get("if-range")
+        # A stale If-Range validator means "send me the whole new file"
+        if range_header and (if_range is None or if_range == headers["etag"]):
+            try:
+                byte_range = parse_range(range_header, size)
+            except ValueError:
+                headers["content-range"] = f"bytes */{size}"
+                headers["content-length"] = "0"
+                await self._start(send, 416, headers)
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+        if byte_range is None:
+            status_code, start, end = 200, 0, size - 1
+        else:
+            status_code, (start, end) = 206, byte_range
+            headers["content-range"] = f"bytes {start}-{end}/{size}"
+        count = end - start + 1 if size else 0
+        headers["content-length"] = str(count)
+
+        await self._start(send, status_code, headers)
+        if scope.get("method") == "HEAD" or count == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        extensions = scope.get("extensions") or {}
+        if "http.response.zerocopysend" in extensions:
+            with open(self.path, "rb") as f:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f.fileno(),
+                    "offset": start,
+                    "count": count,
+                })
+        elif status_code == 200 and "http.response.pathsend" in extensions:
+            await send({
+                "type": "http.response.pathsend",
+                "path": os.path.abspath(self.path),
+            })
+        else:
+            await self._send_chunks(send, start, count)
+
+    async def _send_chunks(self, send: Send, start: int, count: int):
+        async with await anyio.open_file(self.path, mode="rb") as f:
+            await f.seek(start)
+            remaining = count
+            while remaining > 0:
+                chunk = await f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": remaining > 0,
+                })
+            if remaining > 0:
+                # File shrank while sending; close the body anyway
+                await send({"type": "http.response.body", "body": b""})
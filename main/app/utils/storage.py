@@ -0,0 +1,258 @@
+"""
+Storage of request files behind a common interface.
+
+Images are always produced on the local disk of the node that ran the
+request (downloads, renditions, bundles). The storage backend decides
+where they live from then on:
+
+- local: the files under settings.downloads_dir are the stored copies;
+  they are served by the API itself
+- s3: files are uploaded to an S3-compatible bucket (AWS S3, MinIO, ...)
+  with multipart uploads streamed from disk, and clients are redirected
+  to presigned URLs, so any node can serve any request
+
+Objects are addressed by keys, the file paths relative to
+settings.downloads_dir with forward slashes.
+
+boto3 is only needed for the s3 backend and is imported on first use.
+"""
+
+import asyncio
+import os
+import shutil
+from abc import ABC, abstractmethod
+from functools import partial
+from typing import Optional
+
+from ..core.config import settings
+
+
+def key_for(path: str, root: Optional[str] = None) -> str:
+    """Storage key of a file under the downloads root"""
+    root = os.path.abspath(root or settings.downloads_dir)
+    relative = os.path.relpath(os.path.abspath(path), root)
+    if relative.startswith(os.pardir):
+        raise ValueError(f"{path} is outside of {root}")
+    return relative.replace(os.sep, "/")
+
+
+class StorageBackend(ABC):
+    """Interface of the storage backends"""
+
+    name = ""
+
+    @abstractmethod
+    async def save_file(
+        self, path: str, key: str, content_type: Optional[str] = None
+    ):
+        """Store a local file under a key"""
+
+    @abstractmethod
+    async def read(self, key: str) -> bytes:
+        """Read a stored object"""
+
+    @abstractmethod
+    async def delete(self, key: str):
+        """Delete a stored object; missing objects are ignored"""
+
+    @abstractmethod
+    async def exists(self, key: str) -> bool:
+        """Whether an object is stored under a key"""
+
+    def presigned_url(self, key: str) -> Optional[str]:
+        """
+        Time-limited URL clients can download the object from directly.
+
+        Returns:
+            The URL, or None if the API has to serve the file itself
+        """
+        return None
+
+
+class LocalStorage(StorageBackend):
+    """Files stay where they were written under the downloads root"""
+
+    name = "local"
+
+    def __init__(self, root: Optional[str] = None):
+        self._root = root
+
+    @property
+    def root(self) -> str:
+        # Read on every use, like key_for(), so both agree on the root
+        return self._root or settings.downloads_dir
+
+    def path_for(self, key: str) -> str:
+        root = os.path.abspath(self.root)
+        path = os.path.abspath(os.path.join(root, *key.split("/")))
+        # Keys come from key_for(), but never leave the root regardless
+        if os.path.commonpath([root, path]) != root:
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    async def save_file(
+        self, path: str, key: str, content_type: Optional[str] = None
+    ):
+        target = self.path_for(key)
+        if os.path.abspath(path) == target:
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, _copy_file, path, target)
+
+    async def read(self, key: str) -> bytes:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, _read_file, self.path_for(key))
+
+    async def delete(self, key: str):
+        try:
+            os.remove(self.path_for(key))
+        except FileNotFoundError:
+            pass
+
+    async def exists(self, key: str) -> bool:
+        return os.path.isfile(self.path_for(key))
+
+
+def _copy_file(source: str, target: str):
+    shutil.copyfile(source, target)
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class S3Storage(StorageBackend):
+    """
+    S3-compatible object storage.
+
+    Args:
+        bucket: Bucket name
+        endpoint_url: Endpoint for MinIO and other S3-compatible servers,
+            None for AWS
+        region: Region of the bucket
+        access_key: Access key ID, None for the default credential chain
+        secret_key: Secret access key
+        prefix: Key prefix inside the bucket
+        part_size: Multipart upload part size in bytes
+        url_expiry: Lifetime of presigned URLs in seconds
+    """
+
+    name = "s3"
+
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None,
+                 region: Optional[str] = None,
+                 access_key: Optional[str] = None,
+                 secret_key: Optional[str] = None,
+                 prefix: str = "", part_size: int = 8 * 1024 * 1024,
+                 url_expiry: int = 3600):
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.prefix = prefix.strip("/")
+        self.part_size = part_size
+        self.url_expiry = url_expiry
+        self._client = None
+        self._transfer_config = None
+
+    @property
+    def client(self):
+        """boto3 client, created on first use"""
+        if self._client is None:
+            try:
+                import boto3
+                from boto3.s3.transfer import TransferConfig
+            except ImportError:
+                raise RuntimeError(
+                    "The s3 storage backend requires boto3 "
+                    "(pip install boto3)"
+                )
+            self._client = boto3.client(
+                "s3",
+                endpoint_url=self.endpoint_url,
+                region_name=self.region,
+                aws_access_key_id=self.access_key,
+                aws_secret_access_key=self.secret_key,
+            )
+            # Files above one part are uploaded as multipart uploads,
+            # streamed from disk part by part
+            self._transfer_config = TransferConfig(
+                multipart_threshold=self.part_size,
+                multipart_chunksize=self.part_size,
+            )
+        return self._client
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    async def _run(self, func, *args, **kwargs):
+        # boto3 is blocking; keep it off the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, partial(func, *args, **kwargs))
+
+    async def save_file(
+        self, path: str, key: str, content_type: Optional[str] = None
+    ):
+        client = self.client
+        extra_args = {"ContentType": content_type} if content_type else None
+        await self._run(
+            client.upload_file, path, self.bucket, self._object_key(key),
+            ExtraArgs=extra_args, Config=self._transfer_config
+        )
+
+    async def read(self, key: str) -> bytes:
+        response = await self._run(
+            self.client.get_object,
+            Bucket=self.bucket, Key=self._object_key(key)
+        )
+        return await self._run(response["Body"].read)
+
+    async def delete(self, key: str):
+        await self._run(
+            self.client.delete_object,
+            Bucket=self.bucket, Key=self._object_key(key)
+        )
+
+    async def exists(self, key: str) -> bool:
+        client = self.client
+        from botocore.exceptions import ClientError
+        try:
+            await self._run(
+                client.head_object, Bucket=self.bucket, Key=self._object_key(key)
+            )
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    def presigned_url(self, key: str) -> Optional[str]:
+        # Signing is local computation, no request is made
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self._object_key(key)},
+            ExpiresIn=self.url_expiry,
+        )
+
+
+def create_storage() -> StorageBackend:
+    """Create the storage backend selected in the settings"""
+    if settings.storage_backend == "s3":
+        return S3Storage(
+            bucket=settings.s3_bucket,
+            endpoint_url=settings.s3_endpoint_url,
+            region=settings.s3_region,
+            access_key=settings.s3_access_key,
+            secret_key=settings.s3_secret_key,
+            prefix=settings.s3_prefix,
+            part_size=settings.s3_part_size,
+            url_expiry=settings.s3_url_expiry_seconds,
+        )
+    return LocalStorage()
+
+
+# Global storage backend instance
+storage = create_storage()
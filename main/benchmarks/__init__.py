@@ -0,0 +1 @@
+"""Benchmarks: load tests against local stand-ins of the external services."""
@@ -0,0 +1,217 @@
+"""
+Local stand-ins for the external services the API talks to.
+
+FakeProviders is one aiohttp app serving:
+
+- POST /chat/completions: Perplexity. Streamed requests get the search
+  terms as structured output over server-sent events, return_images
+  requests get image URLs
+- GET /search/photos: Unsplash search results
+- GET /images/{n}.jpg: the image host; every n is a different picture
+  so validation and de-duplication keep them
+
+Latency (fixed plus random jitter) and an error rate can be set per
+instance; every request is counted by route.
+
+SmtpSink is a minimal in-process SMTP server that accepts and discards
+every message (no TLS; any credentials are accepted).
+"""
+
+import asyncio
+import io
+import json
+import random
+from collections import Counter
+from typing import Optional
+
+from aiohttp import web
+
+
+class FakeProviders:
+    """
+    Perplexity, Unsplash and image host stub.
+
+    Args:
+        latency: Seconds added to every response
+        jitter: Up to this many extra seconds, uniformly random
+        error_rate: Fraction of API calls answered with HTTP 503
+        image_size: Width and height of the served images
+        terms: Search terms returned per completion
+    """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.02,
+                 error_rate: float = 0.0, image_size: int = 256,
+                 terms: int = 5):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.image_size = image_size
+        self.terms = terms
+        self.requests = Counter()
+        self.base_url = ""
+        self._images = {}
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _delay(self):
+        await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+
+    def _fail(self) -> bool:
+        return random.random() < self.error_rate
+
+    def _image_url(self, index: int) -> str:
+        return f"{self.base_url}/images/{index}.jpg"
+
+    async def completions(self, request: web.Request) -> web.StreamResponse:
+        self.requests["perplexity"] += 1
+        payload = await request.json()
+        await self._delay()
+        if self._fail():
+            return web.Response(status=503)
+
+        if payload.get("return_images"):
+            start = random.randrange(1_000_000)
+            return web.json_response({
+                "choices": [{"message": {"content": "Here are some images"}}],
+                "images": [self._image_url(start + i) for i in range(20)],
+            })
+
+        prompt = payload["messages"][0]["content"]
+        topic = prompt.split("'")[1] if "'" in prompt else "image"
+        content = json.dumps({
+            "terms": [f"{topic} {i}" for i in range(self.terms)]
+        })
+        if not payload.get("stream"):
+            return web.json_response({
+                "choices": [{"message": {"content": content}}]
+            })
+
+        response = web.StreamResponse(
+            headers={"Content-Type": "text/event-stream"}
+        )
+        await response.prepare(request)
+        # A few tokens per event, as a real completion would send them
+        for start in range(0, len(content), 8):
+            event = {"choices": [{"delta": {"content": content[start:start + 8]}}]}
+            await response.write(f"data: {json.dumps(event)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def unsplash_search(self, request: web.Request) -> web.Response:
+        self.requests["unsplash"] += 1
+        await self._delay()
+        if self._fail():
+            return web.Response(status=503)
+        per_page = int(request.query.get("per_page", 10))
+        start = random.randrange(1_000_000)
+        return web.json_response({
+            "results": [
+                {"urls": {"regular": self._image_url(start + i)}}
+                for i in range(per_page)
+            ]
+        })
+
+    def _render_image(self, index: int) -> bytes:
+        from PIL import Image
+
+        # A random 8x8 grid scaled up: distinct hashes, cheap to encode
+        rng = random.Random(index)
+        grid = Image.new("L", (8, 8))
+        grid.putdata([rng.randrange(256) for _ in range(64)])
+        image = grid.resize(
+            (self.image_size, self.image_size), Image.NEAREST
+        ).convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=85)
+        return buffer.getvalue()
+
+    async def image(self, request: web.Request) -> web.Response:
+        self.requests["images"] += 1
+        await self._delay()
+        index = int(request.match_info["index"])
+        # A bounded set of distinct images, rendered once
+        key = index % 4096
+        body = self._images.get(key)
+        if body is None:
+            body = self._images[key] = self._render_image(key)
+        return web.Response(body=body, content_type="image/jpeg")
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Start serving; returns the base URL"""
+        app = web.Application()
+        app.router.add_post("/chat/completions", self.completions)
+        app.router.add_get("/search/photos", self.unsplash_search)
+        app.router.add_get(r"/images/{index:\d+}.jpg", self.image)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+class SmtpSink:
+    """Accepts SMTP messages and throws them away, counting them"""
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self.port = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def _session(self, reader: asyncio.StreamReader,
+                       writer: asyncio.StreamWriter):
+        def reply(line: str):
+            writer.write(line.encode() + b"\r\n")
+
+        reply("220 sink ESMTP")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode(errors="replace").strip().upper()
+                if command.startswith(("EHLO", "HELO")):
+                    reply("250-sink")
+                    reply("250-AUTH PLAIN LOGIN")
+                    reply("250 8BITMIME")
+                elif command == "DATA":
+                    reply("354 End data with <CR><LF>.<CR><LF>")
+                    await writer.drain()
+                    size = 0
+                    while True:
+                        data = await reader.readline()
+                        if not data or data == b".\r\n":
+                            break
+                        size += len(data)
+                    self.messages += 1
+                    self.bytes += size
+                    reply("250 OK")
+                elif command.startswith("AUTH"):
+                    reply("235 Authentication successful")
+                elif command == "QUIT":
+                    reply("221 Bye")
+                    break
+                else:
+                    # MAIL, RCPT, RSET, NOOP
+                    reply("250 OK")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        """Start listening; returns the port"""
+        self._server = await asyncio.start_server(self._session, host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
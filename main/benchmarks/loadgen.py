@@ -0,0 +1,474 @@
+"""
+Load generator for the SnapNSend API.
+
+Starts the local stand-ins (see fake_services), launches the API
+against them in a subprocess, registers users through /v1/register and
+then keeps --concurrency clients submitting /v1/requests for
+--duration seconds. Async requests are polled until they finish.
+
+Reported per run:
+
+- client side: RPS and p50/p95/p99 latency of register, submit and
+  end-to-end completion, plus failures
+- server side: p50/p95/p99 of the processing stages (scheduler wait,
+  download, renditions, delivery), estimated from the /metrics
+  histograms
+- memory: peak and final RSS of the API processes
+- traffic to the stand-ins and the SMTP sink
+
+Results are written to benchmarks/results/<time>-<git revision>.json;
+compare two runs with the compare command.
+
+    python -m benchmarks.loadgen run --concurrency 20 --duration 60
+    python -m benchmarks.loadgen run --mode sync --n 10 --workers 4
+    python -m benchmarks.loadgen compare results/a.json results/b.json
+
+Run from the main/ folder.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from .fake_services import FakeProviders, SmtpSink
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(APP_DIR, "benchmarks", "results")
+
+# Server-side histograms reported per stage
+STAGE_METRICS = {
+    "snapnsend_scheduler_wait_seconds": "lane",
+    "snapnsend_request_stage_seconds": "stage",
+}
+
+
+def percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    """Count, p50, p95, p99 and max (nearest rank), in seconds"""
+    if not samples:
+        return {"count": 0, "p50": None, "p95": None, "p99": None, "max": None}
+    ordered = sorted(samples)
+
+    def rank(q: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, int(q * len(ordered) + 0.5) - 1))]
+
+    return {
+        "count": len(ordered),
+        "p50": rank(0.50),
+        "p95": rank(0.95),
+        "p99": rank(0.99),
+        "max": ordered[-1],
+    }
+
+
+def parse_histograms(text: str, name: str, label: str) -> Dict[str, list]:
+    """Cumulative (upper bound, count) buckets per label value"""
+    buckets = defaultdict(list)
+    prefix = f"{name}_bucket{{"
+    for line in text.splitlines():
+        if not line.startswith(prefix):
+            continue
+        labels, value = line[len(prefix):].rsplit("} ", 1)
+        parsed = dict(
+            part.split("=", 1) for part in labels.split(",") if "=" in part
+        )
+        bound = parsed["le"].strip('"')
+        buckets[parsed.get(label, '""').strip('"')].append(
+            (float("inf") if bound == "+Inf" else float(bound), float(value))
+        )
+    return buckets
+
+
+def histogram_quantile(q: float, buckets: list) -> Optional[float]:
+    """Prometheus-style quantile estimate from cumulative buckets"""
+    buckets = sorted(buckets)
+    if not buckets or buckets[-1][1] == 0:
+        return None
+    target = q * buckets[-1][1]
+    lower, below = 0.0, 0.0
+    for bound, count in buckets:
+        if count >= target:
+            if bound == float("inf"):
+                return lower
+            if count == below:
+                return bound
+            return lower + (bound - lower) * (target - below) / (count - below)
+        lower, below = bound, count
+    return lower
+
+
+def process_rss_bytes(pid: int) -> Optional[int]:
+    """RSS of a process and its children (Linux /proc), None elsewhere"""
+    total = 0
+    pending = [pid]
+    try:
+        while pending:
+            current = pending.pop()
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pending.extend(int(child) for child in f.read().split())
+    except (FileNotFoundError, ProcessLookupError):
+        if total == 0:
+            return None
+    return total
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], cwd=APP_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class LoadTest:
+    """One benchmark run; see the module docstring"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.latencies = defaultdict(list)
+        self.outcomes = Counter()
+        self.rss_samples: List[int] = []
+        self.server: Optional[subprocess.Popen] = None
+        self.base_url = args.target
+
+    def server_env(self, providers_url: str, smtp_port: int,
+                   workdir: str) -> Dict[str, str]:
+        env = dict(os.environ)
+        env.update({
+            "PYTHONPATH": APP_DIR,
+            "PERPLEXITY_API_KEY": "benchmark",
+            "UNSPLASH_ACCESS_KEY": "benchmark",
+            "PERPLEXITY_API_BASE": providers_url,
+            "UNSPLASH_API_BASE": providers_url,
+            "IMAGE_SEARCH_PROVIDERS": '["unsplash"]',
+            "DOWNLOAD_REAL_IMAGES": "true",
+            "SMTP_SERVER": "127.0.0.1",
+            "SMTP_PORT": str(smtp_port),
+            "SMTP_SECURITY": "none",
+            # The username doubles as the sender address
+            "SMTP_USERNAME": "snapnsend@example.com",
+            "SMTP_PASSWORD": "benchmark",
+            "DOWNLOADS_DIR": os.path.join(workdir, "downloads"),
+            "RENDITION_CACHE_DIR": os.path.join(workdir, "downloads", ".renditions"),
+            "RETENTION_ENABLED": "false",
+            "PUBLIC_BASE_URL": self.base_url,
+            "LOG_LEVEL": "WARNING",
+            # Measure the pipeline, not the admission limits
+            "RATE_LIMIT_REQUESTS": "1000000000",
+            "MAX_CONCURRENT_REQUESTS": "100000",
+            "PERPLEXITY_REQUESTS_PER_SECOND": "1000000",
+            "PERPLEXITY_REQUESTS_PER_MINUTE": "1000000000",
+            "UNSPLASH_REQUESTS_PER_SECOND": "1000000",
+            "UNSPLASH_REQUESTS_PER_HOUR": "1000000000",
+        })
+        for item in self.args.server_env:
+            key, _, value = item.partition("=")
+            env[key] = value
+        return env
+
+    async def start_server(self, env: Dict[str, str], workdir: str):
+        port = self.args.port
+        if self.args.workers is not None:
+            command = [
+                sys.executable, os.path.join(APP_DIR, "run_server.py"),
+                "--workers", str(self.args.workers),
+                "--host", "127.0.0.1", "--port", str(port),
+            ]
+        else:
+            command = [
+                sys.executable, "-m", "uvicorn", "app.main:app",
+                "--host", "127.0.0.1", "--port", str(port),
+                "--log-level", "warning",
+            ]
+        self.server = subprocess.Popen(command, cwd=workdir, env=env)
+
+        deadline = time.monotonic() + 30
+        async with aiohttp.ClientSession() as session:
+            while time.monotonic() < deadline:
+                if self.server.poll() is not None:
+                    raise RuntimeError("API server exited during startup")
+                try:
+                    async with session.get(f"{self.base_url}/v1/health") as response:
+                        if response.status == 200:
+                            return
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.2)
+        raise RuntimeError("API server did not become healthy")
+
+    def stop_server(self):
+        if self.server is not None:
+            self.server.terminate()
+            try:
+                self.server.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                self.server.kill()
+
+    async def sample_memory(self):
+        while True:
+            if self.server is not None:
+                rss = process_rss_bytes(self.server.pid)
+                if rss:
+                    self.rss_samples.append(rss)
+            await asyncio.sleep(0.5)
+
+    async def timed(self, stage: str, call):
+        started = time.monotonic()
+        result = await call
+        self.latencies[stage].append(time.monotonic() - started)
+        return result
+
+    async def register(self, session: aiohttp.ClientSession, index: int) -> Optional[str]:
+        suffix = uuid.uuid4().hex[:8]
+        payload = {
+            "user_name": f"bench_{index}_{suffix}",
+            "user_mail": f"bench_{index}_{suffix}@example.com",
+        }
+
+        async def call():
+            async with session.post(f"{self.base_url}/v1/register", json=payload) as response:
+                return response.status, await response.json()
+
+        status, body = await self.timed("register", call())
+        if status != 200:
+            self.outcomes["register_failed"] += 1
+            return None
+        return body["user_id"]
+
+    async def submit(self, session: aiohttp.ClientSession, user_id: str):
+        payload = {
+            "user": user_id,
+            "n": self.args.n,
+            "mode": self.args.mode,
+            "prompt": random.choice(["mountains", "cats", "city at night", "forest"]),
+        }
+        started = time.monotonic()
+
+        async def call():
+            async with session.post(f"{self.base_url}/v1/requests", json=payload) as response:
+                return response.status, await response.json()
+
+        status, body = await self.timed("submit", call())
+        if status != 201:
+            self.outcomes[f"http_{status}"] += 1
+            return
+
+        # Async requests are done once polling says so
+        while body.get("status") in ("pending", "processing"):
+            await asyncio.sleep(self.args.poll_interval)
+            async with session.get(f"{self.base_url}/v1/requests/{body['request_id']}") as response:
+                if response.status != 200:
+                    self.outcomes[f"poll_http_{response.status}"] += 1
+                    return
+                body = await response.json()
+
+        self.latencies["end_to_end"].append(time.monotonic() - started)
+        self.outcomes[body.get("status", "unknown")] += 1
+
+    async def client(self, session: aiohttp.ClientSession, users: List[str], deadline: float):
+        while time.monotonic() < deadline:
+            try:
+                await self.submit(session, random.choice(users))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.outcomes[type(e).__name__] += 1
+
+    async def server_stages(self, session: aiohttp.ClientSession) -> dict:
+        async with session.get(f"{self.base_url}/metrics") as response:
+            text = await response.text()
+        stages = {}
+        for name, label in STAGE_METRICS.items():
+            for value, buckets in parse_histograms(text, name, label).items():
+                stages[f"{name.rsplit('_', 1)[0].replace('snapnsend_', '')}:{value}"] = {
+                    "count": int(max(count for _, count in buckets)),
+                    **{
+                        f"p{int(q * 100)}": histogram_quantile(q, buckets)
+                        for q in (0.50, 0.95, 0.99)
+                    },
+                }
+        return stages
+
+    async def run(self) -> dict:
+        args = self.args
+        providers = FakeProviders(
+            latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+            error_rate=args.error_rate, image_size=args.image_size
+        )
+        sink = SmtpSink()
+        workdir = tempfile.mkdtemp(prefix="snapnsend-bench-")
+
+        providers_url = await providers.start()
+        smtp_port = await sink.start()
+        sampler = None
+        try:
+            if not self.base_url:
+                self.base_url = f"http://127.0.0.1:{args.port}"
+                await self.start_server(self.server_env(providers_url, smtp_port, workdir), workdir)
+                sampler = asyncio.create_task(self.sample_memory())
+            else:
+                print(f"Using {self.base_url}; point it at the stand-ins with "
+                      f"PERPLEXITY_API_BASE={providers_url} UNSPLASH_API_BASE={providers_url} "
+                      f"SMTP_SERVER=127.0.0.1 SMTP_PORT={smtp_port} SMTP_SECURITY=none")
+
+            connector = aiohttp.TCPConnector(limit=args.concurrency * 2)
+            timeout = aiohttp.ClientTimeout(total=args.request_timeout)
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+                users = [
+                    user for user in await asyncio.gather(*(
+                        self.register(session, i) for i in range(args.users)
+                    )) if user
+                ]
+                if not users:
+                    raise RuntimeError("No user could be registered")
+
+                started = time.monotonic()
+                deadline = started + args.duration
+                await asyncio.gather(*(
+                    self.client(session, users, deadline)
+                    for _ in range(args.concurrency)
+                ))
+                elapsed = time.monotonic() - started
+                stages = await self.server_stages(session)
+        finally:
+            if sampler is not None:
+                sampler.cancel()
+            final_rss = process_rss_bytes(self.server.pid) if self.server else None
+            self.stop_server()
+            await providers.stop()
+            await sink.stop()
+
+        completed = len(self.latencies["end_to_end"])
+        return {
+            "revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": {
+                key: value for key, value in vars(args).items()
+                if key not in ("func", "output")
+            },
+            "duration_seconds": elapsed,
+            "throughput_rps": completed / elapsed if elapsed else 0.0,
+            "submit_rps": len(self.latencies["submit"]) / elapsed if elapsed else 0.0,
+            "latency_seconds": {
+                stage: percentiles(samples)
+                for stage, samples in self.latencies.items()
+            },
+            "server_stages_seconds": stages,
+            "outcomes": dict(self.outcomes),
+            "memory": {
+                "peak_rss_mb": max(self.rss_samples) / 2**20 if self.rss_samples else None,
+                "final_rss_mb": final_rss / 2**20 if final_rss else None,
+            },
+            "upstream_requests": dict(providers.requests),
+            "smtp": {"messages": sink.messages, "bytes": sink.bytes},
+        }
+
+
+def print_report(result: dict):
+    print(f"\nRevision {result['revision']}, {result['duration_seconds']:.1f}s")
+    print(f"Throughput: {result['throughput_rps']:.2f} completed requests/s "
+          f"({result['submit_rps']:.2f} submitted/s)")
+    print(f"{'stage':<40} {'count':>7} {'p50':>9} {'p95':>9} {'p99':>9}")
+    rows = list(result["latency_seconds"].items()) + list(result["server_stages_seconds"].items())
+    for stage, stats in rows:
+        cells = [
+            f"{stats[key] * 1000:8.1f}ms" if stats[key] is not None else f"{'-':>10}"
+            for key in ("p50", "p95", "p99")
+        ]
+        print(f"{stage:<40} {stats['count']:>7} {''.join(cells)}")
+    print(f"Outcomes: {result['outcomes']}")
+    memory = result["memory"]
+    if memory["peak_rss_mb"] is not None:
+        print(f"Memory: peak {memory['peak_rss_mb']:.1f} MiB RSS")
+    print(f"Upstream: {result['upstream_requests']}, SMTP: {result['smtp']}")
+
+
+def flatten(result: dict) -> Dict[str, float]:
+    """Comparable numbers of a result"""
+    values = {
+        "throughput_rps": result["throughput_rps"],
+        "peak_rss_mb": result["memory"]["peak_rss_mb"],
+    }
+    for group in ("latency_seconds", "server_stages_seconds"):
+        for stage, stats in result[group].items():
+            for key in ("p50", "p95", "p99"):
+                values[f"{stage}.{key}"] = stats.get(key)
+    return values
+
+
+def compare(baseline_path: str, candidate_path: str):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(candidate_path) as f:
+        candidate = json.load(f)
+    print(f"{'metric':<48} {baseline['revision']:>14} {candidate['revision']:>14} {'change':>9}")
+    old_values, new_values = flatten(baseline), flatten(candidate)
+    for key in sorted(set(old_values) | set(new_values)):
+        old, new = old_values.get(key), new_values.get(key)
+        change = f"{(new - old) / old * 100:+8.1f}%" if old and new is not None else f"{'':>9}"
+        fmt = lambda value: f"{value:14.4f}" if value is not None else f"{'-':>14}"  # noqa: E731
+        print(f"{key:<48} {fmt(old)} {fmt(new)} {change}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load test the SnapNSend API")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run a load test")
+    run_parser.add_argument("--users", type=int, default=20, help="Users to register")
+    run_parser.add_argument("--concurrency", type=int, default=10, help="Concurrent clients")
+    run_parser.add_argument("--duration", type=float, default=30.0, help="Seconds of load")
+    run_parser.add_argument("--n", type=int, default=3, help="Images per request")
+    run_parser.add_argument("--mode", choices=["async", "sync"], default="async")
+    run_parser.add_argument("--poll-interval", type=float, default=0.1)
+    run_parser.add_argument("--request-timeout", type=float, default=120.0)
+    run_parser.add_argument("--latency-ms", type=float, default=50.0, help="Stand-in latency")
+    run_parser.add_argument("--jitter-ms", type=float, default=20.0)
+    run_parser.add_argument("--error-rate", type=float, default=0.0, help="Stand-in HTTP 503 rate")
+    run_parser.add_argument("--image-size", type=int, default=256)
+    run_parser.add_argument("--workers", type=int, default=None,
+                            help="Run the API with run_server.py and this many workers "
+                                 "(0 = one per core); default is a single uvicorn process")
+    run_parser.add_argument("--port", type=int, default=8765)
+    run_parser.add_argument("--target", default="", help="Benchmark an already running API instead")
+    run_parser.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE",
+                            help="Extra environment for the API server")
+    run_parser.add_argument("--output", help="Result file (default: benchmarks/results/...)")
+
+    compare_parser = commands.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+
+    args = parser.parse_args(argv)
+    if args.command == "compare":
+        compare(args.baseline, args.candidate)
+        return 0
+
+    result = asyncio.run(LoadTest(args).run())
+    print_report(result)
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{result['revision']}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Results written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
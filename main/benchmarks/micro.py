@@ -0,0 +1,465 @@
+"""
+Micro-benchmarks of the request hot paths, with regression gates.
+
+Each benchmark times one path in isolation, without network access:
+
+- db_get_user_by_id: user lookup in a database of 1000 users
+- db_register_user: RequestService.register_user (existence checks and
+  insert; the welcome email is stubbed out)
+- terms_stream_parse: the term parsing of get_search_terms_from_perplexity,
+  SSE decoding plus StreamingTermParser over a streamed completion
+- terms_fallback_parse: parse_search_terms on a free-text answer
+- email_mime_images: send_images_email with five 100 KB attachments,
+  message built and flattened but not sent
+- image_black_square: _create_black_square_image (PIL encode to JPEG)
+- schema_search_response_list: FastAPI response serialization of
+  100 SearchResponse objects with 10 image URLs each
+
+A run calibrates the iterations per round (like timeit's autorange),
+takes --rounds rounds and reports min / median / stdev per call. It
+then compares the fastest round with the stored baseline
+(benchmarks/baselines/micro.json) and exits with status 1 if a path
+got slower than the threshold allows. The fastest round is the least
+disturbed by other load on the machine. To make baselines usable on
+other machines, every result is also divided by a fixed pure-Python
+calibration workload timed in the same run (before and after the
+benchmarks, fastest of both), and the normalized numbers are compared.
+
+    python -m benchmarks.micro run
+    python -m benchmarks.micro run -k db_ --rounds 30
+    python -m benchmarks.micro run --save-baseline
+
+Run from the main/ folder.
+"""
+
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+from unittest import mock
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(APP_DIR, "benchmarks", "baselines", "micro.json")
+
+# Allowed slowdown of the normalized fastest round before a run fails
+DEFAULT_THRESHOLD = 0.25
+
+
+@dataclass
+class Benchmark:
+    """
+    A registered benchmark.
+
+    setup(workdir, stack) prepares the fixtures and returns the function
+    to time, sync or async; patches are entered on stack and undone
+    after the benchmark.
+    """
+    name: str
+    setup: Callable[[str, ExitStack], Callable]
+    threshold: Optional[float] = None
+
+
+BENCHMARKS: Dict[str, Benchmark] = {}
+
+
+def benchmark(name: str, threshold: Optional[float] = None):
+    """Register a benchmark setup function; threshold overrides the default"""
+    def register(setup):
+        BENCHMARKS[name] = Benchmark(name, setup, threshold)
+        return setup
+    return register
+
+
+def _make_user(index: int):
+    from datetime import datetime
+    from uuid import uuid4
+
+    from app.models.user import User
+
+    return User(
+        id=uuid4(), user_name=f"user_{index}",
+        user_mail=f"user_{index}@example.com", created_at=datetime.utcnow()
+    )
+
+
+@benchmark("db_get_user_by_id", threshold=0.5)
+def setup_get_user_by_id(workdir: str, stack: ExitStack):
+    from app.db.database import DatabaseManager
+
+    db = DatabaseManager(os.path.join(workdir, "users.db"))
+    user_ids = []
+    for i in range(1000):
+        user = _make_user(i)
+        db.create_user(user)
+        user_ids.append(str(user.id))
+    position = 0
+
+    def get_user():
+        nonlocal position
+        position = (position + 1) % len(user_ids)
+        return db.get_user_by_id(user_ids[position])
+
+    return get_user
+
+
+@benchmark("db_register_user", threshold=0.5)
+def setup_register_user(workdir: str, stack: ExitStack):
+    from app.db.database import DatabaseManager
+    from app.schemas import RegisterRequest
+    from app.services import request_service as request_service_module
+
+    service = request_service_module.RequestService()
+    service._db_manager = DatabaseManager(os.path.join(workdir, "users.db"))
+    stack.enter_context(mock.patch.object(
+        request_service_module.email_service, "send_registration_email",
+        mock.AsyncMock(return_value=True)
+    ))
+    counter = 0
+
+    async def register():
+        nonlocal counter
+        counter += 1
+        response = await service.register_user(RegisterRequest(
+            user_name=f"bench_{counter}", user_mail=f"bench_{counter}@example.com"
+        ))
+        assert response.status == "done"
+
+    return register
+
+
+@benchmark("terms_stream_parse")
+def setup_terms_stream_parse(workdir: str, stack: ExitStack):
+    from app.ai.term_parser import StreamingTermParser, iter_sse_content
+
+    content = json.dumps({
+        "terms": [f"mountain landscape at dawn {i}" for i in range(10)]
+    })
+    # A few characters per event, as Perplexity streams them
+    lines = [
+        f"data: {json.dumps({'choices': [{'delta': {'content': content[i:i + 6]}}]})}\n".encode()
+        for i in range(0, len(content), 6)
+    ] + [b"data: [DONE]\n"]
+
+    class StreamedResponse:
+        @property
+        async def content(self):
+            for line in lines:
+                yield line
+
+    response = StreamedResponse()
+
+    async def parse():
+        parser = StreamingTermParser()
+        terms = []
+        async for chunk in iter_sse_content(response):
+            terms.extend(parser.feed(chunk))
+        assert len(terms) == 10
+
+    return parse
+
+
+@benchmark("terms_fallback_parse")
+def setup_terms_fallback_parse(workdir: str, stack: ExitStack):
+    from app.ai.term_parser import parse_search_terms
+
+    content = "Here are some search terms:\n" + "\n".join(
+        f"{i}. mountain landscape at dawn {i}" for i in range(1, 11)
+    )
+    return lambda: parse_search_terms(content)
+
+
+@benchmark("email_mime_images")
+def setup_email_mime_images(workdir: str, stack: ExitStack):
+    from app.utils.email_service import email_service
+
+    paths = []
+    for i in range(5):
+        path = os.path.join(workdir, f"image_{i}.jpg")
+        with open(path, "wb") as f:
+            f.write(os.urandom(100 * 1024))
+        paths.append(path)
+    # Flatten the message as smtplib would, but don't send it
+    stack.enter_context(mock.patch.object(
+        email_service, "_send_message", lambda msg: msg.as_bytes()
+    ))
+
+    async def build():
+        assert await email_service.send_images_email(
+            "bench", "bench@example.com", paths, "mountains"
+        )
+
+    return build
+
+
+@benchmark("image_black_square", threshold=0.5)
+def setup_image_black_square(workdir: str, stack: ExitStack):
+    stack.enter_context(mock.patch.dict(os.environ, {"PERPLEXITY_API_KEY": "benchmark"}))
+    from app.ai.image_downloader import PerplexityImageDownloader
+
+    downloader = PerplexityImageDownloader()
+    path = os.path.join(workdir, "black_square.jpg")
+
+    async def create():
+        await downloader._create_black_square_image(path)
+
+    return create
+
+
+@benchmark("schema_search_response_list")
+def setup_search_response_list(workdir: str, stack: ExitStack):
+    from uuid import uuid4
+
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+    from fastapi.utils import create_response_field
+
+    from app.schemas import SearchResponse
+
+    # The same field FastAPI builds for response_model=List[SearchResponse]
+    field = create_response_field(
+        name="Response_list_requests", type_=List[SearchResponse],
+        mode="serialization"
+    )
+    responses = [
+        SearchResponse(
+            request_id=uuid4(), status="done",
+            images=[
+                f"http://localhost:8000/v1/requests/{i}/images/{n}"
+                for n in range(10)
+            ]
+        )
+        for i in range(100)
+    ]
+
+    async def serialize():
+        content = await serialize_response(field=field, response_content=responses)
+        return JSONResponse(content).body
+
+    return serialize
+
+
+def calibration_workload():
+    """Fixed pure-Python work the other timings are divided by"""
+    total = 0
+    items = {}
+    for i in range(20000):
+        items[str(i)] = i * 3
+        total += len(str(i * 7)) + items[str(i)] % 11
+    return total
+
+
+async def _time_async(func, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await func()
+    return time.perf_counter() - started
+
+
+def _time_sync(func, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return time.perf_counter() - started
+
+
+def measure(func: Callable, rounds: int, min_round_time: float,
+            loop: asyncio.AbstractEventLoop) -> Dict[str, float]:
+    """Time func; returns per-call statistics in seconds"""
+    if inspect.iscoroutinefunction(func):
+        def run(iterations):
+            return loop.run_until_complete(_time_async(func, iterations))
+    else:
+        def run(iterations):
+            return _time_sync(func, iterations)
+
+    # Warm up (imports, caches), then grow the round until it is long
+    # enough for the timer resolution
+    run(1)
+    iterations = 1
+    while True:
+        elapsed = run(iterations)
+        if elapsed >= min_round_time or iterations >= 1_000_000:
+            break
+        iterations *= 10 if elapsed < min_round_time / 10 else 2
+
+    samples = [run(iterations) / iterations for _ in range(rounds)]
+    return {
+        "iterations": iterations,
+        "rounds": rounds,
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+
+
+def run_benchmarks(names: List[str], rounds: int = 15,
+                   min_round_time: float = 0.05) -> dict:
+    """Run the named benchmarks; returns the result document"""
+    loop = asyncio.new_event_loop()
+    results = {}
+    try:
+        calibration = measure(calibration_workload, rounds, min_round_time, loop)["min"]
+        for name in names:
+            workdir = tempfile.mkdtemp(prefix=f"snapnsend-{name}-")
+            try:
+                with ExitStack() as stack:
+                    func = BENCHMARKS[name].setup(workdir, stack)
+                    stats = measure(func, rounds, min_round_time, loop)
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+            results[name] = stats
+        calibration = min(
+            calibration,
+            measure(calibration_workload, rounds, min_round_time, loop)["min"]
+        )
+    finally:
+        loop.close()
+
+    from .loadgen import git_revision
+
+    return {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "calibration_seconds": calibration,
+        "benchmarks": {
+            name: dict(stats, normalized=stats["min"] / calibration)
+            for name, stats in results.items()
+        },
+    }
+
+
+def find_regressions(result: dict, baseline: dict,
+                     threshold: Optional[float] = None,
+                     normalize: bool = True) -> List[dict]:
+    """
+    Compare a run with a baseline.
+
+    Args:
+        result: Document from run_benchmarks
+        baseline: Stored baseline document
+        threshold: Allowed slowdown (0.25 = 25%); defaults to the
+            benchmark's own threshold, then DEFAULT_THRESHOLD
+        normalize: Compare calibration-normalized timings instead of
+            raw seconds
+
+    Returns:
+        One entry per benchmark present in both, with its change and
+        whether it regressed
+    """
+    key = "normalized" if normalize else "min"
+    comparisons = []
+    for name, stats in result["benchmarks"].items():
+        reference = baseline.get("benchmarks", {}).get(name)
+        if not reference or not reference.get(key):
+            continue
+        registered = BENCHMARKS.get(name)
+        allowed = threshold
+        if allowed is None:
+            allowed = registered.threshold if registered and registered.threshold is not None else DEFAULT_THRESHOLD
+        change = stats[key] / reference[key] - 1
+        comparisons.append({
+            "name": name,
+            "change": change,
+            "threshold": allowed,
+            "regressed": change > allowed,
+        })
+    return comparisons
+
+
+def print_report(result: dict, comparisons: List[dict]):
+    changes = {c["name"]: c for c in comparisons}
+    print(f"Revision {result['revision']}, calibration "
+          f"{result['calibration_seconds'] * 1e3:.2f}ms")
+    print(f"{'benchmark':<30} {'min':>11} {'median':>11} {'stdev':>11} {'vs baseline':>16}")
+    for name, stats in result["benchmarks"].items():
+        row = f"{name:<30}" + "".join(
+            f" {stats[key] * 1e6:9.1f}us" for key in ("min", "median", "stdev")
+        )
+        comparison = changes.get(name)
+        if comparison:
+            flag = "  REGRESSION" if comparison["regressed"] else ""
+            row += f" {comparison['change'] * 100:+8.1f}% (<{comparison['threshold'] * 100:.0f}%){flag}"
+        print(row)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the hot paths")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run and compare with the baseline")
+    run_parser.add_argument("-k", dest="pattern", default="",
+                            help="Only benchmarks whose name contains this")
+    run_parser.add_argument("--rounds", type=int, default=15)
+    run_parser.add_argument("--min-round-time", type=float, default=0.05,
+                            help="Seconds per round at least")
+    run_parser.add_argument("--baseline", default=BASELINE_PATH)
+    run_parser.add_argument("--threshold", type=float,
+                            help="Allowed slowdown for every benchmark, e.g. 0.25")
+    run_parser.add_argument("--raw", action="store_true",
+                            help="Compare seconds instead of normalized timings")
+    run_parser.add_argument("--save-baseline", action="store_true",
+                            help="Store this run as the baseline instead of gating")
+    run_parser.add_argument("--output", help="Also write the result to this file")
+
+    commands.add_parser("list", help="List the benchmarks")
+
+    args = parser.parse_args(argv)
+    if args.command == "list":
+        for name in BENCHMARKS:
+            print(name)
+        return 0
+
+    names = [name for name in BENCHMARKS if args.pattern in name]
+    if not names:
+        print(f"No benchmark matches {args.pattern!r}")
+        return 2
+
+    result = run_benchmarks(names, args.rounds, args.min_round_time)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.save_baseline:
+        baseline = {"benchmarks": {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        # Keep the entries of benchmarks that were not run
+        baseline.update({key: value for key, value in result.items() if key != "benchmarks"})
+        baseline["benchmarks"].update(result["benchmarks"])
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+        print_report(result, [])
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    comparisons = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        comparisons = find_regressions(result, baseline, args.threshold, not args.raw)
+    else:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one")
+    print_report(result, comparisons)
+
+    regressed = [c["name"] for c in comparisons if c["regressed"]]
+    if regressed:
+        print(f"Regressed: {', '.join(regressed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,15 @@
+import pytest
+
+from app.core.config import settings
+from app.db.database import DatabaseManager
+from app.services.request_service import request_service
+
+
+@pytest.fixture(autouse=True)
+def isolated_files(tmp_path_factory, monkeypatch):
+    """Keep the database and downloads of every test out of the working tree"""
+    root = tmp_path_factory.mktemp("state")
+    monkeypatch.setattr(settings, "downloads_dir", str(root / "downloads"))
+    monkeypatch.setattr(
+        request_service, "_db_manager", DatabaseManager(str(root / "users.db"))
+    )
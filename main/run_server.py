@@ -69,6 +69,27 @@ def run_simple_server():
     print(f"App version: {app.version}")
     print("App imported successfully!")
 
+def parse_args():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the SnapNSend API server")
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="Run the production server with N worker processes (0 = one per CPU core)"
+    )
+    parser.add_argument("--host", default=None, help="Address to listen on (production server)")
+    parser.add_argument("--port", type=int, default=None, help="Port to listen on (production server)")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
+    args = parse_args()
+    if args.workers is not None or os.environ.get("ENVIRONMENT") == "production":
+        import logging
+        from app.core.server import run_production
+
+        logging.basicConfig(level=logging.INFO)
+        sys.exit(run_production(args.host, args.port, args.workers))
+
     print("Attempting to run SnapNSend API server...")
     run_with_uvicorn_programmatically()
\ No newline at end of file
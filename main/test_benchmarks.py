@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from app.core.config import settings
+from app.utils.email_service import email_service
+from benchmarks.fake_services import SmtpSink
+from benchmarks.loadgen import histogram_quantile, parse_histograms, percentiles
+from benchmarks.micro import BENCHMARKS, find_regressions, run_benchmarks
+
+
+@pytest.mark.asyncio
+async def test_registration_email_reaches_plain_smtp_sink(monkeypatch):
+    sink = SmtpSink()
+    port = await sink.start()
+    monkeypatch.setattr(settings, "smtp_server", "127.0.0.1")
+    monkeypatch.setattr(settings, "smtp_port", port)
+    monkeypatch.setattr(settings, "smtp_security", "none")
+    monkeypatch.setattr(settings, "smtp_username", "snapnsend@example.com")
+    try:
+        # smtplib blocks; keep this loop free to serve the sink
+        sent = await asyncio.to_thread(
+            asyncio.run,
+            email_service.send_registration_email("bench", "bench@example.com", "id")
+        )
+    finally:
+        await sink.stop()
+
+    assert sent is True
+    assert sink.messages == 1
+    assert sink.bytes > 0
+
+
+def test_stage_percentiles_from_metrics():
+    text = "\n".join([
+        'snapnsend_request_stage_seconds_bucket{stage="download",le="0.1"} 50',
+        'snapnsend_request_stage_seconds_bucket{stage="download",le="1.0"} 100',
+        'snapnsend_request_stage_seconds_bucket{stage="download",le="+Inf"} 100',
+        'snapnsend_request_stage_seconds_count{stage="download"} 100',
+    ])
+    buckets = parse_histograms(text, "snapnsend_request_stage_seconds", "stage")
+
+    assert histogram_quantile(0.5, buckets["download"]) == pytest.approx(0.1)
+    assert histogram_quantile(0.75, buckets["download"]) == pytest.approx(0.55)
+
+    stats = percentiles([i / 100 for i in range(1, 101)])
+    assert (stats["p50"], stats["p99"], stats["max"]) == (0.5, 0.99, 1.0)
+
+
+def test_micro_benchmarks_run_and_gate():
+    # One call each, to keep the benchmarks from rotting
+    result = run_benchmarks(list(BENCHMARKS), rounds=1, min_round_time=0)
+    assert set(result["benchmarks"]) == set(BENCHMARKS)
+
+    baseline = {"benchmarks": {
+        name: dict(stats, normalized=stats["normalized"] / 2)
+        for name, stats in result["benchmarks"].items()
+    }}
+    assert all(c["regressed"] for c in find_regressions(result, baseline))
+    assert not any(
+        c["regressed"] for c in find_regressions(result, baseline, threshold=1.5)
+    )
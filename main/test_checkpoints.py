@@ -0,0 +1,189 @@
+import asyncio
+import os
+from datetime import datetime
+from uuid import uuid4
+
+import pytest
+
+from app.ai.checkpoints import RequestCheckpoint
+from app.ai.image_downloader import PerplexityImageDownloader
+from app.db.database import DatabaseManager
+from app.models.user import User
+from app.schemas import SearchRequest
+from app.services import request_service as request_service_module
+from app.services.job_scheduler import JobScheduler
+from app.services.request_service import RequestBusy, RequestService
+
+
+@pytest.fixture
+def downloader_env(monkeypatch, tmp_path):
+    monkeypatch.setenv("PERPLEXITY_API_KEY", "test-key")
+    for key in ("UNSPLASH_ACCESS_KEY", "PEXELS_API_KEY", "BING_SEARCH_API_KEY"):
+        monkeypatch.delenv(key, raising=False)
+    # Keep downloads/ out of the working tree
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.mark.asyncio
+async def test_download_resumes_after_completed_search(downloader_env, monkeypatch):
+    async def no_terms(self, query):
+        raise AssertionError("search terms were requested again")
+        yield
+
+    monkeypatch.setattr(
+        PerplexityImageDownloader, "stream_search_terms_from_perplexity", no_terms
+    )
+    checkpoint = RequestCheckpoint("req", num_images=3)
+    checkpoint.record_urls([f"https://img/{i}.jpg" for i in range(5)])
+
+    async with PerplexityImageDownloader() as downloader:
+        # An earlier attempt got the first image before failing
+        first = await downloader.run_download_pipeline(
+            ["https://img/0.jpg"], "user", "req", 1, checkpoint
+        )
+        downloaded = []
+        original = downloader._download_image
+
+        async def recording_download(i, url, folder_path):
+            downloaded.append(url)
+            return await original(i, url, folder_path)
+
+        downloader._download_image = recording_download
+        paths = await downloader.search_and_download_images(
+            "cats", 3, "user", "req", checkpoint=checkpoint
+        )
+
+    assert paths[0] == first[0]
+    assert downloaded == ["https://img/1.jpg", "https://img/2.jpg"]
+    # File numbering continues after the first attempt
+    assert [os.path.basename(p) for p in paths] == [
+        "black_square_img_01.jpg", "black_square_img_02.jpg",
+        "black_square_img_03.jpg"
+    ]
+    assert checkpoint.tried == [f"https://img/{i}.jpg" for i in range(3)]
+
+
+def test_interrupted_requests_are_claimed_once(tmp_path):
+    db = DatabaseManager(str(tmp_path / "users.db"))
+    db.save_checkpoint(RequestCheckpoint("leased", status="processing"), lease_seconds=600)
+    db.save_checkpoint(RequestCheckpoint("expired", status="processing"))
+    db.save_checkpoint(RequestCheckpoint("finished", status="done"))
+
+    claimed = db.claim_interrupted_checkpoints(lease_seconds=600)
+    assert [c.request_id for c in claimed] == ["expired"]
+    assert db.claim_interrupted_checkpoints(lease_seconds=600) == []
+
+    db.release_checkpoints(["leased"])
+    claimed = db.claim_interrupted_checkpoints(lease_seconds=600)
+    assert [c.request_id for c in claimed] == ["leased"]
+
+
+@pytest.mark.asyncio
+async def test_retry_skips_completed_stages(tmp_path, monkeypatch):
+    service = RequestService()
+    service._db_manager = DatabaseManager(str(tmp_path / "users.db"))
+    user = User(
+        id=uuid4(), user_name="resume", user_mail="resume@example.com",
+        created_at=datetime.utcnow()
+    )
+    service.db_manager.create_user(user)
+    image = tmp_path / "img_01.jpg"
+    image.write_bytes(b"image")
+
+    downloads = 0
+    emails = []
+
+    class FakeDownloader:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc_info):
+            pass
+
+        async def search_and_download_images(self, checkpoint, **kwargs):
+            nonlocal downloads
+            downloads += 1
+            checkpoint.record_image(0, "https://img/0.jpg", str(image))
+            return checkpoint.image_paths()
+
+    async def send_email(user, image_paths, prompt):
+        emails.append(image_paths)
+        return len(emails) > 1  # The first attempt fails
+
+    monkeypatch.setattr(
+        "app.ai.image_downloader.PerplexityImageDownloader", FakeDownloader
+    )
+    monkeypatch.setattr(service, "_send_images_to_user_email", send_email)
+    monkeypatch.setattr(request_service_module.downloads_collector, "track", lambda folder: None)
+    monkeypatch.setattr(request_service_module.settings, "rendition_enabled", False)
+
+    request = await service.create_request(
+        SearchRequest(user=user.id, n=1, prompt="cats", mode="sync")
+    )
+    assert request.status == "done_with_errors"
+
+    # A fresh service, as after a restart: state comes from the checkpoint
+    restarted = RequestService()
+    restarted._db_manager = service.db_manager
+    monkeypatch.setattr(restarted, "_send_images_to_user_email", send_email)
+    stored = await restarted.get_request(request.request_id)
+    assert stored.status == "done_with_errors"
+
+    await restarted.resume_request(request.request_id)
+    await restarted._jobs[request.request_id]
+    resumed = await restarted.get_request(request.request_id)
+
+    assert resumed.status == "done"
+    assert len(resumed.images) == 1
+    assert downloads == 1
+    assert emails == [[str(image)], [str(image)]]
+
+    # Delivered requests are not sent again
+    await restarted.resume_request(request.request_id)
+    assert request.request_id not in restarted._jobs
+
+
+@pytest.mark.asyncio
+async def test_queued_request_keeps_its_lease(tmp_path, monkeypatch):
+    monkeypatch.setattr(request_service_module.settings, "checkpoint_lease_seconds", 0.3)
+    # One bulk worker: the first request holds it, the second waits
+    scheduler = JobScheduler(
+        {"interactive": 1, "small": 1, "bulk": 1}, quantum=10,
+        small_job_max_images=10, max_queued=10
+    )
+    monkeypatch.setattr(request_service_module, "job_scheduler", scheduler)
+    service = RequestService()
+    service._db_manager = DatabaseManager(str(tmp_path / "users.db"))
+    user = User(
+        id=uuid4(), user_name="queued", user_mail="queued@example.com",
+        created_at=datetime.utcnow()
+    )
+    service.db_manager.create_user(user)
+    release = asyncio.Event()
+
+    async def slow_stage(request, checkpoint, user):
+        await release.wait()
+        request.status = "done"
+
+    monkeypatch.setattr(service, "_process_request", slow_stage)
+    await service.startup()
+    try:
+        running = await service.create_request(SearchRequest(user=user.id, n=20, prompt="cats"))
+        queued = await service.create_request(SearchRequest(user=user.id, n=20, prompt="dogs"))
+        await asyncio.sleep(1.0)  # Both outlive the lease
+        assert scheduler.queued() == 1
+
+        # Another worker starting now must not take them over
+        other = DatabaseManager(str(tmp_path / "users.db"))
+        assert other.claim_interrupted_checkpoints(lease_seconds=0.3) == []
+        restarted = RequestService()
+        restarted._db_manager = other
+        for request in (running, queued):
+            with pytest.raises(RequestBusy):
+                await restarted.resume_request(request.request_id)
+    finally:
+        release.set()
+        await service.drain(5)
+        service.release_unfinished()
+        await scheduler.stop()
@@ -0,0 +1,62 @@
+import os
+
+from app.ai.checkpoints import RequestCheckpoint
+from app.core.config import settings
+from app.db.database import DatabaseManager
+from app.utils.download_layout import (
+    iter_request_folders, migrate, request_folder
+)
+
+
+def test_sharded_request_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "downloads_layout", "sharded")
+    monkeypatch.setattr(settings, "downloads_shard_depth", 2)
+    monkeypatch.setattr(settings, "downloads_shard_width", 2)
+
+    path = request_folder("alice", "req-1", root=str(tmp_path))
+    parts = os.path.relpath(path, tmp_path).split(os.sep)
+    assert len(parts) == 3 and parts[-1] == "req-1"
+    assert all(len(part) == 2 for part in parts[:2])
+    # Stable for a request ID, independent of the user
+    assert request_folder("bob", "req-1", root=str(tmp_path)) == path
+
+    monkeypatch.setattr(settings, "downloads_layout", "flat")
+    assert request_folder("alice", "req-1", root=str(tmp_path)) == str(
+        tmp_path / "alice" / "req-1"
+    )
+
+
+def test_migrate_flat_tree(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "downloads_layout", "sharded")
+    root = tmp_path / "downloads"
+    for user, request_id in [("alice", "r1"), ("alice", "r2"), ("bob", "r3")]:
+        folder = root / user / request_id
+        folder.mkdir(parents=True)
+        (folder / "img_01.jpg").write_bytes(b"x")
+    (root / ".renditions").mkdir()
+
+    db = DatabaseManager(str(tmp_path / "test.db"))
+    checkpoint = RequestCheckpoint("r2", status="done")
+    checkpoint.record_image(0, "https://img/0.jpg", str(root / "alice" / "r2" / "img_01.jpg"))
+    checkpoint.complete("downloads")
+    db.save_checkpoint(checkpoint)
+    assert migrate(str(root), db_manager=db, dry_run=True) == 3
+    assert (root / "alice" / "r1").exists()
+
+    assert migrate(str(root), db_manager=db) == 3
+    assert sorted(os.listdir(root)) == sorted(
+        [".renditions"] + list({
+            os.path.relpath(request_folder("", r, str(root)), root).split(os.sep)[0]
+            for r in ("r1", "r2", "r3")
+        })
+    )
+
+    target = request_folder("alice", "r2", str(root))
+    assert os.path.exists(os.path.join(target, "img_01.jpg"))
+    assert db.get_request_folder("r2") == target
+    assert db.get_checkpoint("r2").image_paths() == [os.path.join(target, "img_01.jpg")]
+
+    folders = list(iter_request_folders(str(root)))
+    assert len(folders) == 3 and all(sharded for _, sharded in folders)
+    # Running it again has nothing left to do
+    assert migrate(str(root), db_manager=db) == 0
@@ -0,0 +1,159 @@
+import asyncio
+import os
+import time
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+
+from app.ai.checkpoints import RequestCheckpoint
+from app.ai.image_downloader import (
+    DownloadRejected, PerplexityImageDownloader
+)
+from app.core.config import settings
+
+
+@pytest.fixture
+def downloader_env(monkeypatch, tmp_path):
+    monkeypatch.setenv("PERPLEXITY_API_KEY", "test-key")
+    for key in ("UNSPLASH_ACCESS_KEY", "PEXELS_API_KEY", "BING_SEARCH_API_KEY"):
+        monkeypatch.delenv(key, raising=False)
+    # Keep downloads/ out of the working tree
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.mark.asyncio
+async def test_downloads_start_before_search_finishes(downloader_env):
+    events = []
+
+    async def slow_urls():
+        for i in range(3):
+            events.append(("found", i))
+            yield f"https://img/{i}.jpg"
+            await asyncio.sleep(0.05)
+
+    async with PerplexityImageDownloader() as downloader:
+        original = downloader._download_image
+
+        async def recording_download(i, url, folder_path):
+            events.append(("download", i))
+            return await original(i, url, folder_path)
+
+        downloader._download_image = recording_download
+        paths = await downloader.run_download_pipeline(slow_urls(), "user", "req")
+
+    # The first image is downloaded before the second URL is discovered
+    assert events.index(("download", 0)) < events.index(("found", 1))
+    assert [os.path.basename(p) for p in paths] == [
+        "black_square_img_01.jpg", "black_square_img_02.jpg",
+        "black_square_img_03.jpg"
+    ]
+    assert downloader.last_pipeline_stats["images"] == 3
+    assert (
+        downloader.last_pipeline_stats["time_to_first_image"]
+        < downloader.last_pipeline_stats["total_time"]
+    )
+
+
+@pytest.mark.asyncio
+async def test_search_and_download_with_streamed_terms(downloader_env, monkeypatch):
+    async def fake_terms(self, query):
+        yield "first term"
+        yield "second term"
+
+    monkeypatch.setattr(
+        PerplexityImageDownloader, "stream_search_terms_from_perplexity", fake_terms
+    )
+
+    started = time.monotonic()
+    async with PerplexityImageDownloader() as downloader:
+        paths = await downloader.search_and_download_images(
+            "query", 5, "user", "req"
+        )
+
+    assert time.monotonic() - started < 5
+    assert len(paths) == 5
+    assert all(os.path.exists(path) for path in paths)
+
+
+@pytest_asyncio.fixture
+async def image_server():
+    async def image(request):
+        return web.Response(body=b"\xff\xd8\xff" + b"x" * 5000, content_type="image/jpeg")
+
+    async def html(request):
+        return web.Response(text="<html></html>", content_type="text/html")
+
+    async def endless(request):
+        # Chunked body without Content-Length that never ends
+        response = web.StreamResponse(headers={"Content-Type": "image/png"})
+        await response.prepare(request)
+        while True:
+            await response.write(b"x" * 4096)
+
+    app = web.Application()
+    app.router.add_get("/image.jpg", image)
+    app.router.add_get("/page", html)
+    app.router.add_get("/endless", endless)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    yield f"http://127.0.0.1:{port}"
+    await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_stream_image_caps_and_content_type(downloader_env, image_server, monkeypatch):
+    monkeypatch.setattr(settings, "max_image_bytes", 4096 * 8)
+    monkeypatch.setattr(settings, "download_chunk_size", 1024)
+
+    async with PerplexityImageDownloader() as downloader:
+        folder = downloader._request_folder("user", "req")
+
+        image = await downloader._stream_image(0, f"{image_server}/image.jpg", folder)
+        assert image.bytes == 5003 and not image.placeholder
+        assert os.path.basename(image.path) == "img_01.jpg"
+
+        with pytest.raises(DownloadRejected, match="Content-Type"):
+            await downloader._stream_image(1, f"{image_server}/page", folder)
+        with pytest.raises(DownloadRejected, match="exceeds"):
+            await downloader._stream_image(2, f"{image_server}/endless", folder)
+
+        monkeypatch.setattr(settings, "max_image_bytes", 1000)
+        with pytest.raises(DownloadRejected, match="Content-Length"):
+            await downloader._stream_image(3, f"{image_server}/image.jpg", folder)
+
+    # No partial files are left behind
+    assert os.listdir(folder) == ["img_01.jpg"]
+
+
+@pytest.mark.asyncio
+async def test_failed_downloads_are_replaced_by_spare_urls(downloader_env, image_server, monkeypatch):
+    monkeypatch.setattr(settings, "download_real_images", True)
+    monkeypatch.setattr(settings, "image_validation_enabled", False)
+    monkeypatch.setattr(settings, "download_concurrency", 1)
+    urls = [f"{image_server}/page"] + [f"{image_server}/image.jpg?{i}" for i in range(3)]
+    checkpoint = RequestCheckpoint("req", num_images=2)
+
+    async with PerplexityImageDownloader() as downloader:
+        paths = await downloader.run_download_pipeline(urls, "user", "req", 2, checkpoint)
+        stats = downloader.last_pipeline_stats
+
+    # No placeholder stands in for the HTML page; the next URL does
+    assert [os.path.basename(path) for path in paths] == ["img_02.jpg", "img_03.jpg"]
+    assert stats["rejected"] == 1
+    assert checkpoint.tried[:3] == urls[:3]
+    assert [url for _, url, _ in checkpoint.images] == urls[1:3]
+
+    async with PerplexityImageDownloader() as downloader:
+        folder = downloader._request_folder("user", "other")
+        assert await downloader._download_image(0, f"{image_server}/page", folder) is None
+        # Mock URLs still get placeholders
+        image = await downloader._download_image(
+            1, "https://example-images.com/search?q=x&img=1.jpg", folder
+        )
+    assert image.placeholder
+    assert os.path.basename(image.path) == "black_square_img_02.jpg"
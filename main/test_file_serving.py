@@ -0,0 +1,162 @@
+import io
+import os
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.ai.checkpoints import RequestCheckpoint
+from app.core.config import settings
+from app.db.database import DatabaseManager
+from app.main import app
+from app.utils.bundles import build_bundle
+from app.services.request_service import request_service
+from app.utils.file_response import parse_range
+
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+
+@pytest.fixture
+def finished_request(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "downloads_dir", str(tmp_path / "downloads"))
+    folder = tmp_path / "downloads" / "user" / "req"
+    folder.mkdir(parents=True)
+    paths = []
+    for i in range(3):
+        path = folder / f"img_{i + 1:02d}.jpg"
+        path.write_bytes(bytes([i]) * 1000)
+        paths.append(str(path))
+
+    request_id = uuid.uuid4()
+    request_service._request_files[request_id] = paths
+    yield request_id
+    del request_service._request_files[request_id]
+
+
+def test_parse_range():
+    assert parse_range("bytes=0-9", 100) == (0, 9)
+    assert parse_range("bytes=90-", 100) == (90, 99)
+    assert parse_range("bytes=-10", 100) == (90, 99)
+    assert parse_range("bytes=50-500", 100) == (50, 99)
+    # Malformed or multiple ranges fall back to the full file
+    assert parse_range("bytes=a-b", 100) is None
+    assert parse_range("bytes=0-1,5-6", 100) is None
+    with pytest.raises(ValueError):
+        parse_range("bytes=100-", 100)
+
+
+def test_bundle_download_with_ranges(client, finished_request):
+    url = f"/v1/requests/{finished_request}/bundle"
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/zip"
+    assert response.headers["accept-ranges"] == "bytes"
+    body = response.content
+    with zipfile.ZipFile(io.BytesIO(body)) as archive:
+        assert archive.namelist() == ["img_01.jpg", "img_02.jpg", "img_03.jpg"]
+        assert archive.read("img_02.jpg") == b"\x01" * 1000
+
+    # Resuming a download
+    partial = client.get(url, headers={"Range": "bytes=100-"})
+    assert partial.status_code == 206
+    assert partial.headers["content-range"] == f"bytes 100-{len(body) - 1}/{len(body)}"
+    assert partial.content == body[100:]
+
+    etag = response.headers["etag"]
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    # A stale If-Range validator returns the whole file
+    stale = client.get(url, headers={"Range": "bytes=0-9", "If-Range": '"old"'})
+    assert stale.status_code == 200
+
+    unsatisfiable = client.get(url, headers={"Range": f"bytes={len(body)}-"})
+    assert unsatisfiable.status_code == 416
+
+
+def test_bundle_is_rebuilt_when_images_are_added(client, finished_request):
+    url = f"/v1/requests/{finished_request}/bundle"
+    assert client.get(url).status_code == 200
+
+    # A retry downloaded one more image
+    paths = request_service._request_files[finished_request]
+    added = os.path.join(os.path.dirname(paths[0]), "img_04.jpg")
+    with open(added, "wb") as f:
+        f.write(b"\x03" * 1000)
+    bundle = os.path.join(os.path.dirname(paths[0]), "bundle.zip")
+    os.utime(added, (os.path.getmtime(bundle) + 1,) * 2)
+    paths.append(added)
+
+    with zipfile.ZipFile(io.BytesIO(client.get(url).content)) as archive:
+        assert archive.namelist()[-1] == "img_04.jpg"
+
+
+def test_concurrent_builds_of_one_bundle(finished_request, tmp_path):
+    paths = request_service._request_files[finished_request]
+    (tmp_path / "bundles").mkdir()
+    destination = str(tmp_path / "bundles" / "bundle.zip")
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda _: build_bundle(paths, destination), range(8)))
+
+    assert results == [destination] * 8
+    # No temporary file is left behind
+    assert os.listdir(tmp_path / "bundles") == ["bundle.zip"]
+    with zipfile.ZipFile(destination) as archive:
+        assert archive.testzip() is None
+
+
+def test_bundle_unknown_request(client):
+    response = client.get(f"/v1/requests/{uuid.uuid4()}/bundle")
+    assert response.status_code == 404
+
+
+def test_image_download(client, finished_request, tmp_path):
+    url = f"/v1/requests/{finished_request}/images/1"
+    assert request_service.image_url(finished_request, 1).endswith(url)
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/jpeg"
+    assert "immutable" in response.headers["cache-control"]
+    assert response.content == b"\x01" * 1000
+
+    partial = client.get(url, headers={"Range": "bytes=-10"})
+    assert partial.status_code == 206
+    assert partial.content == b"\x01" * 10
+
+    assert client.get(f"/v1/requests/{finished_request}/images/3").status_code == 404
+
+
+def test_image_outside_downloads_dir_is_not_served(client, finished_request, tmp_path):
+    secret = tmp_path / "secret.jpg"
+    secret.write_bytes(b"secret")
+    request_service._request_files[finished_request].append(str(secret))
+
+    response = client.get(f"/v1/requests/{finished_request}/images/3")
+    assert response.status_code == 404
+
+
+def test_files_of_requests_run_elsewhere(client, finished_request, tmp_path, monkeypatch):
+    db = DatabaseManager(str(tmp_path / "users.db"))
+    monkeypatch.setattr(request_service, "_db_manager", db)
+    # Requests run by another worker or before a restart are not in memory
+    paths = request_service._request_files.pop(finished_request)
+    checkpoint = RequestCheckpoint(str(finished_request), status="done")
+    for i, path in enumerate(paths):
+        checkpoint.record_image(i, f"https://img/{i}.jpg", path)
+    checkpoint.complete("downloads")
+    db.save_checkpoint(checkpoint)
+    # Requests from before checkpoints only have their folder recorded
+    indexed = uuid.uuid4()
+    db.save_request_folder(str(indexed), "user", os.path.dirname(paths[0]))
+
+    for request_id in (finished_request, indexed):
+        response = client.get(f"/v1/requests/{request_id}/images/2")
+        assert response.status_code == 200
+        assert response.content == b"\x02" * 1000
+        assert client.get(f"/v1/requests/{request_id}/bundle").status_code == 200
+    assert request_service._request_files.pop(indexed) == paths
@@ -0,0 +1,74 @@
+import asyncio
+from datetime import datetime
+from uuid import uuid4
+
+import pytest
+
+from app.core.idempotency import IdempotencyKeyReused, IdempotencyStore
+from app.models.user import User
+from app.schemas import SearchRequest
+from app.services.request_service import RequestService
+
+
+@pytest.mark.asyncio
+async def test_store_reserves_each_key_once():
+    # No Redis pool is open in tests, so this runs on the local fallback
+    store = IdempotencyStore(ttl_seconds=60)
+
+    assert await store.reserve("user:key", "first", "body") is None
+    assert await store.reserve("user:key", "second", "body") == "first"
+    with pytest.raises(IdempotencyKeyReused):
+        await store.reserve("user:key", "third", "other body")
+
+    await store.release("user:key")
+    assert await store.reserve("user:key", "fourth", "body") is None
+
+
+class FakeDatabase:
+    def __init__(self, user):
+        self.user = user
+
+    def get_user_by_id(self, user_id):
+        return self.user if user_id == str(self.user.id) else None
+
+    def save_checkpoint(self, checkpoint, lease_seconds=0):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_retried_submission_reuses_the_request():
+    user = User(
+        id=uuid4(), user_name="retry", user_mail="retry@example.com",
+        created_at=datetime.utcnow()
+    )
+    service = RequestService()
+    service._db_manager = FakeDatabase(user)
+
+    runs = 0
+    release = asyncio.Event()
+
+    async def process(request, checkpoint, user):
+        nonlocal runs
+        runs += 1
+        await release.wait()
+        request.status = "done"
+
+    service._process_request = process
+    request_data = SearchRequest(user=user.id, n=2, prompt="cats")
+
+    first = await service.create_request(request_data, "key-1")
+    retry = await service.create_request(request_data, "key-1")
+    assert retry.request_id == first.request_id
+
+    # A sync retry waits for the original job
+    release.set()
+    sync_retry = await service.create_request(
+        request_data.model_copy(update={"mode": "sync"}), "key-1"
+    )
+    assert sync_retry.request_id == first.request_id
+    assert sync_retry.status == "done"
+    assert runs == 1
+
+    other = await service.create_request(request_data, "key-2")
+    assert other.request_id != first.request_id
+    await service.drain(1)
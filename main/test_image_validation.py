@@ -0,0 +1,88 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.ai.image_downloader import DownloadedImage, PerplexityImageDownloader
+from app.ai.image_validation import (
+    PerceptualDeduplicator, dhash, hamming_distance, phash, validate_and_hash
+)
+
+
+def pattern_image(path, size=(200, 150), flip=False, fmt="JPEG"):
+    # A few low-frequency waves, so the pattern survives resizing
+    x = np.linspace(0, 1, size[0])
+    y = np.linspace(0, 1, size[1])[:, None]
+    pixels = 127 + 60 * np.sin(2 * np.pi * (x * 1.3 + y * 0.4)) \
+        + 60 * np.cos(2 * np.pi * (y * 1.7 - x * 0.6))
+    pixels = pixels.astype(np.uint8)
+    if flip:
+        pixels = pixels[:, ::-1]
+    Image.fromarray(pixels).convert("RGB").save(path, fmt)
+    return str(path)
+
+
+def test_validate_reads_header_dimensions(tmp_path):
+    jpeg = validate_and_hash(pattern_image(tmp_path / "a.jpg"))
+    png = validate_and_hash(
+        pattern_image(tmp_path / "a.png", size=(120, 90), fmt="PNG")
+    )
+
+    assert (jpeg.valid, jpeg.format, jpeg.width, jpeg.height) == (
+        True, "jpeg", 200, 150
+    )
+    assert (png.valid, png.format, png.width, png.height) == (
+        True, "png", 120, 90
+    )
+
+
+def test_validate_rejects_broken_files(tmp_path):
+    html = tmp_path / "page.jpg"
+    html.write_bytes(b"<html>Not found</html>")
+    tiny = pattern_image(tmp_path / "tiny.png", size=(16, 16), fmt="PNG")
+
+    assert not validate_and_hash(str(html)).valid
+    assert "too small" in validate_and_hash(tiny).error
+
+
+@pytest.mark.parametrize("hash_function", [dhash, phash])
+def test_resized_copy_is_a_near_duplicate(tmp_path, hash_function):
+    original = hash_function(pattern_image(tmp_path / "a.jpg"))
+    resized = hash_function(pattern_image(tmp_path / "b.jpg", size=(400, 300)))
+    flipped = hash_function(pattern_image(tmp_path / "c.jpg", flip=True))
+
+    assert hamming_distance(original, resized) <= 6
+    assert hamming_distance(original, flipped) > 6
+
+    deduplicator = PerceptualDeduplicator(threshold=6)
+    assert deduplicator.add(original)
+    assert not deduplicator.add(resized)
+    assert deduplicator.add(flipped)
+
+
+@pytest.mark.asyncio
+async def test_pipeline_replaces_duplicates(monkeypatch, tmp_path):
+    monkeypatch.setenv("PERPLEXITY_API_KEY", "test-key")
+    monkeypatch.chdir(tmp_path)
+
+    async def fake_download(self, i, url, folder_path):
+        # The "dup" URL is a resized copy of the first image
+        os.makedirs(folder_path, exist_ok=True)
+        path = os.path.join(folder_path, f"img_{i}.jpg")
+        if url.endswith("dup"):
+            pattern_image(path, size=(300, 225))
+        else:
+            pattern_image(path, flip=bool(i))
+        return DownloadedImage(url, path)
+
+    monkeypatch.setattr(PerplexityImageDownloader, "_download_image", fake_download)
+    urls = ["https://a/0", "https://a/1dup", "https://a/2", "https://a/3"]
+
+    async with PerplexityImageDownloader() as downloader:
+        paths = await downloader.run_download_pipeline(urls, "user", "req", 2)
+
+    assert [os.path.basename(path) for path in paths] == ["img_0.jpg", "img_2.jpg"]
+    assert downloader.last_pipeline_stats["rejected"] == 1
+    # Rejected files are removed from the request folder
+    assert not os.path.exists(os.path.join(os.path.dirname(paths[0]), "img_1.jpg"))
@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+
+# Cumulative import time allowed for app.main, in milliseconds; FastAPI
+# itself accounts for most of it
+IMPORT_BUDGET_MS = float(os.environ.get("IMPORT_TIME_BUDGET_MS", 1000))
+
+# Only needed once a request is processed; loaded in the lifespan or lazily
+LAZY_MODULES = ["aiohttp", "smtplib", "email.mime", "PIL", "numpy", "boto3", "redis",
+                "aio_pika"]
+
+
+def import_times(module, cwd):
+    """Run python -X importtime and return {module: cumulative microseconds}"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd, capture_output=True, text=True, check=True,
+        env=dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__))),
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_app_import_is_lazy_and_within_budget(tmp_path):
+    times = import_times("app.main", cwd=tmp_path)
+
+    loaded = [
+        name for name in times
+        if any(name == lazy or name.startswith(lazy + ".") for lazy in LAZY_MODULES)
+    ]
+    assert loaded == []
+    # The database is opened in the lifespan, not at import
+    assert not (tmp_path / "users.db").exists()
+    assert times["app.main"] / 1000 < IMPORT_BUDGET_MS
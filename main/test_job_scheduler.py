@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from app.services.job_scheduler import FairQueue, Job, JobScheduler
+
+
+def make_job(user, cost, lane="bulk"):
+    return Job(user, cost, lane, func=None, future=None)
+
+
+def test_fair_queue_interleaves_users_by_cost():
+    queue = FairQueue(quantum=10)
+    for _ in range(3):
+        queue.push(make_job("heavy", 50))
+    for _ in range(3):
+        queue.push(make_job("light", 5))
+
+    order = [queue.pop().user for _ in range(6)]
+
+    # light gets two 5-image jobs per 10-image quantum while heavy
+    # saves up for its first 50-image job
+    assert order[:3] == ["light", "light", "light"]
+    assert order[3:] == ["heavy"] * 3
+    assert queue.pop() is None
+    assert len(queue) == 0
+
+
+def test_fair_queue_keeps_fifo_per_user():
+    queue = FairQueue(quantum=1)
+    jobs = [make_job("a", 1) for _ in range(3)]
+    for job in jobs:
+        queue.push(job)
+    assert [queue.pop() for _ in range(3)] == jobs
+
+
+@pytest.mark.asyncio
+async def test_small_jobs_are_not_blocked_by_a_heavy_backlog():
+    scheduler = JobScheduler(
+        workers={"interactive": 1, "small": 1, "bulk": 1},
+        quantum=10, small_job_max_images=10, max_queued=100
+    )
+    release = asyncio.Event()
+    finished = []
+
+    def job(name):
+        async def run():
+            await release.wait()
+            finished.append(name)
+            return name
+        return run
+
+    # The bulk worker picks up one heavy job and blocks on it; the rest
+    # of the backlog stays queued
+    heavy = [
+        await scheduler.submit("heavy", 50, "async", job(f"heavy-{i}"))
+        for i in range(5)
+    ]
+    small = await scheduler.submit("light", 3, "async", job("small"))
+    interactive = await scheduler.submit("light", 3, "sync", job("sync"))
+
+    await asyncio.sleep(0.01)
+    release.set()
+    assert await asyncio.wait_for(small, 1) == "small"
+    assert await asyncio.wait_for(interactive, 1) == "sync"
+    assert finished.index("small") < finished.index("heavy-1")
+
+    await asyncio.wait_for(asyncio.gather(*heavy), 1)
+    await scheduler.stop()
+
+
+@pytest.mark.asyncio
+async def test_submit_rejects_when_queue_is_full():
+    scheduler = JobScheduler(
+        workers={"interactive": 1, "small": 1, "bulk": 1},
+        quantum=10, small_job_max_images=10, max_queued=1
+    )
+    blocker = asyncio.Event()
+
+    async def wait():
+        await blocker.wait()
+
+    await scheduler.submit("a", 50, "async", wait)
+    await asyncio.sleep(0)  # The bulk worker takes the first job
+    await scheduler.submit("a", 50, "async", wait)
+    with pytest.raises(asyncio.QueueFull):
+        await scheduler.submit("a", 50, "async", wait)
+
+    await scheduler.stop()
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import time
+
+import pytest
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+
+from app.core.config import settings
+from app.core.loop_monitor import (
+    BACKGROUND, LoopMonitor, LoopMonitorMiddleware, loop_blocked_total
+)
+
+
+def blocking_call():
+    time.sleep(0.3)
+
+
+@pytest.mark.asyncio
+async def test_blocking_route_is_reported(caplog):
+    monitor = LoopMonitor(interval=0.02, threshold=0.1)
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def blocking_endpoint(item_id: int):
+        blocking_call()
+        return {"item_id": item_id}
+
+    app.add_middleware(LoopMonitorMiddleware, monitor=monitor)
+    route = "GET /items/{item_id}"
+    before = loop_blocked_total.value(route=route)
+
+    monitor.start(app)
+    try:
+        with caplog.at_level(logging.WARNING, logger="app.core.loop_monitor"):
+            async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+                response = await client.get("/items/7")
+            await asyncio.sleep(0.1)
+    finally:
+        await monitor.stop()
+
+    assert response.status_code == 200
+    assert loop_blocked_total.value(route=route) == before + 1
+    message = caplog.records[-1].getMessage()
+    assert route in message
+    assert "blocking_call" in message and "time.sleep(0.3)" in message
+
+
+@pytest.mark.asyncio
+async def test_background_stall_names_the_task(caplog):
+    monitor = LoopMonitor(interval=0.02, threshold=0.1)
+    before = loop_blocked_total.value(route=BACKGROUND)
+
+    async def image_job():
+        blocking_call()
+
+    monitor.start()
+    try:
+        with caplog.at_level(logging.WARNING, logger="app.core.loop_monitor"):
+            await asyncio.sleep(0.05)
+            await asyncio.create_task(image_job())
+            await asyncio.sleep(0.1)
+    finally:
+        await monitor.stop()
+
+    assert loop_blocked_total.value(route=BACKGROUND) == before + 1
+    assert "image_job" in caplog.records[-1].getMessage()
+
+
+@pytest.mark.asyncio
+async def test_stall_right_after_a_beat_is_reported():
+    # Default settings, and a longer interval, which is capped
+    for interval in (settings.loop_monitor_interval_seconds, 0.25):
+        monitor = LoopMonitor(interval, settings.loop_monitor_threshold_seconds)
+        before = loop_blocked_total.value(route=BACKGROUND)
+
+        monitor.start()
+        try:
+            beat = monitor._heartbeat.last_beat
+            while monitor._heartbeat.last_beat == beat:
+                await asyncio.sleep(0.001)
+            await asyncio.sleep(0.01)
+            blocking_call()
+            await asyncio.sleep(0.1)
+        finally:
+            await monitor.stop()
+
+        assert loop_blocked_total.value(route=BACKGROUND) == before + 1
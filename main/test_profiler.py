@@ -0,0 +1,53 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.core.profiler import SamplingProfiler
+from app.main import app
+
+
+def blocking_call():
+    time.sleep(0.3)
+
+
+@pytest.mark.asyncio
+async def test_profiler_reports_the_blocking_callback():
+    profiler = SamplingProfiler(interval=0.005, stall_threshold=0.1)
+    profiler.start()
+    await asyncio.sleep(0.05)
+    blocking_call()
+    await asyncio.sleep(0.05)
+    await profiler.stop()
+
+    assert profiler.samples > 0
+    assert "blocking_call (test_profiler.py:" in profiler.collapsed()
+    stall = profiler.report()["stalls"][0]
+    assert stall["duration_seconds"] >= 0.2
+    assert "blocking_call" in stall["stack"]
+    assert profiler.report()["loop_lag_seconds"]["max"] >= 0.2
+
+
+def test_profile_endpoint_requires_admin(monkeypatch):
+    client = TestClient(app)
+    monkeypatch.setattr(settings, "admin_token", "secret")
+    monkeypatch.setattr(settings, "profiler_enabled", True)
+
+    assert client.get("/v1/admin/profile").status_code == 403
+    assert client.get(
+        "/v1/admin/profile", headers={"Authorization": "Bearer wrong"}
+    ).status_code == 403
+
+    response = client.get(
+        "/v1/admin/profile", params={"seconds": 0.2, "format": "json"},
+        headers={"Authorization": "Bearer secret"}
+    )
+    assert response.status_code == 200
+    assert response.json()["samples"] > 0
+
+    monkeypatch.setattr(settings, "profiler_enabled", False)
+    assert client.get(
+        "/v1/admin/profile", headers={"Authorization": "Bearer secret"}
+    ).status_code == 404
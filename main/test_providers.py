@@ -0,0 +1,157 @@
+import asyncio
+import time
+
+import pytest
+
+from app.ai.checkpoints import RequestCheckpoint
+from app.ai.image_downloader import PerplexityImageDownloader
+from app.ai.providers import (
+    ImageSearchProvider, MockProvider, PerplexityImagesProvider,
+    aggregate_image_search, extract_perplexity_images, normalize_image_url
+)
+from app.core.config import settings
+
+
+class StaticProvider(ImageSearchProvider):
+    """Returns fixed URLs after a delay, without any network access"""
+
+    hedge = False
+
+    def __init__(self, name, urls, delay=0.0):
+        super().__init__(session=None)
+        self.name = name
+        self.urls = urls
+        self.delay = delay
+
+    async def _fetch(self, term, count, priority):
+        await asyncio.sleep(self.delay)
+        return self.urls[:count]
+
+
+def test_normalize_image_url_ignores_tracking_params():
+    a = "https://images.unsplash.com/photo-1?ixid=abc&w=1080"
+    b = "https://IMAGES.unsplash.com/photo-1?w=1080&ixlib=rb-4"
+    assert normalize_image_url(a) == normalize_image_url(b)
+
+    # Mock URLs differ only in their query and must stay distinct
+    assert normalize_image_url(
+        "https://example-images.com/search?q=x&img=1.jpg"
+    ) != normalize_image_url(
+        "https://example-images.com/search?q=x&img=2.jpg"
+    )
+
+
+@pytest.mark.asyncio
+async def test_aggregate_merges_and_deduplicates():
+    fast = StaticProvider("fast", ["https://a/1", "https://a/2"])
+    slower = StaticProvider(
+        "slower", ["https://a/2", "https://b/1", "https://b/2"], delay=0.01
+    )
+
+    urls = await aggregate_image_search(
+        [fast, slower], ["cats"], num_images=4, deadline=1
+    )
+    assert urls == ["https://a/1", "https://a/2", "https://b/1", "https://b/2"]
+
+
+@pytest.mark.asyncio
+async def test_aggregate_stops_at_deadline():
+    fast = StaticProvider("fast", ["https://a/1"])
+    hanging = StaticProvider("hanging", ["https://b/1"], delay=10)
+
+    started = time.monotonic()
+    urls = await aggregate_image_search(
+        [fast, hanging], ["cats"], num_images=5, deadline=0.1
+    )
+    assert time.monotonic() - started < 1
+    assert urls == ["https://a/1"]
+
+
+@pytest.mark.asyncio
+async def test_aggregate_returns_once_enough_results():
+    fast = StaticProvider("fast", ["https://a/1", "https://a/2"])
+    hanging = StaticProvider("hanging", ["https://b/1"], delay=10)
+
+    started = time.monotonic()
+    urls = await aggregate_image_search(
+        [fast, hanging], ["cats"], num_images=2
+    )
+    assert time.monotonic() - started < 1
+    assert len(urls) == 2
+
+
+@pytest.mark.asyncio
+async def test_mock_provider_urls():
+    urls = await MockProvider(None).search("Blue Sky!", 2, start=3)
+    assert urls == [
+        "https://example-images.com/search?q=blue_sky&img=4.jpg",
+        "https://example-images.com/search?q=blue_sky&img=5.jpg",
+    ]
+
+
+def test_extract_perplexity_images():
+    data = {
+        "images": [
+            {"image_url": "https://x/1.jpg", "origin_url": "https://x"},
+            {"url": "https://x/2.jpg"},
+            "https://x/3.jpg",
+            {},
+        ]
+    }
+    assert extract_perplexity_images(data) == [
+        "https://x/1.jpg", "https://x/2.jpg", "https://x/3.jpg"
+    ]
+
+
+@pytest.mark.asyncio
+async def test_search_falls_back_to_mock_without_keys(monkeypatch):
+    monkeypatch.setenv("PERPLEXITY_API_KEY", "test-key")
+    for key in ("UNSPLASH_ACCESS_KEY", "PEXELS_API_KEY", "BING_SEARCH_API_KEY"):
+        monkeypatch.delenv(key, raising=False)
+
+    async with PerplexityImageDownloader() as downloader:
+        urls = await downloader.search_for_image_urls(["cats", "dogs"], 5)
+
+    assert len(urls) == 5
+    assert len(set(urls)) == 5
+    assert all(url.startswith("https://example-images.com/") for url in urls)
+
+
+@pytest.mark.asyncio
+async def test_single_hop_tops_up_perplexity_images(monkeypatch):
+    monkeypatch.setenv("PERPLEXITY_API_KEY", "test-key")
+    for key in ("UNSPLASH_ACCESS_KEY", "PEXELS_API_KEY", "BING_SEARCH_API_KEY"):
+        monkeypatch.delenv(key, raising=False)
+    monkeypatch.setattr(settings, "image_validation_enabled", False)
+
+    async def fake_search(self, term, count, required=True):
+        return ["https://pplx/1.jpg", "https://pplx/2.jpg"]
+
+    async def no_terms(self, query):
+        raise AssertionError("single-hop mode must not ask for search terms")
+        yield
+
+    monkeypatch.setattr(PerplexityImagesProvider, "search", fake_search)
+    monkeypatch.setattr(
+        PerplexityImageDownloader, "stream_search_terms_from_perplexity", no_terms
+    )
+    downloaded = []
+
+    async def fake_pipeline(image_urls, user_name, request_id, num_images, checkpoint):
+        downloaded.extend(image_urls)
+        return [f"img_{i + 1:02d}.jpg" for i in range(num_images)]
+
+    checkpoint = RequestCheckpoint("req", prompt="cats", num_images=4)
+    async with PerplexityImageDownloader(single_hop=True) as downloader:
+        downloader.run_download_pipeline = fake_pipeline
+        paths = await downloader.search_and_download_images(
+            "cats", 4, "user", "req", checkpoint=checkpoint
+        )
+
+    assert len(paths) == 4
+    assert downloaded[:2] == ["https://pplx/1.jpg", "https://pplx/2.jpg"]
+    assert len(downloaded) == 4
+    assert len(set(downloaded)) == 4
+    # The terms stage is skipped, not just unused
+    assert not checkpoint.done("terms")
+    assert checkpoint.urls == downloaded
@@ -0,0 +1,90 @@
+import time
+
+import pytest
+
+from app.ai.quota_manager import (
+    ProviderLimits, QuotaExhaustedError, QuotaManager,
+    parse_rate_limit_headers
+)
+
+
+def test_parse_rate_limit_headers():
+    now = 1000.0
+
+    parsed = parse_rate_limit_headers(
+        {"X-Ratelimit-Limit": "50", "X-Ratelimit-Remaining": "7"},
+        now, window_seconds=3600
+    )
+    assert parsed == {"remaining": 7, "reset_at": now + 3600}
+
+    parsed = parse_rate_limit_headers(
+        {"x-ratelimit-remaining-requests": "3", "retry-after": "20"},
+        now, window_seconds=60
+    )
+    assert parsed == {"remaining": 3, "reset_at": now + 20}
+
+
+@pytest.mark.asyncio
+async def test_reservations_are_paced():
+    manager = QuotaManager(reserve=0)
+    manager.register("test", ProviderLimits(requests_per_second=20))
+
+    started = time.monotonic()
+    for _ in range(3):
+        await manager.reserve("test")
+    elapsed = time.monotonic() - started
+
+    # Three calls at 20/s need at least two 50ms gaps
+    assert elapsed >= 0.09
+
+
+@pytest.mark.asyncio
+async def test_low_priority_calls_dropped_near_limit():
+    manager = QuotaManager(reserve=2)
+    manager.register("test", ProviderLimits(
+        requests_per_second=1000, requests_per_window=100,
+        window_seconds=0.5
+    ))
+
+    await manager.record_response(
+        "test", 200, {"X-Ratelimit-Remaining": "2"}
+    )
+
+    with pytest.raises(QuotaExhaustedError):
+        await manager.reserve("test", priority=1)
+
+    # High priority calls still use the reserved budget
+    await manager.reserve("test", priority=0)
+
+
+@pytest.mark.asyncio
+async def test_429_blocks_until_reset():
+    manager = QuotaManager(max_wait=0.1)
+    manager.register("test", ProviderLimits(requests_per_second=1000))
+
+    await manager.record_response("test", 429, {"Retry-After": "30"})
+
+    with pytest.raises(QuotaExhaustedError) as exc_info:
+        await manager.reserve("test")
+    assert exc_info.value.retry_after > 25
+
+
+@pytest.mark.asyncio
+async def test_budget_outside_reserve_is_not_stretched():
+    # Unsplash defaults: 50 calls an hour, 5 kept in reserve
+    manager = QuotaManager(reserve=5, max_wait=10.0)
+    manager.register("test", ProviderLimits(
+        requests_per_second=20, requests_per_window=50,
+        window_seconds=3600
+    ))
+
+    for _ in range(4):
+        await manager.reserve("test", priority=0)
+
+    # The reserve is spread over the rest of the window
+    await manager.record_response(
+        "test", 200, {"X-Ratelimit-Remaining": "5"}
+    )
+    await manager.reserve("test", priority=0)
+    with pytest.raises(QuotaExhaustedError):
+        await manager.reserve("test", priority=0)
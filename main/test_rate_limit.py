@@ -0,0 +1,113 @@
+import asyncio
+import uuid
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.core import rate_limit
+from app.core.config import settings
+from app.db.database import DatabaseManager
+from app.models.user import User
+from app.services.job_scheduler import job_scheduler
+from app.services.request_service import request_service
+from app.core.rate_limit import (
+    AdmissionController, InMemoryTokenBucket, RateLimiter
+)
+
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+
+def test_token_bucket_denies_after_capacity():
+    bucket = InMemoryTokenBucket(capacity=3, refill_rate=1.0)
+
+    for _ in range(3):
+        allowed, _ = bucket.hit("user:a")
+        assert allowed
+
+    allowed, retry_after = bucket.hit("user:a")
+    assert not allowed
+    assert 0 < retry_after <= 1.0
+
+    # Other keys have their own bucket
+    allowed, _ = bucket.hit("user:b")
+    assert allowed
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_falls_back_to_memory():
+    # Nothing listens on this port, so the Redis backend must fail over
+    limiter = RateLimiter(
+        capacity=1, window_seconds=60, backend="redis",
+        redis_url="redis://127.0.0.1:1"
+    )
+
+    allowed, _ = await limiter.hit("user:a")
+    assert allowed
+    allowed, retry_after = await limiter.hit("user:a")
+    assert not allowed
+    assert retry_after > 0
+
+
+@pytest.mark.asyncio
+async def test_admission_controller_sheds_when_full():
+    controller = AdmissionController(max_concurrent=1, queue_timeout=0.05)
+
+    assert await controller.acquire()
+    assert not await controller.acquire()
+
+    # A waiter gets the slot handed over on release
+    waiter = asyncio.create_task(controller.acquire())
+    await asyncio.sleep(0)
+    controller.release()
+    assert await waiter
+    assert controller.in_flight == 1
+
+    controller.release()
+    assert controller.in_flight == 0
+
+
+def test_create_request_returns_429_with_retry_after(client, monkeypatch):
+    monkeypatch.setattr(
+        rate_limit, "rate_limiter",
+        RateLimiter(capacity=1, window_seconds=60)
+    )
+
+    request_data = {
+        "user": str(uuid.uuid4()),
+        "n": 1,
+        "prompt": "rate limited query",
+        "mode": "sync"
+    }
+
+    first = client.post("/v1/requests", json=request_data)
+    assert first.status_code == 201
+
+    second = client.post("/v1/requests", json=request_data)
+    assert second.status_code == 429
+    assert int(second.headers["Retry-After"]) >= 1
+
+
+def test_full_scheduler_returns_429_and_records_nothing(client, monkeypatch, tmp_path):
+    db = DatabaseManager(str(tmp_path / "users.db"))
+    user = User(
+        id=uuid.uuid4(), user_name="queued", user_mail="queued@example.com",
+        created_at=datetime.utcnow()
+    )
+    db.create_user(user)
+    monkeypatch.setattr(request_service, "_db_manager", db)
+    monkeypatch.setattr(job_scheduler, "max_queued", 0)
+    requests = len(request_service._requests)
+
+    response = client.post("/v1/requests", json={
+        "user": str(user.id), "n": 1, "prompt": "queued query", "mode": "async"
+    })
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == str(settings.scheduler_retry_after_seconds)
+    assert len(request_service._requests) == requests
+    with db.get_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM request_checkpoints").fetchone()[0] == 0
@@ -0,0 +1,75 @@
+import os
+import shutil
+
+import pytest
+from PIL import Image
+
+from app.ai.renditions import RenditionEngine, RenditionSpec, render
+from app.core.config import settings
+
+
+def noisy_photo(path, size=(1080, 720)):
+    # Random noise so the encoded size depends on the pixel count
+    Image.effect_noise(size, 64).convert("RGB").save(path, "JPEG", quality=90)
+    return str(path)
+
+
+def test_render_resizes_and_caches(tmp_path):
+    source = noisy_photo(tmp_path / "a.jpg")
+    copy = str(tmp_path / "b.jpg")
+    shutil.copyfile(source, copy)
+    cache = str(tmp_path / "cache")
+    spec = RenditionSpec(width=320, format="webp", quality=70)
+
+    first = render(source, cache, spec)
+    mtime = os.path.getmtime(first)
+    # Same content under another name hits the cache
+    assert render(copy, cache, spec) == first
+    assert os.path.getmtime(first) == mtime
+
+    with Image.open(first) as img:
+        assert img.format == "WEBP"
+        assert img.size == (320, 213)
+    assert os.path.getsize(first) * 3 < os.path.getsize(source)
+
+    # A different spec is a different cache entry
+    assert render(source, cache, RenditionSpec(width=320, format="jpeg")) != first
+
+
+def test_render_never_upscales(tmp_path):
+    source = noisy_photo(tmp_path / "small.jpg", size=(200, 100))
+    rendition = render(source, str(tmp_path / "cache"), RenditionSpec(width=640))
+    with Image.open(rendition) as img:
+        assert img.size == (200, 100)
+
+
+@pytest.mark.asyncio
+async def test_engine_keeps_order_and_non_images(tmp_path):
+    folder = tmp_path / "downloads" / "user" / "req"
+    folder.mkdir(parents=True)
+    images = [noisy_photo(folder / f"img_{i:02d}.jpg") for i in range(1, 4)]
+    note = folder / "perplexity_error_img_04.txt"
+    note.write_text("Error downloading image")
+
+    engine = RenditionEngine(cache_dir=str(tmp_path / "cache"), batch_size=2)
+    delivered = await engine.create_renditions(
+        images + [str(note)], RenditionSpec(width=320)
+    )
+
+    assert [os.path.basename(path) for path in delivered] == [
+        "img_01.webp", "img_02.webp", "img_03.webp",
+        "perplexity_error_img_04.txt"
+    ]
+    assert all(
+        os.path.dirname(path) == str(folder / "renditions")
+        for path in delivered[:3]
+    )
+
+
+def test_cache_defaults_to_downloads_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "downloads_dir", str(tmp_path / "files"))
+    monkeypatch.setattr(settings, "rendition_cache_dir", None)
+    assert RenditionEngine().cache_dir == str(tmp_path / "files" / ".renditions")
+
+    monkeypatch.setattr(settings, "rendition_cache_dir", str(tmp_path / "cache"))
+    assert RenditionEngine().cache_dir == str(tmp_path / "cache")
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from app.ai.resilience import (
+    CircuitBreaker, CircuitOpenError, LatencyTracker, hedged
+)
+
+
+async def failing_call():
+    raise RuntimeError("provider down")
+
+
+async def ok_call():
+    return "ok"
+
+
+@pytest.mark.asyncio
+async def test_circuit_opens_and_fails_fast():
+    breaker = CircuitBreaker("test", failure_threshold=2, recovery_timeout=60)
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            await breaker.call(failing_call)
+
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        await breaker.call(ok_call)
+
+
+@pytest.mark.asyncio
+async def test_half_open_probe_closes_circuit():
+    breaker = CircuitBreaker("test", failure_threshold=1, recovery_timeout=0.05)
+
+    with pytest.raises(RuntimeError):
+        await breaker.call(failing_call)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    await asyncio.sleep(0.06)
+    assert await breaker.call(ok_call) == "ok"
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_failed_probe_reopens_circuit():
+    breaker = CircuitBreaker("test", failure_threshold=1, recovery_timeout=0.05)
+
+    with pytest.raises(RuntimeError):
+        await breaker.call(failing_call)
+    await asyncio.sleep(0.06)
+
+    with pytest.raises(RuntimeError):
+        await breaker.call(failing_call)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+@pytest.mark.asyncio
+async def test_hedged_returns_fastest_attempt():
+    started = []
+
+    async def call(attempt):
+        started.append(attempt)
+        # The first attempt hangs, the hedge answers quickly
+        await asyncio.sleep(5 if attempt == 0 else 0.01)
+        return attempt
+
+    result = await asyncio.wait_for(hedged(call, hedge_after=0.02), 1)
+    assert result == 1
+    assert started == [0, 1]
+
+
+@pytest.mark.asyncio
+async def test_hedged_without_threshold_makes_single_call():
+    calls = []
+
+    async def call(attempt):
+        calls.append(attempt)
+        return "done"
+
+    assert await hedged(call, hedge_after=None) == "done"
+    assert calls == [0]
+
+
+def test_latency_tracker_percentile():
+    tracker = LatencyTracker(min_samples=10)
+    assert tracker.percentile(95) is None
+
+    for i in range(100):
+        tracker.record(i / 100)
+    assert tracker.percentile(95) == pytest.approx(0.95)
@@ -0,0 +1,95 @@
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pytest
+
+from app.services.request_service import RequestService
+
+RUN_SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "run_server.py")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.mark.asyncio
+async def test_drain_waits_for_active_jobs():
+    service = RequestService()
+    service._active_jobs = 1
+
+    async def finish_job():
+        await asyncio.sleep(0.2)
+        service._active_jobs -= 1
+
+    task = asyncio.create_task(finish_job())
+    assert await service.drain(timeout=5)
+    await task
+
+    service._active_jobs = 1
+    assert not await service.drain(timeout=0.1)
+
+
+def test_prefork_server_serves_and_drains(tmp_path):
+    port = free_port()
+    env = dict(os.environ, DRAIN_TIMEOUT_SECONDS="2", RETENTION_ENABLED="false")
+    process = subprocess.Popen(
+        [sys.executable, RUN_SERVER, "--workers", "2",
+         "--host", "127.0.0.1", "--port", str(port)],
+        # The server creates its database in the working directory
+        cwd=tmp_path,
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                url = f"http://127.0.0.1:{port}/v1/health"
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    assert response.status == 200
+                    break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.2)
+
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=20) == 0
+    finally:
+        if process.poll() is None:
+            process.kill()
+
+
+@pytest.mark.skipif(not hasattr(socket, "SO_REUSEPORT"), reason="needs SO_REUSEPORT")
+def test_crash_looping_worker_stops_the_server(tmp_path):
+    # Workers bind the port themselves and fail while another socket has it
+    with socket.socket() as blocker:
+        blocker.bind(("127.0.0.1", 0))
+        blocker.listen()
+        port = blocker.getsockname()[1]
+        env = dict(
+            os.environ, RETENTION_ENABLED="false",
+            SERVER_RESTART_BACKOFF_SECONDS="0.1", SERVER_MAX_RESTARTS="2"
+        )
+        process = subprocess.Popen(
+            [sys.executable, RUN_SERVER, "--workers", "1",
+             "--host", "127.0.0.1", "--port", str(port)],
+            cwd=tmp_path,
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+        )
+        try:
+            _, stderr = process.communicate(timeout=60)
+        finally:
+            if process.poll() is None:
+                process.kill()
+
+    assert process.returncode == 1
+    assert stderr.count("restarting in") == 2
+    assert "3 crashes in a row, giving up" in stderr
@@ -0,0 +1,125 @@
+import io
+import os
+import urllib.request
+import uuid
+import zipfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.ai.checkpoints import RequestCheckpoint
+from app.api import routes
+from app.core.config import settings
+from app.main import app
+from app.services import request_service as request_service_module
+from app.services.request_service import request_service
+from app.utils.storage import LocalStorage, S3Storage, key_for
+
+
+def test_key_for(tmp_path):
+    root = tmp_path / "downloads"
+    assert key_for(str(root / "ab" / "cd" / "req" / "img.jpg"), str(root)) == "ab/cd/req/img.jpg"
+    with pytest.raises(ValueError):
+        key_for(str(tmp_path / "elsewhere.jpg"), str(root))
+
+
+@pytest.mark.asyncio
+async def test_local_storage(tmp_path):
+    root = tmp_path / "downloads"
+    source = tmp_path / "upload.jpg"
+    source.write_bytes(b"image")
+    storage = LocalStorage(str(root))
+
+    await storage.save_file(str(source), "req/img.jpg")
+    assert await storage.read("req/img.jpg") == b"image"
+    assert storage.presigned_url("req/img.jpg") is None
+    with pytest.raises(ValueError):
+        storage.path_for("../outside.jpg")
+
+
+@pytest.mark.asyncio
+async def test_local_storage_follows_downloads_dir(tmp_path, monkeypatch):
+    storage = LocalStorage()
+    monkeypatch.setattr(settings, "downloads_dir", str(tmp_path / "downloads"))
+    image = tmp_path / "downloads" / "req" / "img.jpg"
+    image.parent.mkdir(parents=True)
+    image.write_bytes(b"image")
+
+    # The file is its own stored copy; nothing is written elsewhere
+    await storage.save_file(str(image), key_for(str(image)))
+    assert storage.path_for("req/img.jpg") == str(image)
+    assert sorted(p.name for p in tmp_path.rglob("*")) == ["downloads", "img.jpg", "req"]
+
+
+@pytest.fixture
+def s3_server():
+    """Local S3-compatible stand-in (moto), like MinIO in docker-compose"""
+    server_module = pytest.importorskip("moto.server")
+    pytest.importorskip("boto3")
+    server = server_module.ThreadedMotoServer(ip_address="127.0.0.1", port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    yield f"http://{host}:{port}"
+    server.stop()
+
+
+@pytest.mark.asyncio
+async def test_s3_storage_multipart_and_presigned(tmp_path, s3_server):
+    storage = S3Storage(
+        "snapnsend", endpoint_url=s3_server, region="us-east-1",
+        access_key="test", secret_key="test", prefix="images",
+        part_size=5 * 1024 * 1024
+    )
+    storage.client.create_bucket(Bucket="snapnsend")
+
+    # Large enough for a three-part multipart upload
+    payload = os.urandom(11 * 1024 * 1024)
+    source = tmp_path / "big.jpg"
+    source.write_bytes(payload)
+
+    await storage.save_file(str(source), "req/big.jpg", "image/jpeg")
+    head = storage.client.head_object(Bucket="snapnsend", Key="images/req/big.jpg")
+    assert head["ETag"].endswith('-3"')
+    assert head["ContentType"] == "image/jpeg"
+    assert await storage.read("req/big.jpg") == payload
+
+    with urllib.request.urlopen(storage.presigned_url("req/big.jpg")) as response:
+        assert response.read() == payload
+
+
+def test_requests_stored_by_another_node(tmp_path, s3_server, monkeypatch):
+    remote = S3Storage(
+        "snapnsend", endpoint_url=s3_server, region="us-east-1",
+        access_key="test", secret_key="test", prefix="images"
+    )
+    remote.client.create_bucket(Bucket="snapnsend")
+    monkeypatch.setattr(request_service_module, "storage", remote)
+    monkeypatch.setattr(routes, "storage", remote)
+
+    # Another node downloaded and stored the images; none is on this one
+    request_id = uuid.uuid4()
+    checkpoint = RequestCheckpoint(str(request_id), status="done")
+    for i in range(2):
+        path = os.path.join(settings.downloads_dir, "ab", str(request_id), f"img_{i + 1:02d}.jpg")
+        remote.client.put_object(
+            Bucket="snapnsend", Key=f"images/{key_for(path)}", Body=bytes([i]) * 100
+        )
+        checkpoint.record_image(i, f"https://img/{i}.jpg", path)
+    checkpoint.complete("downloads")
+    request_service.db_manager.save_checkpoint(checkpoint)
+
+    client = TestClient(app)
+    try:
+        response = client.get(f"/v1/requests/{request_id}/images/1", follow_redirects=False)
+        assert response.status_code == 307
+        with urllib.request.urlopen(response.headers["location"]) as stored:
+            assert stored.read() == b"\x01" * 100
+
+        # The bundle is built from the stored images, then stored itself
+        response = client.get(f"/v1/requests/{request_id}/bundle", follow_redirects=False)
+        assert response.status_code == 307
+        with urllib.request.urlopen(response.headers["location"]) as stored:
+            with zipfile.ZipFile(io.BytesIO(stored.read())) as archive:
+                assert archive.namelist() == ["img_01.jpg", "img_02.jpg"]
+    finally:
+        request_service._request_files.pop(request_id, None)
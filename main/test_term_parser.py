@@ -0,0 +1,98 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from app.ai.providers import ImageSearchProvider, aggregate_image_search
+from app.ai.term_parser import (
+    StreamingTermParser, iter_sse_content, parse_search_terms
+)
+
+
+def test_streaming_parser_emits_terms_as_they_close():
+    document = '```json\n{"terms": ["red fox", "fox in \\"snow\\"", "arctic fox"]}\n```'
+    parser = StreamingTermParser()
+
+    emitted = []
+    # Feed one character at a time, as a worst case for chunk boundaries
+    for index, ch in enumerate(document):
+        for term in parser.feed(ch):
+            emitted.append((term, index))
+
+    assert [term for term, _ in emitted] == [
+        "red fox", 'fox in "snow"', "arctic fox"
+    ]
+    # The first term is available long before the document is complete
+    assert emitted[0][1] < len(document) // 2
+
+
+def test_streaming_parser_ignores_other_keys():
+    parser = StreamingTermParser()
+    terms = parser.feed(
+        '{"note": "ignore me", "nested": {"terms": 1}, "terms": ["a b c"]}'
+    )
+    assert terms == ["a b c"]
+
+
+def test_streaming_parser_stops_at_max_terms():
+    parser = StreamingTermParser(max_terms=2)
+    terms = parser.feed('{"terms": ["one", "two", "three"]}')
+    assert terms == ["one", "two"]
+    assert parser.done
+
+
+def test_parse_search_terms_numbered_list():
+    assert parse_search_terms("1. mountain lake\n2. alpine sunrise\n\n3. sky") == [
+        "mountain lake", "alpine sunrise"
+    ]
+
+
+class FakeStreamResponse:
+    def __init__(self, lines):
+        self.content = self._iterate(lines)
+
+    async def _iterate(self, lines):
+        for line in lines:
+            yield line
+
+
+@pytest.mark.asyncio
+async def test_iter_sse_content():
+    events = [
+        {"choices": [{"delta": {"content": '{"terms": ['}}]},
+        {"choices": [{"delta": {"content": '"a"]}'}, "message": {"content": "x"}}]},
+    ]
+    lines = [b": keep-alive\n"] + [
+        f"data: {json.dumps(event)}\n".encode() for event in events
+    ] + [b"data: [DONE]\n", b'data: {"choices": [{"delta": {"content": "late"}}]}\n']
+
+    chunks = [chunk async for chunk in iter_sse_content(FakeStreamResponse(lines))]
+    assert chunks == ['{"terms": [', '"a"]}']
+
+
+class EchoProvider(ImageSearchProvider):
+    name = "echo"
+    hedge = False
+
+    def __init__(self):
+        super().__init__(session=None)
+
+    async def _fetch(self, term, count, priority):
+        return [f"https://img/{term}/{i}" for i in range(count)]
+
+
+@pytest.mark.asyncio
+async def test_search_starts_before_terms_stream_ends():
+    async def slow_terms():
+        yield "first"
+        # The rest of the completion takes a long time
+        await asyncio.sleep(10)
+        yield "second"
+
+    started = time.monotonic()
+    urls = await aggregate_image_search(
+        [EchoProvider()], slow_terms(), num_images=3
+    )
+    assert time.monotonic() - started < 1
+    assert urls == ["https://img/first/0", "https://img/first/1", "https://img/first/2"]